@@ -0,0 +1,312 @@
+"""Measures the framework overhead of an agent step for each backend, with scripted LLMs
+
+The LLMs replay a fixed script (see scripted_llm), so what is timed is everything around the
+LLM call: rendering the scratchpad and the prompt, parsing the reply, dispatching the
+callbacks and invoking the tools. For each backend it measures, on the Coder agent:
+
+- scratchpad: fitting the intermediate steps in the budget and converting them
+- prompt: rendering the prompt with the converted scratchpad
+- parse: parsing a tool call reply with the backend's output parser
+- step: a whole planning step, without callbacks
+- callbacks: what the agent callbacks add to a planning step
+- tool / tool_callbacks: reading a file with the tool, and what the callbacks add to it
+
+If the backend has the configs of every agent, it also times whole tasks of the AgentManager
+handing work to the Coder and the Tester, which hands work to the Debugger. Backends whose
+client library isn't installed are skipped.
+
+Each run is appended to `--results` with the commit it ran on, so a change can be compared
+with an earlier commit:
+
+    python -m alfred_ai_backend.benchmarks.agent_loop_benchmark --compare
+    python -m alfred_ai_backend.benchmarks.agent_loop_benchmark --compare --baseline 1a2b3c4
+
+Run it from the folder of config.yml, like the agents.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+from langchain_core.agents import AgentAction
+from alfred_ai_backend.core.Config import Config
+from alfred_ai_backend.benchmarks.scripted_llm import FINAL_ANSWER, ScriptStep, render_reply, scripted_model_type
+import argparse
+import importlib
+import tempfile
+import platform
+import subprocess
+import logging
+import json
+import time
+import sys
+import os
+
+PKG_NAME = "pkg"
+MODULE_PATH = f"{PKG_NAME}/module.py"
+MODULE_SOURCE = '"""A module for the agents to work on"""\n\n\ndef add(a: int, b: int) -> int:\n    return a + b\n' * 20
+SUB_AGENT_INPUT = {'input': "Add a subtract function next to add", 'cwd': ".", 'pkg_name': PKG_NAME}
+
+# The script of each agent by its tool config
+SCRIPTS: Dict[str, List[ScriptStep]] = {
+    'agent_manager_config.yml': [
+        ("list_directory", {'dir_path': PKG_NAME}),
+        ("read_file", {'file_path': MODULE_PATH}),
+        ("Coder", SUB_AGENT_INPUT),
+        ("Tester", {**SUB_AGENT_INPUT, 'input': "Test the subtract function"}),
+        (FINAL_ANSWER, "Added and tested the subtract function"),
+    ],
+    'coder_tool_config.yml': [
+        ("read_file", {'file_path': MODULE_PATH}),
+        ("write_file", {'file_path': MODULE_PATH, 'text': MODULE_SOURCE}),
+        (FINAL_ANSWER, "Wrote the subtract function"),
+    ],
+    'tester_tool_config.yml': [
+        ("read_file", {'file_path': MODULE_PATH}),
+        ("Debugger", {**SUB_AGENT_INPUT, 'input': "Check why subtract is missing a docstring"}),
+        (FINAL_ANSWER, "The tests pass"),
+    ],
+    'debug_tool_config.yml': [
+        ("read_file", {'file_path': MODULE_PATH}),
+        (FINAL_ANSWER, "Nothing to fix"),
+    ],
+}
+
+# Measures that are counts rather than times, so they're never flagged
+COUNTS = {'llm_calls', 'tool_calls'}
+
+
+def time_call(func: Callable[[], Any], repeat: int, number: int) -> float:
+    """Times a call
+
+    Returns:
+        float: The median over `repeat` runs of the mean time of `number` calls, in seconds
+    """
+    func()  # Warm up caches, like the compiled templates
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return sorted(timings)[len(timings) // 2]
+
+
+def make_workspace(folder: str):
+    """Creates the package the agents work on"""
+    Path(folder, PKG_NAME).mkdir(parents=True, exist_ok=True)
+    Path(folder, PKG_NAME, "__init__.py").write_text("")
+    Path(folder, MODULE_PATH).write_text(MODULE_SOURCE)
+
+
+def make_steps(backend: str, parser: Any, count: int, observation_size: int) -> List[Tuple[AgentAction, str]]:
+    """Creates intermediate steps of a backend by parsing its replies, so they have the types its scratchpad expects"""
+    steps = []
+    for i in range(count):
+        step = ("read_file", {'file_path': f"{PKG_NAME}/module_{i}.py"}) if i % 2 == 0 else ("list_directory", {'dir_path': PKG_NAME})
+        actions = parser.invoke(render_reply(backend, step, i))
+        for action in actions if isinstance(actions, list) else [actions]:
+            steps.append((action, f"# module {i}\n" + "x" * observation_size))
+    return steps
+
+
+def benchmark_components(backend: str, model_type: Type, workspace: str, args: argparse.Namespace) -> Dict[str, float]:
+    """Times the parts of a Coder agent step"""
+    from alfred_ai_backend.core.tools.CoderTool import CoderTool
+    from alfred_ai_backend.core.utils.AgentCallbacks import get_agent_callbacks
+
+    coder_tool = CoderTool(scripted_model_type(backend, model_type, SCRIPTS), parent="Benchmark", root_folder=workspace)
+    model = coder_tool._get_model()
+    runnable = model._agent_executor.agent.runnable
+    assign, prompt, parser = runnable.first, runnable.middle[0], runnable.last
+    callbacks = get_agent_callbacks("Coder", "Benchmark", model=model)
+
+    inputs = {
+        'input': SUB_AGENT_INPUT['input'],
+        'pkg_name': PKG_NAME,
+        'chat_history': [],
+        'intermediate_steps': make_steps(backend, parser, args.steps, args.observation_size),
+    }
+    assigned = assign.invoke(inputs)
+    reply = render_reply(backend, ("read_file", {'file_path': MODULE_PATH}), 0)
+    read_file = next(tool for tool in coder_tool._tools if tool.name == "read_file")
+    tool_input = {'file_path': MODULE_PATH}
+
+    def plan_step(config: Optional[Dict[str, Any]] = None):
+        model.get_llm().reset()
+        return runnable.invoke(inputs, config)
+
+    results = {
+        'scratchpad': time_call(lambda: assign.invoke(inputs), args.repeat, args.number),
+        'prompt': time_call(lambda: prompt.invoke(assigned), args.repeat, args.number),
+        'parse': time_call(lambda: parser.invoke(reply), args.repeat, args.number),
+        'step': time_call(plan_step, args.repeat, args.number),
+        'tool': time_call(lambda: read_file.run(tool_input), args.repeat, args.number),
+    }
+    results['callbacks'] = time_call(lambda: plan_step({'callbacks': callbacks}), args.repeat, args.number) - results['step']
+    results['tool_callbacks'] = time_call(lambda: read_file.run(tool_input, callbacks=callbacks), args.repeat, args.number) - results['tool']
+    return results
+
+
+def benchmark_tree(backend: str, model_type: Type, workspace: str, args: argparse.Namespace) -> Dict[str, float]:
+    """Times AgentManager tasks that go through the Coder, the Tester and the Debugger"""
+    from alfred_ai_backend.core.AgentManager import AgentManager
+
+    llms = []
+    agent_manager = AgentManager(scripted_model_type(backend, model_type, SCRIPTS, created=llms.append), root_folder=workspace)
+    usage = {}
+
+    def run_task():
+        for llm in llms:
+            llm.reset()
+        agent_manager.clear_memory()
+        resp = agent_manager.start_task("Add a subtract function to the package and test it")
+        usage.update(resp['usage']['total'])
+
+    task = time_call(run_task, args.repeat, 1)
+    return {
+        'task': task,
+        'per_step': task / max(1, usage['llm_calls']),
+        'llm_calls': usage['llm_calls'],
+        'tool_calls': usage['tool_calls'],
+    }
+
+
+def get_backends(config: Config, only: Optional[List[str]]) -> Dict[str, Tuple[Type, bool]]:
+    """Imports the Model of each backend in the config
+
+    Returns:
+        Dict[str, Tuple[Type, bool]]: The Model of each backend, and whether it has the configs of every agent
+    """
+    backends = {}
+    for name, model_config in (config.get('models') or {}).items():
+        if name == 'default_model' or (only and name not in only):
+            continue
+        try:
+            model_type = getattr(importlib.import_module(model_config['module']), model_config['name'])
+        except ImportError as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+            continue
+        config_folder = Path(sys.modules[model_type.__module__].__file__).parent / 'config'
+        backends[name] = (model_type, all(Path(config_folder, file_name).exists() for file_name in SCRIPTS))
+    return backends
+
+
+def get_commit() -> Tuple[str, bool]:
+    """Gets the commit the benchmark runs on and whether the tree has changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def find_baseline(results_file: Path, commit: str, baseline: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Finds the latest stored run of the baseline commit, or of the latest other commit"""
+    if not results_file.exists():
+        return None
+    found = None
+    with open(results_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            if (baseline and run['commit'].startswith(baseline)) or (not baseline and run['commit'] != commit):
+                found = run
+    return found
+
+
+def print_results(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Optional[Dict[str, Any]], threshold: float) -> int:
+    """Prints the results next to the baseline's
+
+    Returns:
+        int: How many timings got slower than the threshold
+    """
+    regressions = 0
+    print(f"{'backend':<34} {'benchmark':<12} {'measure':<16} {'now':>12} {'baseline':>12} {'change':>8}")
+    for backend, groups in results.items():
+        for group, measures in groups.items():
+            for measure, value in measures.items():
+                old = ((baseline or {}).get('results', {}).get(backend, {}).get(group, {})).get(measure)
+                if measure in COUNTS:
+                    now_text, old_text = f"{value:>12}", f"{old if old is not None else '':>12}"
+                else:
+                    now_text, old_text = f"{value * 1e6:>9.1f} us", f"{old * 1e6:>9.1f} us" if old is not None else f"{'':>12}"
+                change = ""
+                # Differences of callbacks are near zero, so a relative change of them means little
+                if old and measure not in COUNTS and old > 1e-6:
+                    ratio = value / old - 1
+                    change = f"{ratio:+.0%}"
+                    if ratio > threshold:
+                        change += " !"
+                        regressions += 1
+                print(f"{backend:<34} {group:<12} {measure:<16} {now_text} {old_text} {change:>8}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Agent loop overhead benchmark with scripted LLMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--backends", type=str, nargs='+', help="Backends to measure, like openai_api.chat_gpt. Defaults to every one in the config")
+    parser.add_argument("--steps", type=int, default=10, help="Intermediate steps in the scratchpad of the component benchmark")
+    parser.add_argument("--observation_size", type=int, default=2000, help="Characters of each tool observation")
+    parser.add_argument("--repeat", type=int, default=15, help="Runs of each timing, the median is kept")
+    parser.add_argument("--number", type=int, default=20, help="Calls per run of the component timings")
+    parser.add_argument("--log_level", type=str, default="WARNING", help="Level the agents log at, to include the cost of formatting their logs")
+    parser.add_argument("--results", type=str, default=".alfred_bench/agent_loop.jsonl", help="Where the runs are stored")
+    parser.add_argument("--no_save", action='store_true', help="Don't store this run")
+    parser.add_argument("--compare", action='store_true', help="Compare with the latest run of another commit")
+    parser.add_argument("--baseline", type=str, help="The commit to compare with, instead of the latest other one")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown flagged as a regression")
+    parser.add_argument("--fail_on_regression", action='store_true', help="Exit with an error if a timing regressed")
+    args = parser.parse_args()
+
+    # The logs are formatted and written, but nowhere
+    logging.basicConfig(level=getattr(logging, args.log_level), handlers=[logging.StreamHandler(open(os.devnull, 'w'))])
+    config = Config()
+    # Replayed scripts don't need caching, and streaming prints the tokens
+    config.set('llm_cache', {**config.get('llm_cache', {}), 'enabled': False})
+    config.set('streaming', {**config.get('streaming', {}), 'enabled': False})
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    with tempfile.TemporaryDirectory(prefix="alfred_bench_") as workspace, open(os.devnull, 'w') as devnull:
+        make_workspace(workspace)
+        for backend, (model_type, has_every_agent) in get_backends(config, args.backends).items():
+            print(f"Measuring {backend}...", file=sys.stderr)
+            try:
+                # The agents print their status to the console
+                with redirect_stdout(devnull):
+                    results[backend] = {'components': benchmark_components(backend, model_type, workspace, args)}
+                    if has_every_agent:
+                        results[backend]['tree'] = benchmark_tree(backend, model_type, workspace, args)
+            except ImportError as e:
+                # Some Models only import their client library when they're created
+                print(f"  Skipping {backend}: {e}", file=sys.stderr)
+                results.pop(backend, None)
+                continue
+            if not has_every_agent:
+                print(f"  {backend} doesn't have the config of every agent, so only the Coder is measured", file=sys.stderr)
+
+    commit, dirty = get_commit()
+    results_file = Path(args.results)
+    baseline = find_baseline(results_file, commit, args.baseline) if args.compare or args.baseline else None
+    if (args.compare or args.baseline) and baseline is None:
+        print("No stored run to compare with", file=sys.stderr)
+    elif baseline:
+        print(f"Comparing with {baseline['commit'][:10]}{' (with changes)' if baseline.get('dirty') else ''} from {baseline['time']}")
+    regressions = print_results(results, baseline, args.threshold)
+
+    if not args.no_save:
+        results_file.parent.mkdir(parents=True, exist_ok=True)
+        run = {
+            'commit': commit, 'dirty': dirty, 'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'args': vars(args), 'results': results,
+        }
+        with open(results_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + "\n")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
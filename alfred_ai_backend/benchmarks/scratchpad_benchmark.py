@@ -0,0 +1,92 @@
+"""Measures the cost of rendering the Claude scratchpad on each agent step
+
+Rebuilding the scratchpad renders every earlier step again, so the cost of a step grows with
+the number of steps before it. ClaudeScratchpad only renders the new step. What it still pays
+for is copying the text into a new string, shown as the copy column, which formatting the
+prompt does again anyway.
+
+    python -m alfred_ai_backend.benchmarks.scratchpad_benchmark --steps 10 50 100 200 400
+"""
+from typing import Any, Callable, List, Tuple
+from langchain_core.agents import AgentAction
+from alfred_ai_backend.models.anthropic.claude.ClaudeScratchpad import ClaudeScratchpad, render_step
+import argparse
+import logging
+import time
+
+
+def rebuild_scratchpad(intermediate_steps: List[Tuple[AgentAction, Any]]) -> str:
+    """How the scratchpad was rendered before ClaudeScratchpad"""
+    log = ""
+    for action, observation in intermediate_steps:
+        log += render_step(action, observation)
+    return log
+
+
+def make_steps(count: int, observation_size: int) -> List[Tuple[AgentAction, str]]:
+    """Creates steps like an agent reading and writing files, with the tool input left as text like Claude returns it"""
+    steps = []
+    for i in range(count):
+        if i % 3 == 2:
+            # Not valid JSON, so it's parsed by the ast.literal_eval fallback
+            tool_input = f"{{'file_path': 'pkg/module_{i}.py', 'text': 'print({i})'}}"
+            action = AgentAction(tool="write_file", tool_input=tool_input, log="")
+        else:
+            action = AgentAction(tool="read_file", tool_input=f'{{"file_path": "pkg/module_{i}.py"}}', log="")
+        steps.append((action, f"# module {i}\n" + "x" * observation_size))
+    return steps
+
+
+def time_last_step(render: Callable[[List[Tuple[AgentAction, Any]]], str], steps: List[Tuple[AgentAction, Any]], repeat: int) -> float:
+    """Runs an agent of len(steps) steps and times rendering the scratchpad on its last step
+
+    Returns:
+        float: The median time of the last step in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        for i in range(1, len(steps)):
+            render(steps[:i])
+        start = time.perf_counter()
+        render(steps)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def time_copy(text: str, repeat: int) -> float:
+    """Times making a new string the size of the scratchpad, the floor for any step"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        copy = text[:-1] + "."
+        timings.append(time.perf_counter() - start)
+        del copy
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Claude scratchpad rendering benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--steps", type=int, nargs='+', default=[10, 50, 100, 200, 400], help="Agent step counts to measure")
+    parser.add_argument("--observation_size", type=int, default=2000, help="Characters of each tool observation")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each step count")
+    args = parser.parse_args()
+
+    # Unparsable inputs are logged as warnings, which would be timed too
+    logging.disable(logging.WARNING)
+
+    print(f"{'steps':>6} {'size (KB)':>10} {'rebuild (us/step)':>18} {'incremental (us/step)':>22} {'copy (us)':>10} {'speedup':>8}")
+    for count in args.steps:
+        steps = make_steps(count, args.observation_size)
+        rebuild = time_last_step(rebuild_scratchpad, steps, args.repeat)
+        # A new scratchpad for each run, like a new task
+        incremental = min(time_last_step(ClaudeScratchpad().render, steps, 1) for _ in range(args.repeat))
+        text = rebuild_scratchpad(steps)
+        copy = time_copy(text, args.repeat)
+        print(f"{count:>6} {len(text) / 1024:>10.0f} {rebuild * 1e6:>18.1f} {incremental * 1e6:>22.1f} {copy * 1e6:>10.1f} {rebuild / incremental:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
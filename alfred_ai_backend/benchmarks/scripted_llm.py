@@ -0,0 +1,168 @@
+"""Deterministic LLMs that replay a script, so agents run their whole loop with no network
+
+Each agent of a task gets a script of the tool calls it makes and its final answer. The
+script is rendered in the reply format of a backend, so the backend's own prompt, scratchpad
+and output parser handle it the way they handle the real LLM:
+
+- openai_api.chat_gpt: OpenAI tool calls
+- anthropic.claude: `<tool>`/`<tool_input>` and `<final_answer>` tags
+- llama_cpp_local.mistral_instruct: a JSON blob with `action` and `action_input`
+
+`scripted_model_type` creates a subclass of a backend's Model that loads a scripted LLM
+instead of the real one, picking the script of each agent by its tool config.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import LLM
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from alfred_ai_backend.core.utils.TokenCounter import estimate_tokens
+from alfred_ai_backend.models.Model import Model
+import threading
+import json
+
+FINAL_ANSWER = "Final Answer"
+
+# A step of a script: a tool and its input, or FINAL_ANSWER and the answer
+ScriptStep = Tuple[str, Union[Dict[str, Any], str]]
+
+
+def render_reply(backend: str, step: ScriptStep, step_index: int) -> Union[BaseMessage, str]:
+    """Renders a step of a script as a backend's LLM would reply with it
+
+    Args:
+        backend (str): The backend, like `openai_api.chat_gpt`
+        step (ScriptStep): The tool and its input, or FINAL_ANSWER and the answer
+        step_index (int): The step's position in the script, for tool call ids
+
+    Returns:
+        Union[BaseMessage, str]: A message for chat models, text for the others
+    """
+    tool, tool_input = step
+    if backend == 'openai_api.chat_gpt':
+        if tool == FINAL_ANSWER:
+            return AIMessage(content=tool_input)
+        tool_call = {'id': f"call_{step_index}", 'type': 'function', 'function': {'name': tool, 'arguments': json.dumps(tool_input)}}
+        return AIMessage(content="", additional_kwargs={'tool_calls': [tool_call]})
+    if backend == 'anthropic.claude':
+        if tool == FINAL_ANSWER:
+            return AIMessage(content=f"<final_answer>{tool_input}")
+        # The LLM stops at `</tool_input>`, so the reply ends before it
+        return AIMessage(content=f"<tool>{tool}</tool><tool_input>{json.dumps(tool_input)}")
+    if backend == 'llama_cpp_local.mistral_instruct':
+        return f"Thought: the next step\nAction:\n```json\n{json.dumps({'action': tool, 'action_input': tool_input}, indent=2)}\n```"
+    raise ValueError(f"No reply format for the backend {backend}")
+
+
+class _Script():
+    """Replays replies in order, starting over after the last one"""
+
+    def __init__(self, replies: Sequence[Union[BaseMessage, str]]):
+        self._replies = list(replies)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> Union[BaseMessage, str]:
+        with self._lock:
+            reply = self._replies[self._position % len(self._replies)]
+            self._position += 1
+        return reply
+
+    def reset(self):
+        with self._lock:
+            self._position = 0
+
+
+class ScriptedChatModel(BaseChatModel):
+    """A chat model that replies with the messages of a script"""
+    replies: List[BaseMessage]
+    model_name: str = "scripted"
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.__dict__['_script'] = _Script(self.replies)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self.__dict__['_script'].next()
+        # Reported like OpenAI, so the token counting of the agents is the same as with a real LLM
+        usage = {'prompt_tokens': sum(estimate_tokens(str(m.content)) for m in messages), 'completion_tokens': estimate_tokens(str(message.content))}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={'token_usage': usage})
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """Accepts the tools like the Anthropic tools model does, the script already knows which to call"""
+        return self.bind(**kwargs)
+
+    def get_num_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def reset(self):
+        self.__dict__['_script'].reset()
+
+
+class ScriptedLLM(LLM):
+    """A text completion LLM that replies with the texts of a script"""
+    replies: List[str]
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.__dict__['_script'] = _Script(self.replies)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        return self.__dict__['_script'].next()
+
+    def get_num_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def reset(self):
+        self.__dict__['_script'].reset()
+
+
+def create_scripted_llm(backend: str, script: Sequence[ScriptStep]) -> Union[ScriptedChatModel, ScriptedLLM]:
+    """Creates the scripted LLM of a backend
+
+    Args:
+        backend (str): The backend, like `openai_api.chat_gpt`
+        script (Sequence[ScriptStep]): The agent's tool calls and final answer
+
+    Returns:
+        Union[ScriptedChatModel, ScriptedLLM]: The LLM
+    """
+    replies = [render_reply(backend, step, i) for i, step in enumerate(script)]
+    if isinstance(replies[0], BaseMessage):
+        return ScriptedChatModel(replies=replies)
+    return ScriptedLLM(replies=replies)
+
+
+def scripted_model_type(backend: str, model_type: Type[Model], scripts: Dict[str, Sequence[ScriptStep]], created: Optional[Callable[[Any], None]] = None) -> Type[Model]:
+    """Creates a subclass of a backend's Model whose agents run on scripted LLMs
+
+    Args:
+        backend (str): The backend, like `openai_api.chat_gpt`
+        model_type (Type[Model]): The backend's Model
+        scripts (Dict[str, Sequence[ScriptStep]]): The script of each agent by its tool config
+            file name, like `coder_tool_config.yml`
+        created (Optional[Callable[[Any], None]], optional): Called with each scripted LLM
+            created, like to reset them between runs. Defaults to None.
+
+    Returns:
+        Type[Model]: The Model subclass
+    """
+    def _load_llm(self: Model, llm_class: Type, factory: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        file_name = self._tool_config.file_name
+        if file_name not in scripts:
+            raise KeyError(f"No script for the agent of {file_name}")
+        self._llm = create_scripted_llm(backend, scripts[file_name])
+        if created:
+            created(self._llm)
+
+    # The agents find their tool configs next to the module of their Model
+    return type(f"Scripted{model_type.__name__}", (model_type,), {'__module__': model_type.__module__, '_load_llm': _load_llm})
@@ -1,18 +1,25 @@
 from langchain.agents import load_tools
 #from langchain_core.prompts import ChatPromptTemplate
-from typing import Dict, Any, List, Type
+from typing import Dict, Any, List, Optional, Tuple, Type
 import logging
 from alfred_ai_backend.core.Config import Config
 from alfred_ai_backend.core.tools.CoderTool import CoderTool
 from alfred_ai_backend.core.tools.TesterTool import TesterTool
-from alfred_ai_backend.core.utils.StatusMessaging import StatusMessaging
+from alfred_ai_backend.core.tools.SubAgentTool import SubAgentTool
+from alfred_ai_backend.core.tools.code_retriever_tool import create_code_retriever_tool
 from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
-from alfred_ai_backend.core.utils.AgentLogger import AgentLogger
+from alfred_ai_backend.core.utils.AgentCallbacks import get_agent_callbacks
+from alfred_ai_backend.core.utils.TokenUsageLedger import TokenUsageLedger
+from alfred_ai_backend.core.utils.TraceRecorder import TraceRecorder
 from alfred_ai_backend.models.Model import Model
+from alfred_ai_backend.models.ModelRegistry import ModelRegistry
+from alfred_ai_backend.core.utils.process_stats import get_rss_mb
+from alfred_ai_backend.core.LlmResponseCache import get_llm_response_cache
 from langchain_community.agent_toolkits import FileManagementToolkit
 from langchain.globals import set_verbose, set_debug
 from langchain.tools import BaseTool
 import sys
+import time
 
 logger = logging.getLogger(__name__)
 root_config = Config()
@@ -21,7 +28,15 @@ CONFIG_FILE_NAME = "agent_manager_config.yml"
 class AgentManager():
     """The main AI agent that manages other agents via tools"""
 
-    def __init__(self, model_type: Type[Model]):
+    def __init__(self, model_type: Type[Model], root_folder: Optional[str] = None):
+        """
+        Args:
+            model_type (Type[Model]): The model the agents use
+            root_folder (Optional[str], optional): The folder the agents work in. Defaults to
+                the configured root_folder.
+        """
+        start = time.perf_counter()
+        self._root_folder = str(root_folder or root_config.get('root_folder'))
         self._model_path = getattr(sys.modules[model_type.__module__], '__file__')
         tool_config = ToolConfig(CONFIG_FILE_NAME, self._model_path)
 
@@ -34,32 +49,167 @@ class AgentManager():
             set_verbose(True)
             
         # initialize agent
-        tools = self._get_tools()
+        self._tools = self._get_tools()
         self._agent_executor = self._model.initialize_agent(
             user_input_variables=['input'],
-            system_input_variables={'cwd': root_config.get('root_folder')},
-            tools=tools,
+            system_input_variables={'cwd': self._root_folder},
+            tools=self._tools,
+        )
+
+        # The last task and the conversations it started from, to replay it
+        self._last_task: Optional[Tuple[str, Dict[str, Any]]] = None
+
+        stats = ModelRegistry().get_stats()
+        rss = get_rss_mb()
+        logger.info(
+            f"Agent manager started in {time.perf_counter() - start:0.1f} sec with {stats['models']} models loaded "
+            f"for {stats['requests']} agents, resident memory {f'{rss:0.0f} MB' if rss is not None else 'unknown'}. "
+            f"Sub-agents are built when they're first used"
         )
 
     def _get_tools(self) -> List[BaseTool]:
         tools = load_tools(
             ["llm-math"],
-            llm=self._model.get_llm(),
+            llm=self._model.get_bound_llm(),
             allow_dangerous_tools=True
         )
         file_toolkit = FileManagementToolkit(
-            root_dir=str(root_config.get('root_folder')),
+            root_dir=self._root_folder,
             selected_tools=["list_directory", "read_file", "file_search"],
         )
         tools += file_toolkit.get_tools()
+        tools += [create_code_retriever_tool(self._root_folder)]
 
         # This creates sub-agents that can be used for a specific task
-        coder_tool = CoderTool(self._model_type, parent="AgentManager")
-        tester_tool = TesterTool(self._model_type, parent="AgentManager")
+        coder_tool = CoderTool(self._model_type, parent="AgentManager", root_folder=self._root_folder)
+        tester_tool = TesterTool(self._model_type, parent="AgentManager", root_folder=self._root_folder)
         tools += [coder_tool, tester_tool]
 
         return tools
 
-    def start_task(self, user_input_str: str) -> Dict[str, Any]:
+    @property
+    def root_folder(self) -> str:
+        return self._root_folder
+
+    def clear_memory(self):
+        """Makes the manager and its sub-agents forget their conversations, like before handing them to another user"""
+        self._model.clear_memory()
+        for tool in self._model.get_tools():
+            if isinstance(tool, SubAgentTool):
+                tool.clear_memory()
+
+    def _get_memory(self) -> Dict[str, Any]:
+        """Gets a copy of the conversations of the manager and the sub-agents built so far"""
+        return {
+            'messages': self._model.get_memory(),
+            'tools': {tool.name: tool.get_memory() for tool in self._model.get_tools() if isinstance(tool, SubAgentTool)},
+        }
+
+    def _set_memory(self, memory: Dict[str, Any]):
+        """Replaces the conversations of the manager and its sub-agents with ones from `_get_memory`"""
+        self._model.set_memory(memory['messages'])
+        for tool in self._model.get_tools():
+            if isinstance(tool, SubAgentTool):
+                tool.set_memory(memory['tools'].get(tool.name, {}))
+
+    def _get_replay(self) -> str:
+        """Restores the conversations the last task started from and gets the task"""
+        if self._last_task is None:
+            raise ValueError("There is no task to replay")
+        user_input_str, memory = self._last_task
+        self._set_memory(memory)
+        return user_input_str
+
+    def replay_last_task(self, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """Runs the last task again, from the conversations it started from
+
+        The agents see the same prompts as the first time, so with the LLM response cache
+        enabled their LLM calls are served from it. Calls after a tool returns something
+        else than the first time, like a file the task changed, miss the cache.
+
+        Args:
+            task_id (Optional[str], optional): The id its usage is tracked under. Defaults to a new one.
+
+        Returns:
+            Dict[str, Any]: The agent's response, like `start_task`
+
+        Raises:
+            ValueError: If no task was run yet
+        """
+        return self.start_task(self._get_replay(), task_id)
+
+    async def areplay_last_task(self, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """Runs the last task again on the asyncio event loop, like `replay_last_task`"""
+        return await self.astart_task(self._get_replay(), task_id)
+
+    def start_task(self, user_input_str: str, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """Runs a task
+
+        Args:
+            user_input_str (str): The task
+            task_id (Optional[str], optional): The id its usage is tracked under. Defaults to a new one.
+
+        Returns:
+            Dict[str, Any]: The agent's response, with the task's token usage in `usage`, and
+                the file its trace was written to in `trace_file` when tracing is enabled
+        """
+        logger.info("*** Starting task ***")
+        self._last_task = (user_input_str, self._get_memory())
+        with TokenUsageLedger().track_task(task_id) as task_id, TraceRecorder().trace_task(task_id, user_input_str):
+            inference_config = {'callbacks': get_agent_callbacks("AgentManager", model=self._model)}
+            if root_config.get('streaming', {}).get('enabled', False):
+                # The tokens are printed by StatusMessaging as they arrive
+                resp = self._model.stream_agent_executor({'input': user_input_str}, inference_config)
+            else:
+                resp = self._model.invoke_agent_executor({'input': user_input_str}, inference_config)
+        return self._finish_task(task_id, resp)
+
+    async def astart_task(self, user_input_str: str, task_id: Optional[str] = None) -> Dict[str, Any]:
+        """Runs a task on the asyncio event loop
+
+        Sub-agents that the manager calls in the same step, like the Coder and the Tester on
+        independent work, run concurrently.
+        """
         logger.info("*** Starting task ***")
-        return self._model.invoke_agent_executor({'input': user_input_str}, {'callbacks': [AgentLogger("AgentManager"), StatusMessaging("AgentManager")]})
+        self._last_task = (user_input_str, self._get_memory())
+        with TokenUsageLedger().track_task(task_id) as task_id, TraceRecorder().trace_task(task_id, user_input_str):
+            resp = await self._model.ainvoke_agent_executor({'input': user_input_str}, {'callbacks': get_agent_callbacks("AgentManager", model=self._model)})
+        return self._finish_task(task_id, resp)
+
+    def _finish_task(self, task_id: str, resp: Dict[str, Any]) -> Dict[str, Any]:
+        """Adds the task's token usage and trace file to the response and logs the usage"""
+        usage = TokenUsageLedger().get_task_usage(task_id)
+        resp['usage'] = usage
+        trace_file = TraceRecorder().get_trace_file(task_id)
+        if trace_file:
+            resp['trace_file'] = trace_file
+        total = usage['total']
+        logger.info(
+            f"Task used {total['prompt_tokens']} prompt and {total['completion_tokens']} completion tokens "
+            f"in {total['llm_calls']} LLM calls, costing ${total['cost_usd']:0.4f}"
+        )
+        for agent, agent_usage in usage['agents'].items():
+            logger.info(
+                f"  [{agent}] {agent_usage['total_tokens']} tokens, ${agent_usage['cost_usd']:0.4f}, "
+                f"{agent_usage['llm_seconds']:0.1f} sec in the LLM, {agent_usage['tool_seconds']:0.1f} sec in {agent_usage['tool_calls']} tool calls"
+            )
+        self._log_llm_cache_stats(total)
+        return resp
+
+    def _log_llm_cache_stats(self, total: Dict[str, Any]):
+        """Logs how many LLM calls of the task were served from the response cache
+
+        Args:
+            total (Dict[str, Any]): The task's total usage. Sessions of the server share the
+                cache, so the task's hits are counted by its own ledger instead of the cache.
+        """
+        cache = get_llm_response_cache()
+        if cache is None:
+            return
+        hits = total['cached_calls']
+        misses = total['llm_calls'] - hits
+        logger.info(
+            f"LLM response cache: {hits} hits, {misses} misses "
+            f"({hits / total['llm_calls'] if total['llm_calls'] else 0.0:.0%} hit ratio), "
+            f"{cache.get_stats()['size_bytes'] / 1024 / 1024:0.1f} MB cached"
+        )
@@ -0,0 +1,369 @@
+from typing import Any, Deque, Dict, List, Optional, Set, Type, TYPE_CHECKING
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from aiohttp import web
+from alfred_ai_backend.core.Config import Config
+from alfred_ai_backend.core.utils.AgentEvents import send_events_to
+from alfred_ai_backend.core.utils.workspace import prepare_workspace, reset_workspace
+from pathlib import Path
+import asyncio
+import logging
+import math
+import time
+import uuid
+
+# The agents are only imported once the sessions are created
+if TYPE_CHECKING:
+    from alfred_ai_backend.core.AgentManager import AgentManager
+    from alfred_ai_backend.models.Model import Model
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+MAX_LATENCY_SAMPLES = 1000  # The percentiles are of this many of the most recent tasks
+MAX_EVENTS_PER_TASK = 10000  # Events kept to replay to clients that connect late, the rest are only sent live
+
+
+class _LatencyStats():
+    """Percentiles of the most recent latencies"""
+
+    def __init__(self, max_samples: int = MAX_LATENCY_SAMPLES):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {'count': 0, 'p50': None, 'p99': None, 'max': None}
+
+        def percentile(p: float) -> float:
+            # Nearest rank, so the p99 of fewer than 100 tasks is their slowest
+            return round(samples[max(0, math.ceil(p * len(samples)) - 1)], 3)
+        return {'count': len(samples), 'p50': percentile(0.5), 'p99': percentile(0.99), 'max': round(samples[-1], 3)}
+
+
+@dataclass
+class _Session:
+    """An agent manager kept warm for tasks, with its own workspace"""
+    id: int
+    agent_manager: "AgentManager"
+    tasks: int = 0
+
+
+@dataclass
+class _TaskRecord:
+    """A task sent to the server, its result and the events of its agents"""
+    id: str
+    task: str
+    status: str = 'queued'  # queued, running, done or failed
+    created: float = field(default_factory=time.time)
+    session: Optional[int] = None
+    output: Optional[str] = None
+    error: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    queue_seconds: Optional[float] = None
+    execution_seconds: Optional[float] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    subscribers: Set[asyncio.Queue] = field(default_factory=set)
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    _sent_events: int = 0
+
+    def add_event(self, event: Dict[str, Any]):
+        """Keeps an event and sends it to the connected clients. Only call this on the event loop"""
+        event = {'seq': self._sent_events, **event}
+        self._sent_events += 1
+        if len(self.events) < MAX_EVENTS_PER_TASK:
+            self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def finish(self):
+        self.done.set()
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id, 'task': self.task, 'status': self.status, 'created': self.created, 'session': self.session,
+            'output': self.output, 'error': self.error, 'usage': self.usage,
+            'queue_seconds': self.queue_seconds, 'execution_seconds': self.execution_seconds,
+        }
+
+
+class AgentServer():
+    """Serves tasks over HTTP from a pool of warm agent manager sessions
+
+    The sessions are created once when the server starts, so a task doesn't pay for loading
+    the agents and models. Each session has its own workspace under `workspace_folder` and
+    runs one task at a time. Its workspace is emptied, or copied from `root_folder` again,
+    when the session starts and after each task, and its agents forget the conversation after
+    each task, so tasks never see each other's files or history, not even those of a previous
+    server that stopped mid-task. Tasks wait in order for a free session. If some sessions
+    can't be started the server runs with the others, and tasks only fail when none of them
+    started.
+
+    The API:
+
+    - `POST /tasks` with `{"task": "..."}` queues a task and returns its id. With `"wait": true`
+      it returns once the task is done instead.
+    - `GET /tasks/{id}` returns the task's status, output, token usage and latencies.
+    - `GET /tasks/{id}/events` is a WebSocket that replays the task's step and status events so
+      far, sends the next ones as they happen and closes when the task is done.
+    - `GET /metrics` returns the p50 and p99 of the time tasks waited for a session and the
+      time they ran, along with the sessions and tasks in each state.
+    - `GET /health` returns whether the sessions are ready, and the errors of those that failed to start.
+    """
+
+    def __init__(
+        self,
+        model_type: Type["Model"],
+        sessions: int = 2,
+        workspace_folder: str = ".alfred_server/workspaces",
+        copy_root_folder: bool = False,
+        max_queued_tasks: int = 100,
+        max_finished_tasks: int = 1000,
+    ):
+        """
+        Args:
+            model_type (Type[Model]): The model the agents use
+            sessions (int, optional): The agent managers that run tasks at the same time. Defaults to 2.
+            workspace_folder (str, optional): Where the workspace of each session is kept.
+                Defaults to ".alfred_server/workspaces".
+            copy_root_folder (bool, optional): Start new workspaces as a copy of `root_folder`. Defaults to False.
+            max_queued_tasks (int, optional): Tasks waiting for a session before new ones are
+                refused. Defaults to 100.
+            max_finished_tasks (int, optional): Finished tasks kept for their results. Defaults to 1000.
+        """
+        self._model_type = model_type
+        self._num_sessions = max(1, sessions)
+        self._workspace_folder = workspace_folder
+        self._copy_root_folder = copy_root_folder
+        self._max_queued_tasks = max_queued_tasks
+        self._max_finished_tasks = max_finished_tasks
+
+        # The agents block while they run, so each session runs its task on a thread of its own
+        self._executor = ThreadPoolExecutor(max_workers=self._num_sessions, thread_name_prefix="AgentSession")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle_sessions: Optional[asyncio.Queue] = None
+        self._ready_sessions = 0
+        self._sessions_started = False
+        self._session_errors: List[str] = []  # Of the sessions that failed to start
+        self._startup_error: Optional[str] = None  # Set when no session started
+        self._tasks: OrderedDict[str, _TaskRecord] = OrderedDict()
+        self._waiting: Dict[str, asyncio.Task] = {}  # task id -> its run, while it waits for a session
+        self._counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        self._queue_latency = _LatencyStats()
+        self._execution_latency = _LatencyStats()
+
+    def create_app(self) -> web.Application:
+        """Creates the aiohttp application, which starts the sessions when it starts"""
+        app = web.Application()
+        app.add_routes([
+            web.post('/tasks', self._post_task),
+            web.get('/tasks/{id}', self._get_task),
+            web.get('/tasks/{id}/events', self._get_task_events),
+            web.get('/metrics', self._get_metrics),
+            web.get('/health', self._get_health),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    def run(self, host: str = "127.0.0.1", port: int = 8080):
+        """Serves until interrupted"""
+        logger.info(f"Serving on http://{host}:{port} with {self._num_sessions} sessions")
+        web.run_app(self.create_app(), host=host, port=port)
+
+    async def _on_startup(self, app: web.Application):
+        self._loop = asyncio.get_running_loop()
+        self._idle_sessions = asyncio.Queue()
+        # Requests are accepted right away and wait for the first session
+        app['session_startup'] = asyncio.create_task(self._start_sessions())
+
+    async def _on_cleanup(self, app: web.Application):
+        app['session_startup'].cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _start_sessions(self):
+        start = time.perf_counter()
+        for session_id in range(self._num_sessions):
+            try:
+                # One at a time, so sessions after the first share the models it loaded
+                agent_manager = await self._loop.run_in_executor(self._executor, self._create_agent_manager, session_id)
+            except Exception as e:
+                error = f"Unable to start session {session_id}: {e}"
+                logger.exception(error)
+                self._session_errors.append(error)
+                continue
+            self._ready_sessions += 1
+            self._idle_sessions.put_nowait(_Session(session_id, agent_manager))
+        self._sessions_started = True
+
+        if self._ready_sessions == 0:
+            self._startup_error = "; ".join(self._session_errors)
+            self._fail_waiting_tasks()
+        elif self._session_errors:
+            logger.warning(
+                f"Started {self._ready_sessions} of {self._num_sessions} sessions in {time.perf_counter() - start:0.1f} sec, "
+                f"running with those"
+            )
+        else:
+            logger.info(f"Started {self._num_sessions} sessions in {time.perf_counter() - start:0.1f} sec")
+
+    def _create_agent_manager(self, session_id: int) -> "AgentManager":
+        from alfred_ai_backend.core.AgentManager import AgentManager
+        workspace = prepare_workspace(Path(self._workspace_folder, f"session_{session_id}"))
+        # A previous server may have stopped in the middle of a task, so start it like after a task
+        reset_workspace(workspace, self._copy_root_folder)
+        return AgentManager(self._model_type, root_folder=str(workspace))
+
+    async def _post_task(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="The body must be JSON")
+        if not isinstance(body, dict) or not isinstance(body.get('task'), str) or not body['task'].strip():
+            raise web.HTTPBadRequest(text="Expected an object with a non-empty `task` string")
+        if self._startup_error:
+            raise web.HTTPServiceUnavailable(text=self._startup_error)
+        if self._counts['queued'] >= self._max_queued_tasks:
+            raise web.HTTPServiceUnavailable(text=f"{self._counts['queued']} tasks are already waiting for a session")
+
+        record = _TaskRecord(uuid.uuid4().hex, body['task'])
+        self._tasks[record.id] = record
+        self._counts['queued'] += 1
+        self._waiting[record.id] = asyncio.create_task(self._run_task(record))
+        if body.get('wait'):
+            await record.done.wait()
+            return web.json_response(record.to_dict())
+        return web.json_response(record.to_dict(), status=202, headers={'Location': f"/tasks/{record.id}"})
+
+    async def _get_task(self, request: web.Request) -> web.Response:
+        return web.json_response(self._find_task(request).to_dict())
+
+    async def _get_task_events(self, request: web.Request) -> web.WebSocketResponse:
+        record = self._find_task(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        # Nothing runs on the loop between these, so no event is missed or sent twice
+        queue: asyncio.Queue = asyncio.Queue()
+        history = list(record.events)
+        finished = record.done.is_set()
+        if not finished:
+            record.subscribers.add(queue)
+        try:
+            for event in history:
+                await ws.send_json(event)
+            while not finished:
+                event = await queue.get()
+                if event is None:
+                    break
+                await ws.send_json(event)
+        except ConnectionResetError:
+            logger.debug(f"The events client of task {record.id} went away")
+        finally:
+            record.subscribers.discard(queue)
+        await ws.close()
+        return ws
+
+    async def _get_metrics(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'sessions': {
+                'total': self._num_sessions,
+                'ready': self._ready_sessions,
+                'failed': len(self._session_errors),
+                'idle': self._idle_sessions.qsize() if self._idle_sessions else 0,
+            },
+            'tasks': dict(self._counts),
+            'queue_seconds': self._queue_latency.to_dict(),
+            'execution_seconds': self._execution_latency.to_dict(),
+        })
+
+    async def _get_health(self, request: web.Request) -> web.Response:
+        if self._startup_error:
+            return web.json_response({'status': 'error', 'error': self._startup_error}, status=503)
+        if self._ready_sessions == self._num_sessions:
+            status = 'ok'
+        elif self._sessions_started:
+            status = 'degraded'  # Running with the sessions that started
+        else:
+            status = 'starting'
+        return web.json_response({'status': status, 'ready_sessions': self._ready_sessions, 'session_errors': self._session_errors})
+
+    def _find_task(self, request: web.Request) -> _TaskRecord:
+        record = self._tasks.get(request.match_info['id'])
+        if record is None:
+            raise web.HTTPNotFound(text="Unknown task")
+        return record
+
+    async def _run_task(self, record: _TaskRecord):
+        queued_at = time.perf_counter()
+        session: _Session = await self._idle_sessions.get()
+        self._waiting.pop(record.id, None)
+        record.queue_seconds = round(time.perf_counter() - queued_at, 3)
+        self._queue_latency.add(record.queue_seconds)
+        self._counts['queued'] -= 1
+        self._counts['running'] += 1
+        record.status = 'running'
+        record.session = session.id
+        record.add_event({'type': 'task_start', 'time': time.time(), 'session': session.id})
+
+        start = time.perf_counter()
+        try:
+            resp = await self._loop.run_in_executor(self._executor, self._run_on_session, session, record)
+            record.output = resp.get('output')
+            record.usage = (resp.get('usage') or {}).get('total')
+            record.status = 'done'
+        except Exception as e:
+            logger.exception(f"Task {record.id} failed on session {session.id}")
+            record.error = f"{type(e).__name__}: {e}"
+            record.status = 'failed'
+        finally:
+            record.execution_seconds = round(time.perf_counter() - start, 3)
+            self._execution_latency.add(record.execution_seconds)
+            self._counts['running'] -= 1
+            self._counts[record.status] += 1
+            self._idle_sessions.put_nowait(session)
+
+        record.add_event({'type': 'task_end', 'time': time.time(), **record.to_dict()})
+        record.finish()
+        self._forget_finished_tasks()
+
+    def _run_on_session(self, session: _Session, record: _TaskRecord) -> Dict[str, Any]:
+        """Runs a task on a session's thread, sending its agents' events back to the loop"""
+        def send(event: Dict[str, Any]):
+            self._loop.call_soon_threadsafe(record.add_event, event)
+
+        session.tasks += 1
+        with send_events_to(send):
+            try:
+                return session.agent_manager.start_task(record.task, task_id=record.id)
+            finally:
+                # The next task on this session may come from someone else
+                session.agent_manager.clear_memory()
+                try:
+                    reset_workspace(Path(session.agent_manager.root_folder), self._copy_root_folder)
+                except OSError:
+                    logger.exception(f"Unable to empty the workspace of session {session.id}")
+
+    def _fail_waiting_tasks(self):
+        """Fails the tasks waiting for a session, once none of the sessions could be started"""
+        for task_id, waiting in list(self._waiting.items()):
+            waiting.cancel()
+            record = self._tasks[task_id]
+            record.error = self._startup_error
+            record.status = 'failed'
+            self._counts['queued'] -= 1
+            self._counts['failed'] += 1
+            record.add_event({'type': 'task_end', 'time': time.time(), **record.to_dict()})
+            record.finish()
+        self._waiting.clear()
+        self._forget_finished_tasks()
+
+    def _forget_finished_tasks(self):
+        finished = [task_id for task_id, record in self._tasks.items() if record.done.is_set()]
+        for task_id in finished[:max(0, len(finished) - self._max_finished_tasks)]:
+            del self._tasks[task_id]
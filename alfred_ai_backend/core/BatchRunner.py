@@ -0,0 +1,245 @@
+from typing import Any, Dict, IO, Iterator, Optional, Tuple, Type, TYPE_CHECKING
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from alfred_ai_backend.core.Config import Config
+from alfred_ai_backend.core.utils.RedirectStdStreamsToLogger import StreamToLogger
+from alfred_ai_backend.core.utils.workspace import prepare_workspace
+from alfred_ai_backend.core.utils.log_writer import start_log_writer, stop_log_writer
+from pathlib import Path
+import multiprocessing
+import multiprocessing.util
+import logging
+import json
+import time
+import uuid
+import sys
+
+# The agents are only imported inside the worker processes
+if TYPE_CHECKING:
+    from alfred_ai_backend.core.AgentManager import AgentManager
+    from alfred_ai_backend.models.Model import Model
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+
+# Each worker process creates its agent manager once and runs all of its tasks with it
+_worker_state: Tuple[int, "AgentManager"] = None
+
+
+@dataclass
+class BatchTask:
+    """A task read from the batch input"""
+    index: int  # Line number in the input
+    id: str
+    task: Optional[str]
+    error: Optional[str] = None  # Why the line couldn't be read as a task
+
+
+def read_tasks(stream: IO[str]) -> Iterator[BatchTask]:
+    """Reads tasks from JSONL, one `{"id": ..., "task": ...}` object per line
+
+    The id is optional and defaults to the line number. A line holding only a JSON string is
+    read as a task as well. Lines that aren't a task are returned with an error, so they show
+    up in the results instead of silently disappearing.
+
+    Args:
+        stream (IO[str]): The input, like an open file or stdin
+
+    Yields:
+        Iterator[BatchTask]: The tasks in the order they were read
+    """
+    for index, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield BatchTask(index, str(index), None, f"Invalid JSON: {e}")
+            continue
+        if isinstance(entry, str):
+            entry = {'task': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('task'), str) or not entry['task'].strip():
+            yield BatchTask(index, str(index), None, "Expected an object with a non-empty `task` string")
+            continue
+        yield BatchTask(index, str(entry.get('id', index)), entry['task'])
+
+
+def _init_worker(model_type: Type["Model"], workspace_folder: str, copy_root_folder: bool, worker_ids: "multiprocessing.Queue", log_level: int):
+    """Gives the worker process its own workspace and log file and creates its agent manager"""
+    global _worker_state
+    worker_id = worker_ids.get()
+    workspace = Path(workspace_folder, f"worker_{worker_id}").resolve()
+
+    # Logs are kept next to the workspace so the agents don't see them in their root folder
+    workspace.parent.mkdir(parents=True, exist_ok=True)
+    handler = logging.FileHandler(Path(workspace.parent, f"worker_{worker_id}.log"), 'w', 'utf-8')
+    handler.setFormatter(logging.Formatter(root_config.get('logging', {}).get('format', '%(asctime)s - %(levelname)s - %(message)s')))
+    start_log_writer([handler], log_level)
+    # Worker processes exit without running atexit, only the finalizers of multiprocessing
+    multiprocessing.util.Finalize(None, stop_log_writer, exitpriority=0)
+    # The console messages of the agents would interleave across workers, so they're logged instead
+    sys.stdout = StreamToLogger(logging.getLogger(f"{__name__}.worker_{worker_id}"), logging.INFO)
+
+    prepare_workspace(workspace, copy_root_folder)
+    # Tokens are printed as they arrive to a console that no one is watching
+    root_config.set('streaming', {**root_config.get('streaming', {}), 'enabled': False})
+
+    from alfred_ai_backend.core.AgentManager import AgentManager
+    _worker_state = (worker_id, AgentManager(model_type, root_folder=str(workspace)))
+    logger.info(f"Worker {worker_id} ready with the workspace {workspace}")
+
+
+def run_task(task: BatchTask) -> Dict[str, Any]:
+    """Runs a task on the worker's agent manager
+
+    This runs inside the worker processes so it must stay a picklable top level function.
+
+    Args:
+        task (BatchTask): The task
+
+    Returns:
+        Dict[str, Any]: The task's result, with its latency and total token usage
+    """
+    from alfred_ai_backend.core.utils.TokenUsageLedger import TokenUsageLedger
+    worker_id, agent_manager = _worker_state
+    task_id = uuid.uuid4().hex
+    result = {'index': task.index, 'id': task.id, 'task': task.task, 'worker': worker_id, 'output': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        resp = agent_manager.start_task(task.task, task_id=task_id)
+        result['output'] = resp.get('output')
+    except Exception as e:
+        logger.exception(f"Task {task.id} failed")
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        # The worker's next task is unrelated, and its result mustn't depend on what ran before it
+        agent_manager.clear_memory()
+    result['latency_seconds'] = round(time.perf_counter() - start, 3)
+    # Failed tasks spent tokens too, so the usage comes from the ledger rather than the response
+    usage = TokenUsageLedger().get_task_usage(task_id)
+    result['usage'] = usage['total'] if usage else None
+    return result
+
+
+class BatchRunner():
+    """Runs a queue of tasks across a pool of worker processes
+
+    Each worker creates its own agent manager, with its own models, and works in its own
+    `root_folder` under `workspace_folder`, so tasks that write files can't step on each other.
+    A worker runs its tasks one after the other and keeps its workspace between them, but
+    its agents forget the conversation after each task.
+
+    The results are written as JSONL in the order the tasks finish, as soon as each one does,
+    so a long batch can be watched and a crashed one still keeps what it finished.
+    """
+
+    def __init__(self, model_type: Type["Model"], workers: int = 2, workspace_folder: str = ".alfred_batch/workspaces", copy_root_folder: bool = False):
+        """
+        Args:
+            model_type (Type[Model]): The model the agents use
+            workers (int, optional): The worker processes. Defaults to 2.
+            workspace_folder (str, optional): Where the workspace and log of each worker are kept.
+                Defaults to ".alfred_batch/workspaces".
+            copy_root_folder (bool, optional): Start new workspaces as a copy of `root_folder`.
+                Defaults to False.
+        """
+        self._model_type = model_type
+        self._workers = max(1, workers)
+        self._workspace_folder = workspace_folder
+        self._copy_root_folder = copy_root_folder
+
+    def run(self, tasks: Iterator[BatchTask], output: IO[str]) -> Dict[str, Any]:
+        """Runs the tasks and writes their results
+
+        Args:
+            tasks (Iterator[BatchTask]): The tasks, read lazily so stdin can keep feeding them
+            output (IO[str]): Where the JSONL results are written
+
+        Returns:
+            Dict[str, Any]: A summary of the batch
+        """
+        start = time.perf_counter()
+        summary = {'tasks': 0, 'failed': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0, 'latency_seconds': []}
+
+        def write(result: Dict[str, Any]):
+            output.write(json.dumps(result, default=str) + "\n")
+            output.flush()
+            summary['tasks'] += 1
+            summary['failed'] += int(result['error'] is not None)
+            usage = result.get('usage') or {}
+            summary['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            summary['completion_tokens'] += usage.get('completion_tokens', 0)
+            summary['cost_usd'] += usage.get('cost_usd', 0.0)
+            if result.get('latency_seconds') is not None:
+                summary['latency_seconds'].append(result['latency_seconds'])
+
+        # The agents start threads, which aren't safe to fork
+        context = multiprocessing.get_context('spawn')
+        worker_ids = context.Queue()
+        for worker_id in range(self._workers):
+            worker_ids.put(worker_id)
+        logger.info(f"Running the batch with {self._workers} workers in {Path(self._workspace_folder).resolve()}")
+
+        # Only a bounded number of tasks are in flight, the rest stay unread in the input
+        max_in_flight = self._workers * 2
+        in_flight: Dict[Future, BatchTask] = {}
+        with ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._model_type, self._workspace_folder, self._copy_root_folder, worker_ids, logging.getLogger().getEffectiveLevel()),
+        ) as executor:
+            broken = None
+            for task in tasks:
+                if task.error or broken:
+                    write(self._get_failed_result(task, task.error or broken))
+                    continue
+                try:
+                    in_flight[executor.submit(run_task, task)] = task
+                except BrokenProcessPool as e:
+                    broken = f"The worker pool stopped, see the worker logs in {self._workspace_folder}: {e}"
+                    logger.error(broken)
+                    write(self._get_failed_result(task, broken))
+                    continue
+                while len(in_flight) >= max_in_flight:
+                    broken = self._write_done(in_flight, write) or broken
+            while in_flight:
+                broken = self._write_done(in_flight, write) or broken
+
+        latencies = sorted(summary.pop('latency_seconds'))
+        summary['wall_seconds'] = round(time.perf_counter() - start, 3)
+        summary['p50_latency_seconds'] = latencies[len(latencies) // 2] if latencies else None
+        summary['max_latency_seconds'] = latencies[-1] if latencies else None
+        logger.info(
+            f"Batch done: {summary['tasks']} tasks, {summary['failed']} failed in {summary['wall_seconds']:0.1f} sec, "
+            f"{summary['prompt_tokens']} prompt and {summary['completion_tokens']} completion tokens, ${summary['cost_usd']:0.4f}"
+        )
+        return summary
+
+    def _write_done(self, in_flight: Dict[Future, BatchTask], write) -> Optional[str]:
+        """Waits for tasks to finish and writes their results
+
+        Returns:
+            Optional[str]: Why the pool can't run any more tasks, if it broke
+        """
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        broken = None
+        for future in done:
+            task = in_flight.pop(future)
+            try:
+                write(future.result())
+            except BrokenProcessPool as e:
+                # A worker died or couldn't create its agent manager, like when a model fails to load
+                broken = f"The worker pool stopped, see the worker logs in {self._workspace_folder}: {e}"
+                logger.error(broken)
+                write(self._get_failed_result(task, broken))
+        return broken
+
+    @staticmethod
+    def _get_failed_result(task: BatchTask, error: str) -> Dict[str, Any]:
+        return {
+            'index': task.index, 'id': task.id, 'task': task.task, 'worker': None,
+            'output': None, 'error': error, 'latency_seconds': None, 'usage': None,
+        }
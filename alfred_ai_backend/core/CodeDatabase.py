@@ -1,55 +1,437 @@
 import yaml
-from typing import Any
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
 import logging
-from alfred_ai_backend.core.Config import SingletonMeta
-from langchain_community.document_loaders.generic import GenericLoader
-from langchain_community.document_loaders.parsers import LanguageParser
-from langchain_text_splitters import Language
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma, VectorStoreRetriever, VectorStore
-from langchain_openai import OpenAIEmbeddings
-import asyncio
+from alfred_ai_backend.core.Config import SingletonMeta, Config
+from alfred_ai_backend.core.CodeManifest import CodeManifest, MANIFEST_FILE_NAME
+from alfred_ai_backend.core.EmbeddingCache import CachedEmbeddings, get_embeddings_model_name
+from alfred_ai_backend.core.EmbeddingScheduler import EmbeddingScheduler
+from alfred_ai_backend.core.CodeIndexingPipeline import CodeIndexingPipeline
+from alfred_ai_backend.core.CodeSearchIndex import LexicalIndex, HybridCodeRetriever, build_lexical_index
+from alfred_ai_backend.core.CodeWatcher import CodeWatcher
+from langchain_core.documents import Document
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from pathlib import Path
+from concurrent.futures import Future, TimeoutError
+from dataclasses import dataclass, replace
+import importlib
+import queue
+import hashlib
+import threading
+import time
 
 logger = logging.getLogger(__name__)
+root_config = Config()
 CONFIG_FILE_NAME = "config.yml"
+SUFFIXES = [".py", ".yml"]
+EXCLUDE = ["**/non-utf8-encoding.py"]
+COLLECTION_PREFIX = "code_"
+DEFAULT_EMBEDDINGS_CONFIG = {
+    'name': 'OpenAIEmbeddings',
+    'module': 'langchain_openai',
+    'init': {'disallowed_special': []},
+}
+# Backends that run a model in this process on a context that isn't thread safe
+LOCAL_MODEL_EMBEDDINGS = ["LlamaCppEmbeddings", "GPT4AllEmbeddings"]
+
+
+def load_embeddings(embeddings_config: Dict[str, Any]) -> Embeddings:
+    """This dynamically loads the embedding backend of the code database
+
+    The EmbeddingScheduler retries rate limited requests with a backoff shared by all its
+    workers, so backends that retry on their own, like OpenAIEmbeddings, are loaded with
+    `max_retries: 0` unless the config sets it.
+
+    Args:
+        embeddings_config (Dict[str, Any]): The class name, module and init arguments of the backend
+
+    Returns:
+        Embeddings: The embeddings object
+    """
+    class_name = embeddings_config.get('name')
+    module_name = embeddings_config.get('module')
+    try:
+        module = importlib.import_module(module_name)
+    except Exception as e:
+        logger.error(f"Failed to import embeddings module_name '{module_name}'")
+        raise
+
+    logger.info(f"Loaded embeddings {module_name}.{class_name}")
+    embeddings_class = getattr(module, class_name)
+    init_config = dict(embeddings_config.get('init') or {})
+    if 'max_retries' in getattr(embeddings_class, '__fields__', {}):
+        init_config.setdefault('max_retries', 0)
+    return embeddings_class(**init_config)
+
+
+def is_thread_safe(embeddings_config: Dict[str, Any]) -> bool:
+    """Checks if the embedding backend can be called from several threads at once
+
+    Args:
+        embeddings_config (Dict[str, Any]): The class name, module and init arguments of the backend.
+            `thread_safe` overrides the default.
+
+    Returns:
+        bool: False for backends running a local model, like LlamaCppEmbeddings
+    """
+    return embeddings_config.get('thread_safe', embeddings_config.get('name') not in LOCAL_MODEL_EMBEDDINGS)
+
+
+@dataclass(frozen=True)
+class CodeIndexSnapshot:
+    """The index of a repository as it's served to readers
+
+    A snapshot is never changed once it's published. A refresh builds the next one from
+    copies of its manifest and lexical index, which only copy what the refresh changes,
+    so a refresh costs what changed rather than the size of the repository. The vector
+    store is shared by the snapshots, and the retriever only keeps the chunks of its own.
+    """
+    repo_path: Path
+    manifest: CodeManifest
+    db: Chroma
+    lexical_index: LexicalIndex
+    retriever: HybridCodeRetriever
+    refreshed: bool = False  # False when opened from disk and not yet checked for changes
+
 
 class CodeDatabase(metaclass=SingletonMeta):
-    """Holds the Code Database"""
+    """Holds the Code Database
+
+    All refreshes run on a single background worker thread. Refresh requests for a
+    repository that are still queued are coalesced into one. A refresh builds the next
+    snapshot off to the side and publishes it with a single swap under the lock, so readers
+    keep using the previous snapshot until then and never see a half-built one.
+
+    With `code_database.watch.enabled`, every repository that gets refreshed is also
+    watched, and files written afterwards are re-indexed in the background.
+    """
 
     def __init__(self):
-        self._lock = asyncio.Lock()  # Initialize the lock
-        self._db: VectorStore = None
-        self._retriever: VectorStoreRetriever = None
-        pass
-
-    def get_retriever(self):
-        if self._retriever:
-            return self._retriever
-        
+        self._lock = threading.Lock()  # Guards the snapshots and the queued refreshes
+        self._load_lock = threading.Lock()  # Only one thread opens persisted indexes at a time
+        self._snapshots: Dict[Path, CodeIndexSnapshot] = {}
+        self._latest_repo_path: Path = None
+        self._pending: Dict[Path, Future] = {}
+        self._pending_paths: Dict[Path, Optional[Set[Path]]] = {}  # None means the whole repository
+        self._running: Dict[Path, Future] = {}
+        self._running_paths: Dict[Path, Optional[Set[Path]]] = {}
+        self._queue: "queue.Queue[Path]" = queue.Queue()
+        self._worker: threading.Thread = None
+
+        db_config = root_config.get('code_database', {})
+        self._index_folder = Path(db_config.get('index_folder', '.alfred_index'))
+        self._indexing_config = db_config.get('indexing', {})
+        cache_config = db_config.get('embedding_cache', {})
+        embeddings_config = db_config.get('embeddings', DEFAULT_EMBEDDINGS_CONFIG)
+        embeddings = load_embeddings(embeddings_config)
+        self._scheduler = EmbeddingScheduler(
+            embeddings,
+            **{'thread_safe': is_thread_safe(embeddings_config), **db_config.get('embedding_scheduler', {})},
+        )
+        self._embeddings = CachedEmbeddings(
+            self._scheduler,
+            folder=cache_config.get('folder', Path(self._index_folder, 'embedding_cache')),
+            max_size_mb=cache_config.get('max_size_mb', 512),
+            model_name=get_embeddings_model_name(embeddings),
+        )
+
+        watch_config = dict(db_config.get('watch') or {})
+        self._watcher: Optional[CodeWatcher] = None
+        if watch_config.pop('enabled', False):
+            self._watcher = CodeWatcher(self._discover_files, self.request_refresh, **watch_config)
+
+    def get_retriever(self, repo_path: Optional[str] = None) -> HybridCodeRetriever:
+        """Gets the retriever of the current snapshot of a repository
+
+        Args:
+            repo_path (Optional[str], optional): The root of the repository. Defaults to the last refreshed one.
+
+        Returns:
+            HybridCodeRetriever: The retriever
+        """
+        with self._lock:
+            repo_path = Path(repo_path).resolve() if repo_path else self._latest_repo_path
+            snapshot = self._snapshots.get(repo_path)
+        if snapshot:
+            return snapshot.retriever
+
         raise Exception("Code database needs to be refreshed")
 
+    def get_retriever_for(self, repo_path: str, timeout: float = 0) -> Optional[HybridCodeRetriever]:
+        """Gets the retriever of a repository without requiring an explicit refresh first
+
+        A persisted index is opened straight away and brought up to date in the background.
+        Without one, a build is started in the background and awaited for up to `timeout`.
+
+        Args:
+            repo_path (str): The root of the repository
+            timeout (float, optional): Seconds to wait for a new index to be built. Defaults to 0.
+
+        Returns:
+            Optional[HybridCodeRetriever]: The retriever or None if the index isn't ready yet
+        """
+        repo_path = Path(repo_path).resolve()
+        snapshot = self._get_snapshot(repo_path, load=True)
+        if snapshot:
+            if not snapshot.refreshed:
+                # Serve the persisted index right away and catch up on changes in the background
+                self.request_refresh(repo_path, join_running=True)
+            return snapshot.retriever
+
+        build = self.request_refresh(repo_path, join_running=True)
+        try:
+            build.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        return self.get_retriever(repo_path)
+
+    def request_refresh(self, repo_path: str, paths: Optional[Iterable[Path]] = None, join_running: bool = False) -> Future:
+        """Queues a refresh of a repository on the background worker
+
+        Args:
+            repo_path (str): The root of the repository
+            paths (Optional[Iterable[Path]], optional): Only re-index these files instead of
+                scanning the whole repository. Defaults to None.
+            join_running (bool, optional): Share the future of a full refresh that is already
+                running instead of queuing another one. That refresh may have scanned the
+                repository before the latest writes, so this is for readers that only need an
+                index, not for callers that just changed files. Defaults to False.
+
+        Returns:
+            Future: Completes when the refresh is done. Requests made while an earlier one for
+                the same repository is still queued share its future.
+        """
+        repo_path = Path(repo_path).resolve()
+        if self._watcher:
+            self._watcher.watch(repo_path)
+        paths = None if paths is None else {Path(path).resolve() for path in paths}
+        with self._lock:
+            future = self._running.get(repo_path)
+            if join_running and paths is None and future and self._running_paths[repo_path] is None:
+                return future
+            future = self._pending.get(repo_path)
+            if future:
+                queued_paths = self._pending_paths[repo_path]
+                if queued_paths is not None:
+                    self._pending_paths[repo_path] = None if paths is None else queued_paths | paths
+                return future
+            future = Future()
+            self._pending[repo_path] = future
+            self._pending_paths[repo_path] = paths
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name="CodeDatabaseRefresh", daemon=True)
+                self._worker.start()
+        self._queue.put(repo_path)
+        return future
+
     def refresh_database(self, repo_path: str):
+        """Refreshes a repository and waits for the new snapshot to be in place
+
+        Args:
+            repo_path (str): The root of the repository
+        """
+        self.request_refresh(repo_path).result()
+
+    def _run_worker(self):
+        while True:
+            repo_path = self._queue.get()
+            with self._lock:
+                # Requests arriving from now on need another refresh to see newer changes,
+                # unless they only want an index and join this one
+                future = self._pending.pop(repo_path)
+                paths = self._pending_paths.pop(repo_path)
+                self._running[repo_path] = future
+                self._running_paths[repo_path] = paths
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    self._refresh(repo_path, paths)
+                    future.set_result(None)
+                except Exception as e:
+                    logger.error(f"Refresh of {repo_path} failed. Error message: {e}")
+                    future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._running[repo_path]
+                    del self._running_paths[repo_path]
+
+    def _refresh(self, repo_path: Path, paths: Optional[Set[Path]] = None):
+        """Builds the next snapshot of a repository's index from the changes since the last refresh and publishes it"""
+        current = self._get_snapshot(repo_path, load=True)
+        if current is None:
+            # Nothing indexed yet, so only a full scan gives a complete index. It's only
+            # published once it's built, readers wait for it in get_retriever_for
+            manifest = CodeManifest(self._get_index_path(repo_path), load=False)
+            db = self._open_collection(repo_path, manifest.generation)
+            self._clear_collection(db)
+            published_index = LexicalIndex()
+            lexical_index = LexicalIndex()
+            paths = None
+        else:
+            if not current.refreshed:
+                # Files may have changed while nothing was watching
+                paths = None
+            manifest, db = current.manifest.copy(), current.db
+            published_index, lexical_index = current.lexical_index, current.lexical_index.copy()
+
+        # Work out what changed since the last refresh
+        start = time.perf_counter()
+        if paths is None:
+            diff = manifest.diff(repo_path, self._discover_files(repo_path))
+        else:
+            files = [path for path in paths if path.is_file() and self._is_code_file(path)]
+            diff = manifest.diff(repo_path, files, paths=paths)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        scanned = diff.unchanged + len(diff.added) + len(diff.changed)
+        logger.info(f"Code database refresh of {repo_path}: {diff}")
+        logger.info(f"Discovery stage: {scanned} files in {elapsed:0.1f} sec ({scanned / elapsed:0.1f} files/s)")
+        if diff.is_empty():
+            manifest.save()
+            self._publish(repo_path, self._create_snapshot(repo_path, manifest, db, lexical_index))
+            return
+
+        # Only parse, split and embed the new content, streaming it to the store in batches.
+        # Chunk ids include the content hash, so the new chunks don't replace the published
+        # ones in the store, and the retriever of the published snapshot leaves them out
+        self._embeddings.reset_stats()
+        self._scheduler.reset_stats()
+        pipeline = CodeIndexingPipeline(**self._indexing_config)
+        num_chunks, store_time = 0, 0.0
+        added_ids: List[str] = []  # In the store but not in the published snapshot
+        stale_ids: List[str] = []  # In the published snapshot but not in the new one
+        try:
+            for batch in pipeline.run(repo_path, [*diff.added, *diff.changed]):
+                texts, ids = [], []
+                for indexed_file in batch:
+                    texts += indexed_file.chunks
+                    ids += indexed_file.chunk_ids
+                # A file can be written back to the content that was already indexed
+                new_ids = set(ids)
+                batch_stale_ids = [chunk_id for chunk_id in manifest.get_chunk_ids(indexed_file.rel_path for indexed_file in batch) if chunk_id not in new_ids]
+
+                store_start = time.perf_counter()
+                added_ids += [chunk_id for chunk_id in ids if chunk_id not in published_index]
+                if texts:
+                    db.add_documents(texts, ids=ids)
+                lexical_index.add(ids, texts)
+                lexical_index.remove(batch_stale_ids)
+                for indexed_file in batch:
+                    manifest.update(indexed_file.rel_path, indexed_file.content_hash, indexed_file.chunk_ids, indexed_file.mtime_ns, indexed_file.size)
+                store_time += time.perf_counter() - store_start
+                num_chunks += len(texts)
+                stale_ids += batch_stale_ids
+
+            removed_ids = manifest.get_chunk_ids(diff.removed)
+            lexical_index.remove(removed_ids)
+            for rel_path in diff.removed:
+                manifest.remove(rel_path)
+            stale_ids += removed_ids
+            manifest.save()
+        except BaseException:
+            # Readers keep the published snapshot, so only the chunks nobody will use are dropped
+            self._delete_chunks(db, added_ids)
+            raise
+        self._publish(repo_path, self._create_snapshot(repo_path, manifest, db, lexical_index))
+        # Searches still running on the previous snapshot just miss these in the vector results
+        self._delete_chunks(db, stale_ids)
+
+        logger.info(f"Embed and store stage: {num_chunks} chunks in {store_time:0.1f} sec ({num_chunks / max(store_time, 1e-9):0.1f} chunks/s)")
+        logger.info(f"Indexed {num_chunks} chunks and dropped {len(stale_ids)} chunks in {time.perf_counter() - start:0.1f} sec (manifest revision {manifest.revision})")
+
+        stats = self._embeddings.get_stats()
+        logger.info(
+            f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_ratio']:.0%} hit ratio), {stats['bytes_saved']} bytes not re-embedded"
+        )
+        stats = self._scheduler.get_stats()
+        logger.info(
+            f"Embedding requests: {stats['embeddings']} embeddings in {stats['requests']} requests, "
+            f"{stats['rate_limited']} rate limited, {stats['embeddings_per_sec']:0.1f} embeddings/s"
+        )
+
+    def _publish(self, repo_path: Path, snapshot: CodeIndexSnapshot):
+        """Swaps in the new snapshot of a repository for readers and marks it as up to date"""
         with self._lock:
-            # Load the code documents
-            loader = GenericLoader.from_filesystem(
-                repo_path,
-                glob="**/*",
-                suffixes=[".py", ".yml"],
-                exclude=["**/non-utf8-encoding.py"],
-                parser=LanguageParser(language=Language.PYTHON, parser_threshold=500),
-            )
-            documents = loader.load()
-
-            # Split into chunks
-            python_splitter = RecursiveCharacterTextSplitter.from_language(
-                language=Language.PYTHON, chunk_size=2000, chunk_overlap=200
-            )
-            texts = python_splitter.split_documents(documents)
-
-            # Build the vector db
-            self._db = Chroma.from_documents(texts, OpenAIEmbeddings(disallowed_special=()))
-            self._retriever = self._db.as_retriever(
-                search_type="mmr",  # Also test "similarity"
-                search_kwargs={"k": 8},
-            )
+            self._snapshots[repo_path] = replace(snapshot, refreshed=True)
+            self._latest_repo_path = repo_path
+
+    def _delete_chunks(self, db: Chroma, ids: List[str]):
+        if ids:
+            db.delete(ids=ids)
+
+    def _get_snapshot(self, repo_path: Path, load: bool = False) -> Optional[CodeIndexSnapshot]:
+        with self._lock:
+            snapshot = self._snapshots.get(repo_path)
+        if snapshot or not load or not self._has_persisted_index(repo_path):
+            return snapshot
+
+        with self._load_lock:
+            with self._lock:
+                snapshot = self._snapshots.get(repo_path)
+            if snapshot is None:
+                manifest = CodeManifest(self._get_index_path(repo_path))
+                db = self._open_collection(repo_path, manifest.generation)
+                stored_ids = set(db.get(include=[])['ids'])
+                manifest_ids = set(manifest.get_all_chunk_ids())
+                if len(manifest) == 0 or not manifest_ids <= stored_ids:
+                    logger.warning(f"Code database of {repo_path} doesn't match its manifest, it will be re-indexed")
+                    manifest.delete()
+                    self._clear_collection(db)
+                    return None
+                orphan_ids = stored_ids - manifest_ids
+                if orphan_ids:
+                    # Left by a refresh that didn't get to publish its snapshot
+                    logger.info(f"Dropping {len(orphan_ids)} chunks of an unfinished refresh of {repo_path}")
+                    self._delete_chunks(db, list(orphan_ids))
+                snapshot = self._create_snapshot(repo_path, manifest, db)
+                with self._lock:
+                    self._snapshots.setdefault(repo_path, snapshot)
+                    snapshot = self._snapshots[repo_path]
+        return snapshot
+
+    def _create_snapshot(self, repo_path: Path, manifest: CodeManifest, db: Optional[Chroma] = None, lexical_index: Optional[LexicalIndex] = None) -> CodeIndexSnapshot:
+        if db is None:
+            db = self._open_collection(repo_path, manifest.generation)
+        if lexical_index is None:
+            # The lexical index is cheap to rebuild from the persisted chunks
+            stored = db.get(include=["documents", "metadatas"])
+            documents = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(stored['documents'], stored['metadatas'])]
+            lexical_index, build_time = build_lexical_index(stored['ids'], documents)
+            logger.info(f"Built lexical index of {len(documents)} chunks in {build_time * 1e3:0.1f} ms")
+
+        vector_retriever = db.as_retriever(
+            search_type="mmr",  # Also test "similarity"
+            search_kwargs={"k": 8},
+        )
+        retriever = HybridCodeRetriever(vector_retriever=vector_retriever, lexical_index=lexical_index, k=8)
+        return CodeIndexSnapshot(repo_path, manifest, db, lexical_index, retriever)
+
+    def _open_collection(self, repo_path: Path, generation: int) -> Chroma:
+        return Chroma(
+            collection_name=f"{COLLECTION_PREFIX}{generation}",
+            embedding_function=self._embeddings,
+            persist_directory=str(Path(self._get_index_path(repo_path), "chroma")),
+        )
+
+    def _clear_collection(self, db: Chroma):
+        """Deletes the chunks left in a collection that has no manifest to go with them"""
+        ids = db.get(include=[])['ids']
+        if ids:
+            logger.info(f"Dropping {len(ids)} chunks left in the code database")
+            db.delete(ids=ids)
+
+    def _get_index_path(self, repo_path: Path) -> Path:
+        repo_key = f"{repo_path.name}_{hashlib.sha1(str(repo_path).encode('utf-8')).hexdigest()[:8]}"
+        return Path(self._index_folder, repo_key)
+
+    def _has_persisted_index(self, repo_path: Path) -> bool:
+        return Path(self._get_index_path(repo_path), MANIFEST_FILE_NAME).exists()
+
+    def _discover_files(self, repo_path: Path) -> Iterator[Path]:
+        for path in repo_path.rglob("*"):
+            if self._is_code_file(path) and path.is_file():
+                yield path
 
+    def _is_code_file(self, path: Path) -> bool:
+        return path.suffix in SUFFIXES and not any(path.match(pattern) for pattern in EXCLUDE)
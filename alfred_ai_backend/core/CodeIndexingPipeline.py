@@ -0,0 +1,150 @@
+from typing import Iterator, List, Tuple
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from langchain_core.documents import Document
+from langchain_community.document_loaders.blob_loaders import Blob
+from langchain_community.document_loaders.parsers import LanguageParser
+from langchain_text_splitters import Language
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pathlib import Path
+import hashlib
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Each worker process builds its parser and splitter once
+_worker_state: Tuple[LanguageParser, RecursiveCharacterTextSplitter] = None
+
+
+@dataclass
+class IndexedFile:
+    """The chunks of a single parsed and split file
+
+    The hash and stat describe the exact bytes the chunks were split from.
+    """
+    rel_path: str
+    content_hash: str
+    chunks: List[Document]
+    mtime_ns: int = 0
+    size: int = 0
+
+    @property
+    def chunk_ids(self) -> List[str]:
+        return [f"{self.rel_path}:{self.content_hash[:16]}:{i}" for i in range(len(self.chunks))]
+
+
+def _get_worker_state() -> Tuple[LanguageParser, RecursiveCharacterTextSplitter]:
+    global _worker_state
+    if _worker_state is None:
+        parser = LanguageParser(language=Language.PYTHON, parser_threshold=500)
+        python_splitter = RecursiveCharacterTextSplitter.from_language(
+            language=Language.PYTHON, chunk_size=2000, chunk_overlap=200
+        )
+        _worker_state = (parser, python_splitter)
+    return _worker_state
+
+
+def parse_and_split(file_path: str, rel_path: str) -> IndexedFile:
+    """Loads a single code file and splits it into chunks
+
+    The file is read once, and its stat and hash are taken from that same read, so a file
+    written while it's being indexed is seen as changed again on the next refresh.
+
+    This runs inside the worker processes so it must stay a picklable top level function.
+
+    Args:
+        file_path (str): Absolute path of the file
+        rel_path (str): Path of the file relative to the repository root
+
+    Returns:
+        IndexedFile: The file's chunks
+    """
+    with open(file_path, 'rb') as f:
+        # Stat before reading, a write during the read then leaves a newer mtime behind
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    parser, python_splitter = _get_worker_state()
+    documents = list(parser.lazy_parse(Blob.from_data(data, path=file_path)))
+    chunks = python_splitter.split_documents(documents)
+    indexed_file = IndexedFile(rel_path, content_hash, chunks, stat.st_mtime_ns, stat.st_size)
+    for chunk, chunk_id in zip(chunks, indexed_file.chunk_ids):
+        chunk.metadata['content_hash'] = content_hash
+        chunk.metadata['chunk_id'] = chunk_id  # Lets readers tell which generation of the index a chunk belongs to
+    return indexed_file
+
+
+class CodeIndexingPipeline():
+    """Parses and splits code files in a process pool and streams the chunks in bounded batches
+
+    Only a bounded number of files are in flight at any time, so peak memory doesn't depend
+    on the size of the repository.
+    """
+
+    def __init__(self, max_workers: int = 0, batch_size: int = 256, min_files_for_pool: int = 8):
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._min_files_for_pool = min_files_for_pool
+
+    def run(self, repo_path: Path, files: List[str]) -> Iterator[List[IndexedFile]]:
+        """Parses and splits the given files
+
+        Args:
+            repo_path (Path): The root of the repository
+            files (List[str]): Relative paths of the files to index
+
+        Yields:
+            Iterator[List[IndexedFile]]: Batches of parsed files holding about batch_size chunks each.
+                A file's chunks are never split across batches.
+        """
+        start = time.perf_counter()
+        num_files, num_chunks = 0, 0
+        batch: List[IndexedFile] = []
+        batch_chunks = 0
+        consumer_time = 0.0
+        for indexed_file in self._parse_files(repo_path, files):
+            num_files += 1
+            num_chunks += len(indexed_file.chunks)
+            batch.append(indexed_file)
+            batch_chunks += len(indexed_file.chunks)
+            if batch_chunks >= self._batch_size:
+                yield_start = time.perf_counter()
+                yield batch
+                consumer_time += time.perf_counter() - yield_start
+                batch, batch_chunks = [], 0
+        if batch:
+            yield_start = time.perf_counter()
+            yield batch
+            consumer_time += time.perf_counter() - yield_start
+
+        # Leave out the time the consumer spent on each batch so this is the parse rate alone
+        elapsed = max(time.perf_counter() - start - consumer_time, 1e-9)
+        logger.info(
+            f"Parse and split stage: {num_files} files, {num_chunks} chunks in {elapsed:0.1f} sec "
+            f"({num_files / elapsed:0.1f} files/s, {num_chunks / elapsed:0.1f} chunks/s)"
+        )
+
+    def _parse_files(self, repo_path: Path, files: List[str]) -> Iterator[IndexedFile]:
+        work = ((str(Path(repo_path, rel_path)), rel_path) for rel_path in files)
+
+        if self._max_workers == 1 or len(files) < self._min_files_for_pool:
+            # Not worth paying for the process pool start-up
+            for args in work:
+                yield parse_and_split(*args)
+            return
+
+        max_in_flight = self._max_workers * 2
+        logger.debug(f"Parsing {len(files)} files with {self._max_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=self._max_workers) as executor:
+            in_flight: set[Future] = set()
+            for args in work:
+                in_flight.add(executor.submit(parse_and_split, *args))
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in wait(in_flight).done:
+                yield future.result()
@@ -0,0 +1,187 @@
+from typing import Dict, List, Iterable, Optional
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 2  # 2 added the chunk id to the metadata of the stored chunks
+
+
+def hash_file(path: Path) -> str:
+    """Hashes the content of a file
+
+    Args:
+        path (Path): The file to hash
+
+    Returns:
+        str: The hex sha256 digest of the file's content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    """What we know about a single indexed file"""
+    content_hash: str
+    chunk_ids: List[str] = field(default_factory=list)
+    mtime_ns: int = 0
+    size: int = 0
+
+
+@dataclass
+class ManifestDiff:
+    """The files that need to be (re)indexed or dropped on a refresh"""
+    added: Dict[str, str] = field(default_factory=dict)  # relative path -> content hash
+    changed: Dict[str, str] = field(default_factory=dict)  # relative path -> content hash
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed, {self.unchanged} unchanged"
+
+
+class CodeManifest():
+    """Maps each indexed file of a repository to its content hash and the ids of its chunks
+
+    This is persisted next to the vector store so a refresh only needs to parse, split and
+    embed the files that were added or changed since the previous refresh.
+
+    A manifest is versioned like the index it describes: a refresh changes a copy with the
+    next revision, and the manifest of a published index is never changed again.
+    """
+
+    def __init__(self, index_path: Path, load: bool = True):
+        self._path = Path(index_path, MANIFEST_FILE_NAME)
+        self._entries: Dict[str, ManifestEntry] = {}
+        self.generation = 0  # The vector store collection holding these chunks
+        self.revision = 0  # Counts the refreshes that changed the index
+        if load:
+            self.load()
+
+    def load(self):
+        """Loads the manifest from disk if it exists"""
+        self._entries = {}
+        if not self._path.exists():
+            return
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != MANIFEST_VERSION:
+                logger.warning(f"Ignoring manifest with unsupported version: {self._path}")
+                return
+            self._entries = {path: ManifestEntry(**entry) for path, entry in data.get('files', {}).items()}
+            self.generation = data.get('generation', 0)
+            self.revision = data.get('revision', 0)
+            logger.info(f"Loaded code manifest with {len(self._entries)} files from {self._path}")
+        except Exception as e:
+            # A broken manifest only costs us a full re-index
+            logger.warning(f"Unable to load code manifest [{self._path}], starting over. Error message: {e}")
+            self._entries = {}
+
+    def save(self):
+        """Writes the manifest to disk atomically"""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'version': MANIFEST_VERSION,
+            'generation': self.generation,
+            'revision': self.revision,
+            'files': {path: vars(entry) for path, entry in self._entries.items()},
+        }
+        tmp_path = self._path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path)
+
+    def delete(self):
+        """Deletes the manifest from disk, so the index it describes is no longer trusted"""
+        self._path.unlink(missing_ok=True)
+
+    def copy(self) -> "CodeManifest":
+        """Starts the next revision of the manifest
+
+        Returns:
+            CodeManifest: A copy that can be changed without changing this manifest
+        """
+        manifest = CodeManifest(self._path.parent, load=False)
+        manifest._entries = dict(self._entries)  # Entries are frozen, so they can be shared
+        manifest.generation = self.generation
+        manifest.revision = self.revision + 1
+        return manifest
+
+    def diff(self, repo_path: Path, files: Iterable[Path], paths: Optional[Iterable[Path]] = None) -> ManifestDiff:
+        """Compares the files on disk against the manifest
+
+        Files whose modification time and size haven't changed are not re-hashed.
+
+        Args:
+            repo_path (Path): The root of the repository
+            files (Iterable[Path]): The files currently in the repository
+            paths (Optional[Iterable[Path]], optional): Restricts removal detection to these
+                files when only part of the repository was scanned. Defaults to None.
+
+        Returns:
+            ManifestDiff: The added, changed and removed files
+        """
+        diff = ManifestDiff()
+        seen = set()
+        for file in files:
+            rel_path = Path(file).relative_to(repo_path).as_posix()
+            seen.add(rel_path)
+            stat = os.stat(file)
+            entry = self._entries.get(rel_path)
+            if entry and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                diff.unchanged += 1
+                continue
+
+            content_hash = hash_file(file)
+            if entry is None:
+                diff.added[rel_path] = content_hash
+            elif entry.content_hash != content_hash:
+                diff.changed[rel_path] = content_hash
+            else:
+                # Touched but identical, just remember the new stat
+                self._entries[rel_path] = replace(entry, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                diff.unchanged += 1
+
+        candidates = self._entries.keys() if paths is None else [Path(p).relative_to(repo_path).as_posix() for p in paths]
+        diff.removed = [p for p in candidates if p in self._entries and p not in seen]
+        return diff
+
+    def get_all_chunk_ids(self) -> List[str]:
+        return [chunk_id for entry in self._entries.values() for chunk_id in entry.chunk_ids]
+
+    def get_chunk_ids(self, rel_paths: Iterable[str]) -> List[str]:
+        """Gets the chunk ids of the given files
+
+        Args:
+            rel_paths (Iterable[str]): Paths relative to the repository root
+
+        Returns:
+            List[str]: All the chunk ids of those files
+        """
+        ids = []
+        for rel_path in rel_paths:
+            entry = self._entries.get(rel_path)
+            if entry:
+                ids += entry.chunk_ids
+        return ids
+
+    def update(self, rel_path: str, content_hash: str, chunk_ids: List[str], mtime_ns: int, size: int):
+        self._entries[rel_path] = ManifestEntry(content_hash, list(chunk_ids), mtime_ns, size)
+
+    def remove(self, rel_path: str):
+        self._entries.pop(rel_path, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
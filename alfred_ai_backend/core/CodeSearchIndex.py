@@ -0,0 +1,212 @@
+from typing import Dict, List, Set, Tuple, Iterable, Optional
+from collections import Counter, defaultdict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from alfred_ai_backend.core.HashingEmbeddings import tokenize_code
+import logging
+import heapq
+import math
+import time
+import re
+
+logger = logging.getLogger(__name__)
+_SYMBOL_RE = re.compile(r"^\s*(?:async\s+)?(?:def|class)\s+([A-Za-z_][A-Za-z0-9_]*)", re.MULTILINE)
+_IDENTIFIER_QUERY_RE = re.compile(r"^\s*[A-Za-z_][A-Za-z0-9_.]*(?:\(\))?\s*$")
+
+
+class LexicalIndex():
+    """In-memory inverted index over code tokens with BM25 scoring
+
+    Also keeps a symbol table of the functions and classes defined in each chunk so an
+    exact identifier can be looked up directly.
+
+    An index is only changed before it's published to readers. A refresh changes a copy,
+    which shares the posting lists and symbol sets of this index and only copies the ones
+    it changes, so searches never wait on a refresh.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self._k1 = k1
+        self._b = b
+        self._postings: Dict[str, Dict[str, int]] = {}  # token -> chunk id -> term frequency
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._documents: Dict[str, Document] = {}
+        self._tokens: Dict[str, List[str]] = {}
+        self._symbols: Dict[str, Set[str]] = {}  # lower case symbol -> chunk ids
+        # The posting lists and symbol sets this index owns, the others are shared with the index it was copied from
+        self._owned_postings: Set[str] = set()
+        self._owned_symbols: Set[str] = set()
+
+    def copy(self) -> "LexicalIndex":
+        """Starts the next generation of the index
+
+        Returns:
+            LexicalIndex: A copy that can be changed without changing this index
+        """
+        index = LexicalIndex(self._k1, self._b)
+        index._postings = dict(self._postings)
+        index._lengths = dict(self._lengths)
+        index._total_length = self._total_length
+        index._documents = dict(self._documents)
+        index._tokens = dict(self._tokens)
+        index._symbols = dict(self._symbols)
+        return index
+
+    def add(self, ids: Iterable[str], documents: Iterable[Document]):
+        for doc_id, document in zip(ids, documents):
+            if doc_id in self._documents:
+                self.remove([doc_id])
+            counts = Counter(tokenize_code(document.page_content))
+            for token, count in counts.items():
+                self._get_own_postings(token)[doc_id] = count
+            length = sum(counts.values())
+            self._lengths[doc_id] = length
+            self._total_length += length
+            self._documents[doc_id] = document
+            self._tokens[doc_id] = list(counts)
+            for symbol in _SYMBOL_RE.findall(document.page_content):
+                self._get_own_symbols(symbol.lower()).add(doc_id)
+
+    def remove(self, ids: Iterable[str]):
+        for doc_id in ids:
+            document = self._documents.pop(doc_id, None)
+            if document is None:
+                continue
+            for token in self._tokens.pop(doc_id):
+                postings = self._get_own_postings(token)
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._owned_postings.discard(token)
+            self._total_length -= self._lengths.pop(doc_id)
+            for symbol in _SYMBOL_RE.findall(document.page_content):
+                chunk_ids = self._get_own_symbols(symbol.lower())
+                chunk_ids.discard(doc_id)
+                if not chunk_ids:
+                    del self._symbols[symbol.lower()]
+                    self._owned_symbols.discard(symbol.lower())
+
+    def _get_own_postings(self, token: str) -> Dict[str, int]:
+        if token not in self._owned_postings:
+            self._postings[token] = dict(self._postings.get(token, {}))
+            self._owned_postings.add(token)
+        return self._postings[token]
+
+    def _get_own_symbols(self, symbol: str) -> Set[str]:
+        if symbol not in self._owned_symbols:
+            self._symbols[symbol] = set(self._symbols.get(symbol, ()))
+            self._owned_symbols.add(symbol)
+        return self._symbols[symbol]
+
+    def lookup_symbol(self, name: str) -> List[Document]:
+        """Finds the chunks that define a function or class
+
+        Args:
+            name (str): The symbol, optionally dotted (e.g. `CodeDatabase.refresh_database`)
+
+        Returns:
+            List[Document]: The chunks defining the symbol
+        """
+        name = name.strip().rstrip('()').split('.')[-1].lower()
+        return [self._documents[doc_id] for doc_id in sorted(self._symbols.get(name, ()))]
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[Document, float]]:
+        """Scores the chunks against the query with BM25
+
+        Args:
+            query (str): The query
+            k (int, optional): Number of results. Defaults to 8.
+
+        Returns:
+            List[Tuple[Document, float]]: The best chunks and their scores
+        """
+        tokens = set(tokenize_code(query))
+        num_docs = len(self._documents)
+        if num_docs == 0:
+            return []
+        avg_length = self._total_length / num_docs
+        scores: Dict[str, float] = defaultdict(float)
+        for token in tokens:
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self._k1 * (1 - self._b + self._b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self._k1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self._documents[doc_id], score) for doc_id, score in best]
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._documents
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+
+class HybridCodeRetriever(BaseRetriever):
+    """Fuses BM25 results from the lexical index with the vector store results
+
+    A query that is just an identifier which the symbol table knows is answered from
+    the symbol table alone, without calling the embedding model.
+
+    The vector store is shared by every generation of the index and holds the chunks of a
+    refresh before it's published, so vector results are kept only if the lexical index of
+    this generation has their chunk id.
+    """
+    vector_retriever: BaseRetriever
+    lexical_index: LexicalIndex
+    k: int = 8
+    rrf_k: int = 60  # Dampens the advantage of the very top ranks in reciprocal rank fusion
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        start = time.perf_counter()
+        if _IDENTIFIER_QUERY_RE.match(query):
+            documents = self.lexical_index.lookup_symbol(query)
+            if documents:
+                logger.debug(f"Symbol lookup of '{query}' found {len(documents)} chunks in {(time.perf_counter() - start) * 1e6:0.0f} us")
+                return documents[:self.k]
+
+        lexical_results = [document for document, _ in self.lexical_index.search(query, self.k)]
+        lexical_time = time.perf_counter() - start
+        vector_results = self.vector_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        vector_results = [document for document in vector_results if document.metadata.get('chunk_id') in self.lexical_index]
+        documents = self._fuse([lexical_results, vector_results])
+        logger.debug(
+            f"Hybrid search of '{query}': lexical {lexical_time * 1e3:0.2f} ms, "
+            f"total {(time.perf_counter() - start) * 1e3:0.1f} ms"
+        )
+        return documents
+
+    def _fuse(self, rankings: List[List[Document]]) -> List[Document]:
+        """Reciprocal rank fusion of several rankings"""
+        scores: Dict[Tuple[str, str], float] = defaultdict(float)
+        documents: Dict[Tuple[str, str], Document] = {}
+        for ranking in rankings:
+            for rank, document in enumerate(ranking):
+                key = (document.metadata.get('source', ''), document.page_content)
+                scores[key] += 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, document)
+        best = heapq.nlargest(self.k, scores.items(), key=lambda item: item[1])
+        return [documents[key] for key, _ in best]
+
+
+def build_lexical_index(ids: List[str], documents: List[Document]) -> Tuple[LexicalIndex, float]:
+    """Builds a lexical index and times it
+
+    Args:
+        ids (List[str]): The chunk ids
+        documents (List[Document]): The chunks
+
+    Returns:
+        Tuple[LexicalIndex, float]: The index and the seconds it took to build
+    """
+    start = time.perf_counter()
+    index = LexicalIndex()
+    index.add(ids, documents)
+    return index, time.perf_counter() - start
@@ -0,0 +1,122 @@
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+from pathlib import Path
+import logging
+import threading
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+FileStat = Tuple[int, int]  # mtime_ns, size
+
+
+class _WatchedRepo():
+    def __init__(self, stats: Dict[Path, FileStat]):
+        self.stats = stats
+        self.touched: Set[Path] = set()
+        self.first_change = 0.0
+        self.last_change = 0.0
+
+
+class CodeWatcher():
+    """Polls repositories for changed files and reports them once writes have settled
+
+    The modification time and size of every code file are compared on each poll. Bursts of
+    writes, like an agent writing several files in a row, are debounced into a single
+    change notification with all the touched files.
+    """
+
+    def __init__(
+        self,
+        discover_files: Callable[[Path], Iterable[Path]],
+        on_change: Callable[[Path, Set[Path]], None],
+        poll_seconds: float = 1.0,
+        debounce_seconds: float = 2.0,
+        max_delay_seconds: float = 20.0,
+    ):
+        """
+        Args:
+            discover_files (Callable[[Path], Iterable[Path]]): Lists the code files of a repository
+            on_change (Callable[[Path, Set[Path]], None]): Called with a repository and its touched files
+            poll_seconds (float, optional): Time between polls. Defaults to 1.0.
+            debounce_seconds (float, optional): How long writes must have stopped before reporting. Defaults to 2.0.
+            max_delay_seconds (float, optional): Reports changes anyway after this long, even if
+                writes never stop. Defaults to 20.0.
+        """
+        self._discover_files = discover_files
+        self._on_change = on_change
+        self._poll_seconds = poll_seconds
+        self._debounce_seconds = debounce_seconds
+        self._max_delay_seconds = max_delay_seconds
+        self._repos: Dict[Path, _WatchedRepo] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, repo_path: Path):
+        """Starts watching a repository, does nothing if it's already watched
+
+        Args:
+            repo_path (Path): The root of the repository
+        """
+        with self._lock:
+            if repo_path in self._repos:
+                return
+        stats = self._stat_files(repo_path)
+        with self._lock:
+            self._repos.setdefault(repo_path, _WatchedRepo(stats))
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="CodeWatcher", daemon=True)
+                self._thread.start()
+        logger.info(f"Watching {len(stats)} files of {repo_path} for changes")
+
+    def unwatch(self, repo_path: Path):
+        with self._lock:
+            self._repos.pop(repo_path, None)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self._poll_seconds):
+            with self._lock:
+                repos = list(self._repos.items())
+            for repo_path, repo in repos:
+                try:
+                    self._poll(repo_path, repo)
+                except Exception as e:
+                    logger.warning(f"Unable to poll {repo_path} for changes. Error message: {e}")
+
+    def _poll(self, repo_path: Path, repo: _WatchedRepo):
+        start = time.perf_counter()
+        stats = self._stat_files(repo_path)
+        changed = {path for path, stat in stats.items() if repo.stats.get(path) != stat}
+        changed.update(path for path in repo.stats if path not in stats)
+        repo.stats = stats
+        logger.debug(f"Polled {len(stats)} files of {repo_path} in {(time.perf_counter() - start) * 1e3:0.1f} ms")
+
+        now = time.monotonic()
+        if changed:
+            if not repo.touched:
+                repo.first_change = now
+            repo.touched |= changed
+            repo.last_change = now
+
+        settled = now - repo.last_change >= self._debounce_seconds
+        overdue = now - repo.first_change >= self._max_delay_seconds
+        if repo.touched and (settled or overdue):
+            touched, repo.touched = repo.touched, set()
+            logger.info(f"{len(touched)} files changed in {repo_path}")
+            self._on_change(repo_path, touched)
+
+    def _stat_files(self, repo_path: Path) -> Dict[Path, FileStat]:
+        stats = {}
+        for path in self._discover_files(repo_path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted between listing and stat, the next poll reports it
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
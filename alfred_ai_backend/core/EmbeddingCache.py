@@ -0,0 +1,196 @@
+from typing import Dict, List, Optional, Any
+from langchain_core.embeddings import Embeddings
+from pathlib import Path
+import numpy as np
+import threading
+import sqlite3
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+CACHE_FILE_NAME = "embeddings.sqlite"
+SQL_BATCH_SIZE = 500  # Keys per query, under SQLite's limit of bound parameters
+SAVE_INTERVAL_SECONDS = 30
+BUSY_TIMEOUT_SECONDS = 30  # How long to wait for another process writing to the cache
+
+
+def get_embeddings_model_name(embeddings: Embeddings) -> str:
+    """Gets a name that identifies the vectors an embeddings object produces
+
+    Args:
+        embeddings (Embeddings): The embeddings object
+
+    Returns:
+        str: The model name if the embeddings object has one, otherwise its class name
+    """
+    for attr in ('model', 'model_name', 'model_path'):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            return f"{type(embeddings).__name__}:{value}"
+    return type(embeddings).__name__
+
+
+class EmbeddingCache():
+    """Persistent store of embedding vectors keyed by text hash and model name
+
+    The vectors are kept as float32 blobs in SQLite, so each batch of new vectors is written
+    in one small transaction instead of rewriting the whole index. When the cache is full,
+    the least recently used vectors are deleted. The times vectors were last used are kept
+    in memory and written with the next batch, or by `save`.
+
+    Batch workers are separate processes sharing the same cache. SQLite serializes their
+    writes, and the cache is counted again in each write so every process evicts against
+    what all of them stored.
+    """
+
+    def __init__(self, folder: Path, model_name: str, max_bytes: int):
+        model_key = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:12]
+        self._folder = Path(folder, model_key)
+        self._model_name = model_name
+        self._max_bytes = max_bytes
+        self._dim: int = None
+        self._count = 0
+        self._used: Dict[str, float] = {}  # key -> last used, not written yet
+        self._last_save = time.time()
+        self._folder.mkdir(parents=True, exist_ok=True)
+        path = Path(self._folder, CACHE_FILE_NAME)
+        # The lock of CachedEmbeddings keeps the threads from sharing a cursor, and other
+        # processes writing to the cache are waited for
+        self._conn = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COUNT(*), MAX(LENGTH(vector)) FROM embeddings").fetchone()
+        self._count = row[0]
+        self._dim = row[1] // 4 if row[1] else None
+        if self._count:
+            logger.info(f"Loaded embedding cache with {self._count} vectors from {self._folder}")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Gets the cached vectors of the keys, None for the ones that aren't cached"""
+        found: Dict[str, bytes] = {}
+        for i in range(0, len(keys), SQL_BATCH_SIZE):
+            batch = keys[i:i + SQL_BATCH_SIZE]
+            query = f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})"
+            found.update(self._conn.execute(query, batch).fetchall())
+        now = time.time()
+        for key in found:
+            self._used[key] = now
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        """Caches new vectors in one transaction, evicting the least recently used ones if full"""
+        if self._dim is None and vectors:
+            self._dim = len(vectors[0])
+        rows = []
+        now = time.time()
+        for key, vector in zip(keys, vectors):
+            if len(vector) != self._dim:
+                logger.warning(f"Not caching embedding with dimension {len(vector)}, expected {self._dim}")
+                continue
+            rows.append((key, np.asarray(vector, dtype=np.float32).tobytes(), now))
+        if self.capacity == 0 or not rows:
+            return
+        with self._conn:
+            self._write_used()
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            # Within the write transaction, so it includes what other processes stored
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.capacity:
+                self._evict(self._count - self.capacity + max(1, self.capacity // 10))
+        self._last_save = now
+
+    @property
+    def capacity(self) -> int:
+        """The maximum number of vectors that fit in the cache"""
+        return self._max_bytes // (self._dim * 4) if self._dim else 0
+
+    def save(self, force: bool = True):
+        """Writes the times the vectors were last used
+
+        Args:
+            force (bool, optional): Write them even if they were written less than
+                SAVE_INTERVAL_SECONDS ago. Defaults to True.
+        """
+        if not self._used or (not force and time.time() - self._last_save < SAVE_INTERVAL_SECONDS):
+            return
+        with self._conn:
+            self._write_used()
+        self._last_save = time.time()
+
+    def _write_used(self):
+        if self._used:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(used, key) for key, used in self._used.items()])
+            self._used = {}
+
+    def _evict(self, count: int):
+        """Deletes the least recently used vectors"""
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (count,)
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.debug(f"Evicted {count} vectors from the embedding cache")
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings object so that previously embedded texts are served from disk"""
+
+    def __init__(self, embeddings: Embeddings, folder: str, max_size_mb: int = 512, model_name: Optional[str] = None):
+        self._embeddings = embeddings
+        model_name = model_name if model_name else get_embeddings_model_name(embeddings)
+        self._cache = EmbeddingCache(Path(folder), model_name, int(max_size_mb * 1024 * 1024))
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._cache.key(text) for text in texts]
+        with self._lock:
+            vectors = self._cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        missing_set = set(missing)
+
+        if missing:
+            new_vectors = self._embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            with self._lock:
+                self._cache.put_many([keys[i] for i in missing], new_vectors)
+        else:
+            with self._lock:
+                self._cache.save(force=False)
+
+        with self._lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+            self._bytes_saved += sum(len(text.encode('utf-8')) for i, text in enumerate(texts) if i not in missing_set)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embeddings.embed_query(text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Gets the cache statistics since the last reset
+
+        Returns:
+            Dict[str, Any]: The hits, misses, hit ratio and the bytes of text that didn't need to be embedded
+        """
+        total = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': self._hits / total if total else 0.0,
+            'bytes_saved': self._bytes_saved,
+        }
+
+    def reset_stats(self):
+        self._hits = 0
+        self._misses = 0
+        self._bytes_saved = 0
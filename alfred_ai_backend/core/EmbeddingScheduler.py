@@ -0,0 +1,159 @@
+from typing import Dict, List, Optional, Any
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import threading
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket():
+    """Thread-safe token bucket that blocks until the requested amount is available"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self._rate = rate_per_minute / 60.0
+        self._capacity = capacity if capacity else rate_per_minute
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        # Never wait forever on a request larger than the bucket
+        amount = min(amount, self._capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Checks if an error is a 429 (too many requests) response
+
+    Args:
+        error (Exception): The error raised by the embeddings client
+
+    Returns:
+        bool: True if the request was rate limited
+    """
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    if getattr(getattr(error, 'response', None), 'status_code', None) == 429:
+        return True
+    return type(error).__name__ == 'RateLimitError'
+
+
+class EmbeddingScheduler(Embeddings):
+    """Sends embedding requests in batches with a bounded number of requests in flight
+
+    Requests are paced with token buckets for requests and tokens per minute.  When the
+    server responds with 429, every worker backs off before the next request.
+
+    Backends that aren't thread safe, like a llama.cpp context, get one call at a time,
+    including the queries of agents searching while the index is being refreshed.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = 64,
+        max_in_flight: int = 4,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        thread_safe: bool = True,
+    ):
+        self._embeddings = embeddings
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight if thread_safe else 1
+        self._backend_lock = nullcontext() if thread_safe else threading.Lock()
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._max_retries = max_retries
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = [texts[i:i + self._batch_size] for i in range(0, len(texts), self._batch_size)]
+        if len(batches) == 1 or self._max_in_flight == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self._max_in_flight, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        vectors = [vector for batch_vectors in results for vector in batch_vectors]
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._embeddings_count += len(vectors)
+            self._elapsed += elapsed
+        logger.debug(f"Embedded {len(vectors)} texts in {len(batches)} requests ({len(vectors) / max(elapsed, 1e-9):0.1f} embeddings/s)")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._backend_lock:
+            return self._embeddings.embed_query(text)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        backoff = self._initial_backoff
+        for attempt in range(self._max_retries + 1):
+            self._wait_for_capacity(texts)
+            try:
+                with self._lock:
+                    self._requests += 1
+                with self._backend_lock:
+                    return self._embeddings.embed_documents(texts)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self._max_retries:
+                    raise
+                # Full jitter so the workers don't all retry at once
+                delay = random.uniform(backoff / 2, backoff)
+                with self._lock:
+                    self._rate_limited += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Embedding request rate limited, backing off for {delay:0.1f} sec (attempt {attempt + 1})")
+                backoff = min(backoff * 2, self._max_backoff)
+
+    def _wait_for_capacity(self, texts: List[str]):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        if self._request_bucket:
+            self._request_bucket.acquire()
+        if self._token_bucket:
+            # Roughly 4 characters per token is close enough for pacing
+            self._token_bucket.acquire(sum(len(text) for text in texts) / 4)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Gets the scheduler statistics since the last reset
+
+        Returns:
+            Dict[str, Any]: The embeddings, requests, rate limited responses and achieved embeddings/sec
+        """
+        return {
+            'embeddings': self._embeddings_count,
+            'requests': self._requests,
+            'rate_limited': self._rate_limited,
+            'embeddings_per_sec': self._embeddings_count / self._elapsed if self._elapsed else 0.0,
+        }
+
+    def reset_stats(self):
+        self._embeddings_count = 0
+        self._requests = 0
+        self._rate_limited = 0
+        self._elapsed = 0.0
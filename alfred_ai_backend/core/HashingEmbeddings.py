@@ -0,0 +1,76 @@
+from typing import List, Iterator
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import keyword
+import zlib
+import re
+
+# Identifiers, then split into their snake_case and camelCase parts
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_PART_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+# Tokens that are in almost every chunk of python code and say little about it.
+# The weights are fixed instead of learned so vectors never drift between refreshes.
+_COMMON_TOKENS = set(keyword.kwlist) | {"self", "cls", "none", "true", "false", "str", "int", "dict", "list", "args", "kwargs"}
+_COMMON_TOKEN_WEIGHT = 0.2
+
+
+def tokenize_code(text: str) -> Iterator[str]:
+    """Splits code into lower case identifiers and the parts of compound identifiers
+
+    For example `get_model_type` yields `get_model_type`, `get`, `model` and `type`.
+
+    Args:
+        text (str): The code
+
+    Yields:
+        Iterator[str]: The tokens
+    """
+    for identifier in _IDENTIFIER_RE.findall(text):
+        yield identifier.lower()
+        parts = _PART_RE.findall(identifier)
+        if len(parts) > 1:
+            for part in parts:
+                yield part.lower()
+
+
+class HashingEmbeddings(Embeddings):
+    """Fully local embeddings using hashed, sublinear term frequencies of code tokens
+
+    Runs on the CPU with NumPy alone so refreshing the code database needs no network
+    and has predictable latency.  Similar to a TF-IDF vectorizer with the hashing trick,
+    but with fixed token weights so the vector of a chunk never changes.
+    """
+
+    def __init__(self, n_features: int = 1024, batch_size: int = 256):
+        self.n_features = n_features
+        self.batch_size = batch_size
+        self.model = f"hashing-tf-{n_features}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors += self._embed_batch(texts[i:i + self.batch_size]).tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0].tolist()
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            indices, signs, weights = [], [], []
+            for token in tokenize_code(text):
+                # crc32 is stable across processes, unlike hash()
+                h = zlib.crc32(token.encode('utf-8'))
+                indices.append(h % self.n_features)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+                weights.append(_COMMON_TOKEN_WEIGHT if token in _COMMON_TOKENS else 1.0)
+            if indices:
+                np.add.at(matrix[row], indices, np.multiply(signs, weights))
+
+        # Sublinear term frequency, keeping the sign from the hashing trick
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
@@ -0,0 +1,164 @@
+from typing import Any, Dict, Optional
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from langchain_core._api.beta_decorator import LangChainBetaWarning
+from alfred_ai_backend.core.Config import Config
+from pathlib import Path
+import threading
+import sqlite3
+import hashlib
+import logging
+import warnings
+import time
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+
+_cache: Optional["LlmResponseCache"] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_response_cache() -> Optional["LlmResponseCache"]:
+    """Gets the response cache shared by all LLMs of this process
+
+    Returns:
+        Optional[LlmResponseCache]: The cache, or None if `llm_cache` isn't enabled in the config
+    """
+    global _cache
+    cache_config = root_config.get('llm_cache') or {}
+    if not cache_config.get('enabled', False):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LlmResponseCache(
+                Path(cache_config.get('file', '.alfred_cache/llm_responses.sqlite')),
+                max_size_mb=cache_config.get('max_size_mb', 256),
+                ttl_hours=cache_config.get('ttl_hours'),
+            )
+        return _cache
+
+
+class LlmResponseCache(BaseCache):
+    """Persistent cache of LLM responses in SQLite
+
+    LangChain looks responses up by the rendered prompt and a string describing the LLM
+    call, which holds the model name and settings, the stop words and any bound tools.
+    Both are hashed into the key.  Entries expire after `ttl_hours`, and when the cache
+    grows over `max_size_mb` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: Path, max_size_mb: float = 256, ttl_hours: Optional[float] = None):
+        self._path = Path(path)
+        self._max_bytes = int(max_size_mb * 1024 * 1024)
+        self._ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+        self._lock = threading.Lock()
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Agents call the LLM from several threads, the lock keeps them from sharing a cursor
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.reset_stats()
+        logger.info(f"Opened LLM response cache [{self._path}] with {self._size / 1024 / 1024:0.1f} MB of responses")
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._ttl_seconds and now - row[2] > self._ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._size -= row[1]
+                row = None
+            if row is None:
+                self._misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', LangChainBetaWarning)
+                generations = loads(row[0])
+            for generation in generations:
+                # So token accounting knows that nothing was spent on it. Not on the message,
+                # which the agent keeps in its scratchpad, so the next prompt is the same as
+                # the first time and hits the cache too
+                generation.generation_info = {**(generation.generation_info or {}), 'cached': True}
+        except Exception as e:
+            logger.warning(f"Unable to load a cached LLM response, calling the LLM instead. Error message: {e}")
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.key(prompt, llm_string)
+        value = dumps(list(return_val))
+        size = len(value.encode('utf-8'))
+        if size > self._max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self._max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Gets the cache statistics since the last reset
+
+        Returns:
+            Dict[str, Any]: The hits, misses, hit ratio and the size of the cache in bytes
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / total if total else 0.0,
+                'size_bytes': self._size,
+            }
+
+    def reset_stats(self):
+        self._hits = 0
+        self._misses = 0
+
+    def _evict(self):
+        """Deletes expired entries, then the least recently used ones until the cache fits"""
+        if self._ttl_seconds:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self._ttl_seconds,))
+        # Evict down to 90% so that every new response doesn't cause another eviction
+        target = self._max_bytes * 0.9
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self._size <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} responses from the LLM response cache")
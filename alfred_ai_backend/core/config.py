@@ -24,6 +24,10 @@ class Config(metaclass=SingletonMeta):
     
     def get(self, key: str, default: Any = None) -> Any:
         return self.config.get(key, default)
+
+    def set(self, key: str, value: Any):
+        """Overrides a value for this run, like from a command line flag"""
+        self.config[key] = value
     
     def __contains__(self, key):
         return key in self.config
@@ -0,0 +1,144 @@
+from pathlib import Path
+import tempfile
+import unittest
+import json
+import os
+from alfred_ai_backend.core.Config import Config, SingletonMeta
+from alfred_ai_backend.core.CodeManifest import CodeManifest, MANIFEST_FILE_NAME, hash_file
+
+
+class TestCodeManifest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = Path(tmp.name, "repo")
+        self.repo.mkdir()
+        self.index = Path(tmp.name, "index")
+
+    def write(self, name: str, text: str) -> Path:
+        path = Path(self.repo, name)
+        path.write_text(text)
+        return path
+
+    def index_files(self, manifest: CodeManifest, *names: str):
+        for name in names:
+            path = Path(self.repo, name)
+            stat = os.stat(path)
+            manifest.update(name, hash_file(path), [f"{name}:0"], stat.st_mtime_ns, stat.st_size)
+
+    def test_diff(self):
+        manifest = CodeManifest(self.index, load=False)
+        self.write("same.py", "a = 1\n")
+        self.write("changed.py", "b = 1\n")
+        self.write("removed.py", "c = 1\n")
+        self.index_files(manifest, "same.py", "changed.py", "removed.py")
+
+        changed = self.write("changed.py", "b = 2\n")
+        os.utime(changed, ns=(1, 1))  # Never mistaken for unchanged by its stat
+        os.remove(Path(self.repo, "removed.py"))
+        added = self.write("added.py", "d = 1\n")
+
+        diff = manifest.diff(self.repo, sorted(self.repo.iterdir()))
+
+        self.assertEqual(diff.added, {"added.py": hash_file(added)})
+        self.assertEqual(diff.changed, {"changed.py": hash_file(changed)})
+        self.assertEqual(diff.removed, ["removed.py"])
+        self.assertEqual(diff.unchanged, 1)
+
+    def test_touched_but_identical_file_is_unchanged(self):
+        manifest = CodeManifest(self.index, load=False)
+        path = self.write("touched.py", "a = 1\n")
+        self.index_files(manifest, "touched.py")
+        os.utime(path, ns=(10 ** 18, 10 ** 18))
+
+        diff = manifest.diff(self.repo, [path])
+
+        self.assertTrue(diff.is_empty())
+        self.assertEqual(diff.unchanged, 1)
+        # The new stat is remembered, so the next diff doesn't hash the file again
+        manifest.save()
+        self.assertEqual(json.loads(Path(self.index, MANIFEST_FILE_NAME).read_text())['files']['touched.py']['mtime_ns'], 10 ** 18)
+
+    def test_paths_restrict_removal(self):
+        manifest = CodeManifest(self.index, load=False)
+        self.write("a.py", "a = 1\n")
+        self.write("b.py", "b = 1\n")
+        self.index_files(manifest, "a.py", "b.py")
+        os.remove(Path(self.repo, "a.py"))
+        os.remove(Path(self.repo, "b.py"))
+
+        diff = manifest.diff(self.repo, [], paths=[Path(self.repo, "a.py")])
+
+        self.assertEqual(diff.removed, ["a.py"])
+
+    def test_copy_doesnt_change_the_original(self):
+        manifest = CodeManifest(self.index, load=False)
+        self.write("a.py", "a = 1\n")
+        self.index_files(manifest, "a.py")
+
+        copy = manifest.copy()
+        copy.remove("a.py")
+
+        self.assertEqual(manifest.get_chunk_ids(["a.py"]), ["a.py:0"])
+        self.assertEqual(copy.revision, manifest.revision + 1)
+
+    def test_ignores_unsupported_version(self):
+        self.index.mkdir()
+        Path(self.index, MANIFEST_FILE_NAME).write_text(json.dumps({
+            'version': 0,
+            'files': {'a.py': {'content_hash': 'x', 'chunk_ids': ['a.py:0']}},
+        }))
+
+        manifest = CodeManifest(self.index)
+
+        self.assertEqual(len(manifest), 0)
+
+
+class TestIncrementalRefresh(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = Path(tmp.name, "repo")
+        self.repo.mkdir()
+        for i in range(3):
+            Path(self.repo, f"module_{i}.py").write_text(f"def function_{i}(x):\n    return x + {i}\n")
+
+        config = Config()
+        previous = config.get('code_database')
+        self.addCleanup(config.set, 'code_database', previous)
+        config.set('code_database', {
+            'index_folder': str(Path(tmp.name, "index")),
+            'embeddings': {'name': 'HashingEmbeddings', 'module': 'alfred_ai_backend.core.HashingEmbeddings'},
+            'indexing': {'max_workers': 1},
+        })
+        from alfred_ai_backend.core.CodeDatabase import CodeDatabase
+        SingletonMeta._instances.pop(CodeDatabase, None)
+        self.addCleanup(SingletonMeta._instances.pop, CodeDatabase, None)
+        self.db = CodeDatabase()
+
+    def stored_ids(self):
+        snapshot = self.db._get_snapshot(self.repo.resolve())
+        return set(snapshot.db.get(include=[])['ids'])
+
+    def test_only_reindexes_what_changed(self):
+        self.db.refresh_database(self.repo)
+        before = self.stored_ids()
+        self.assertEqual(len(before), 3)
+
+        Path(self.repo, "module_0.py").write_text("def function_0(x):\n    return x * 100\n")
+        os.remove(Path(self.repo, "module_1.py"))
+        self.db.refresh_database(self.repo)
+
+        after = self.stored_ids()
+        # The unchanged file keeps its chunk, the stale chunks are gone from the collection
+        self.assertEqual(len(after), 2)
+        self.assertEqual(before & after, {chunk_id for chunk_id in before if chunk_id.startswith("module_2.py")})
+        self.assertFalse(any(chunk_id.startswith("module_1.py") for chunk_id in after))
+        snapshot = self.db._get_snapshot(self.repo.resolve())
+        self.assertEqual(set(snapshot.manifest.get_all_chunk_ids()), after)
+        self.assertEqual(len(snapshot.lexical_index), 2)
+        self.assertIn("x * 100", snapshot.lexical_index.lookup_symbol("function_0")[0].page_content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from typing import List
+import unittest
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from alfred_ai_backend.core.CodeSearchIndex import LexicalIndex, HybridCodeRetriever
+
+
+def chunk(chunk_id: str, text: str) -> Document:
+    return Document(page_content=text, metadata={'source': chunk_id.split(':')[0], 'chunk_id': chunk_id})
+
+
+class ListRetriever(BaseRetriever):
+    """Returns the same documents for every query, like a vector store would rank them"""
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return list(self.documents)
+
+
+class TestLexicalIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = LexicalIndex()
+        self.chunks = [
+            chunk("db.py:0", "class CodeDatabase:\n    def refresh_database(self, repo_path):\n        refresh(repo_path)"),
+            chunk("manifest.py:0", "def diff(repo_path, files):\n    return files"),
+            chunk("util.py:0", "def helper():\n    return None"),
+        ]
+        self.index.add([c.metadata['chunk_id'] for c in self.chunks], self.chunks)
+
+    def test_bm25_ranks_the_most_relevant_chunk_first(self):
+        results = self.index.search("refresh repo_path")
+
+        self.assertEqual([document.metadata['chunk_id'] for document, _ in results], ["db.py:0", "manifest.py:0"])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_lookup_symbol(self):
+        for name in ["refresh_database", "CodeDatabase.refresh_database", "CodeDatabase.refresh_database()", "codedatabase"]:
+            with self.subTest(name=name):
+                self.assertEqual([d.metadata['chunk_id'] for d in self.index.lookup_symbol(name)], ["db.py:0"])
+        self.assertEqual(self.index.lookup_symbol("missing"), [])
+
+    def test_copy_doesnt_change_the_original(self):
+        copy = self.index.copy()
+        copy.remove(["db.py:0"])
+        copy.add(["new.py:0"], [chunk("new.py:0", "def diff_files(repo_path):\n    pass")])
+
+        self.assertNotIn("db.py:0", copy)
+        self.assertEqual(copy.lookup_symbol("refresh_database"), [])
+        self.assertEqual(len(copy.lookup_symbol("diff_files")), 1)
+        # The original still has its postings and symbols
+        self.assertIn("db.py:0", self.index)
+        self.assertNotIn("new.py:0", self.index)
+        self.assertEqual(len(self.index.lookup_symbol("refresh_database")), 1)
+        self.assertEqual(self.index.lookup_symbol("diff_files"), [])
+        self.assertEqual([d.metadata['chunk_id'] for d, _ in self.index.search("refresh")], ["db.py:0"])
+        self.assertEqual(len(self.index), 3)
+
+
+class TestHybridCodeRetriever(unittest.TestCase):
+    def test_drops_vector_results_of_other_generations(self):
+        index = LexicalIndex()
+        current = chunk("a.py:new:0", "def parse(): pass")
+        index.add(["a.py:new:0"], [current])
+        stale = chunk("a.py:old:0", "def parse_old(): pass")
+        retriever = HybridCodeRetriever(vector_retriever=ListRetriever(documents=[stale, current]), lexical_index=index)
+
+        documents = retriever.get_relevant_documents("how is parsing done")
+
+        self.assertEqual(documents, [current])
+
+    def test_reciprocal_rank_fusion(self):
+        a, b, c = chunk("a.py:0", "a"), chunk("b.py:0", "b"), chunk("c.py:0", "c")
+        retriever = HybridCodeRetriever(vector_retriever=ListRetriever(documents=[]), lexical_index=LexicalIndex(), k=3)
+
+        # b is second in both rankings, so it beats a and c which are first in only one
+        documents = retriever._fuse([[a, b], [c, b]])
+
+        self.assertEqual(documents[0], b)
+        self.assertEqual(set(d.metadata['chunk_id'] for d in documents[1:]), {"a.py:0", "c.py:0"})
+
+    def test_identifier_query_uses_the_symbol_table(self):
+        index = LexicalIndex()
+        definition = chunk("a.py:0", "def parse_file(path): pass")
+        index.add(["a.py:0"], [definition])
+
+        class FailingRetriever(BaseRetriever):
+            def _get_relevant_documents(self, query, *, run_manager):
+                raise AssertionError("The vector store shouldn't be searched")
+
+        retriever = HybridCodeRetriever(vector_retriever=FailingRetriever(), lexical_index=index)
+
+        self.assertEqual(retriever.get_relevant_documents("parse_file()"), [definition])
+
+
+if __name__ == '__main__':
+    unittest.main()
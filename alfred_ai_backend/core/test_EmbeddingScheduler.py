@@ -0,0 +1,120 @@
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+import time
+from langchain_core.embeddings import Embeddings
+from alfred_ai_backend.core.CodeDatabase import load_embeddings, is_thread_safe
+from alfred_ai_backend.core.EmbeddingScheduler import EmbeddingScheduler
+from alfred_ai_backend.core.utils.FakeEmbeddingsServer import FakeEmbeddingsServer, fake_embedding
+
+DIM = 8
+
+
+class ClientEmbeddings(Embeddings):
+    """Sends the texts with the OpenAI client of OpenAIEmbeddings
+
+    OpenAIEmbeddings tokenizes the texts with tiktoken first, which downloads its encoding,
+    so the tests call the client it configured directly.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self._embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        response = self._embeddings.client.create(input=texts, model=self._embeddings.model)
+        return [data.embedding for data in response.data]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class ConcurrencyTrackingEmbeddings(Embeddings):
+    """Records how many calls were running at the same time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = 0
+        self.max_running = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._running += 1
+            self.max_running = max(self.max_running, self._running)
+        time.sleep(0.01)
+        with self._lock:
+            self._running -= 1
+        return [fake_embedding(text, DIM) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class TestEmbeddingScheduler(unittest.TestCase):
+    def start_server(self, rate_limit_every: int) -> FakeEmbeddingsServer:
+        server = FakeEmbeddingsServer(port=0, dim=DIM, latency=0, rate_limit_every=rate_limit_every)
+        server.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def load_embeddings(self, server: FakeEmbeddingsServer):
+        return load_embeddings({
+            'name': 'OpenAIEmbeddings',
+            'module': 'langchain_openai',
+            'init': {
+                'openai_api_base': f"http://127.0.0.1:{server.server_address[1]}/v1",
+                'openai_api_key': 'fake',
+            },
+        })
+
+    def test_client_doesnt_retry(self):
+        server = self.start_server(rate_limit_every=0)
+        embeddings = self.load_embeddings(server)
+        self.assertEqual(embeddings.max_retries, 0)
+        self.assertEqual(embeddings.client._client.max_retries, 0)
+
+    def test_retries_rate_limited_requests(self):
+        server = self.start_server(rate_limit_every=3)
+        scheduler = EmbeddingScheduler(ClientEmbeddings(self.load_embeddings(server)), batch_size=2, max_in_flight=2, initial_backoff=0.01, max_backoff=0.05)
+        texts = [f"def function_{i}(): pass" for i in range(10)]
+
+        vectors = scheduler.embed_documents(texts)
+
+        self.assertEqual(len(vectors), len(texts))
+        for text, vector in zip(texts, vectors):
+            for value, expected in zip(vector, fake_embedding(text, DIM)):
+                self.assertAlmostEqual(value, expected, places=5)
+        stats = scheduler.get_stats()
+        self.assertGreater(stats['rate_limited'], 0)
+        self.assertEqual(stats['requests'], 5 + stats['rate_limited'])
+        # Every request the server saw was sent by the scheduler, none by the client retrying
+        self.assertEqual(server.requests, stats['requests'])
+
+    def test_gives_up_after_max_retries(self):
+        server = self.start_server(rate_limit_every=1)
+        scheduler = EmbeddingScheduler(ClientEmbeddings(self.load_embeddings(server)), max_retries=2, initial_backoff=0.01, max_backoff=0.05)
+
+        with self.assertRaises(Exception):
+            scheduler.embed_documents(["def f(): pass"])
+
+        self.assertEqual(scheduler.get_stats()['rate_limited'], 2)
+        self.assertEqual(server.requests, 3)
+
+    def test_serializes_backends_that_arent_thread_safe(self):
+        self.assertFalse(is_thread_safe({'name': 'LlamaCppEmbeddings'}))
+        self.assertTrue(is_thread_safe({'name': 'LlamaCppEmbeddings', 'thread_safe': True}))
+        embeddings = ConcurrencyTrackingEmbeddings()
+        scheduler = EmbeddingScheduler(embeddings, batch_size=2, max_in_flight=4, thread_safe=False)
+        texts = [f"def function_{i}(): pass" for i in range(16)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            queries = [executor.submit(scheduler.embed_query, text) for text in texts]
+            vectors = scheduler.embed_documents(texts)
+            [query.result() for query in queries]
+
+        self.assertEqual(len(vectors), len(texts))
+        self.assertEqual(embeddings.max_running, 1)
+
+if __name__ == '__main__':
+    unittest.main()
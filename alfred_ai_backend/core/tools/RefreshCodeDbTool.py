@@ -5,13 +5,17 @@ from langchain.callbacks.manager import (
     AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
-from alfred_ai_backend.core.CodeDatabase import CodeDatabase
 from alfred_ai_backend.core.Config import Config
 from pathlib import Path
 import asyncio
 
 root_config = Config()
-code_database = CodeDatabase()
+
+
+def get_code_database():
+    """Gets the code database, deferring its import and creation until a refresh is requested"""
+    from alfred_ai_backend.core.CodeDatabase import CodeDatabase
+    return CodeDatabase()
 
 class RefreshCodeDbSchema(BaseModel):
     pkg_name: str = Field(description="The python package name (i.e. subfolder) where all code should reside")
@@ -28,7 +32,7 @@ class RefreshCodeDbTool(BaseTool):
     ) -> str:
         """Use the tool."""
         repo_path = Path(root_config.get('root_folder'), pkg_name)
-        code_database.refresh_database(repo_path)
+        get_code_database().refresh_database(repo_path)
         return "Update successful"
     
     async def _arun(
@@ -38,6 +42,6 @@ class RefreshCodeDbTool(BaseTool):
     ) -> str:
         """Use the tool asynchronously."""
         repo_path = Path(root_config.get('root_folder'), pkg_name)
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, code_database.refresh_database, repo_path=repo_path)
+        # The refresh runs on the code database's own worker, so just wait for it without holding a thread
+        await asyncio.wrap_future(get_code_database().request_refresh(repo_path))
         return "Update successful"
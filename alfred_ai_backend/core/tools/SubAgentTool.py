@@ -0,0 +1,138 @@
+from abc import abstractmethod
+from typing import Optional, Type, Any, ClassVar, Dict, List
+from uuid import UUID
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain.tools import BaseTool
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
+from alfred_ai_backend.core.utils.AgentCallbacks import get_agent_callbacks
+from alfred_ai_backend.models.Model import Model
+from alfred_ai_backend.core.Config import Config
+import threading
+import asyncio
+import logging
+import time
+import sys
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+
+
+class SubAgentTool(BaseTool):
+    """Hands a task to a sub-agent that is only built the first time it's used
+
+    Registering the tool is cheap. The sub-agent's model, prompt, memory and executor are
+    created on the first call and kept for the next ones, so a session that never needs a
+    sub-agent never pays for it.
+
+    Subclasses set the tool's name, description and args schema, `config_file_name` and
+    `user_input_variables`, and return the sub-agent's own tools from `_get_tools`.
+    """
+    config_file_name: ClassVar[str]
+    user_input_variables: ClassVar[List[str]] = ['input']
+
+    _model_type: Type[Model] = PrivateAttr(None)
+    _model: Model = PrivateAttr(None)
+    _parent: str = PrivateAttr("")
+    _root_folder: str = PrivateAttr("")
+    _tools: List[BaseTool] = PrivateAttr(default_factory=list)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, model_type: Type[Model], parent: str, root_folder: Optional[str] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._model_type = model_type
+        self._parent = parent
+        self._root_folder = str(root_folder or root_config.get('root_folder'))
+
+    def _run(
+        self,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs: Any
+    ) -> str:
+        """Use the tool."""
+        model = self._get_model()
+        resp = model.invoke_agent_executor(kwargs, {'callbacks': self._get_callbacks(model, run_manager.run_id if run_manager else None)})
+        return resp.get('output', ' [[no response]]')
+
+    async def _arun(
+        self,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs: Any
+    ) -> str:
+        """Use the tool asynchronously."""
+        # Building the sub-agent blocks, so keep it off the event loop
+        model = self._model or await asyncio.get_running_loop().run_in_executor(None, self._get_model)
+        resp = await model.ainvoke_agent_executor(kwargs, {'callbacks': self._get_callbacks(model, run_manager.run_id if run_manager else None)})
+        return resp.get('output', ' [[no response]]')
+
+    def _get_model(self) -> Model:
+        """Gets the sub-agent's model, building it and its agent executor on first use"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    model_path = getattr(sys.modules[self._model_type.__module__], '__file__')
+                    model = self._model_type(ToolConfig(self.config_file_name, model_path))
+                    self._tools = self._get_tools(model)
+                    model.initialize_agent(
+                        user_input_variables=list(self.user_input_variables),
+                        system_input_variables={'cwd': self._root_folder},
+                        tools=self._tools,
+                        chat_history=True
+                    )
+                    self._model = model
+                    logger.info(f"Built the {self._get_agent_path()} agent in {time.perf_counter() - start:0.1f} sec")
+        return self._model
+
+    def clear_memory(self):
+        """Makes the sub-agent and its own sub-agents forget their conversations, if they were built"""
+        if self._model is None:
+            return
+        self._model.clear_memory()
+        for tool in self._model.get_tools():
+            if isinstance(tool, SubAgentTool):
+                tool.clear_memory()
+
+    def get_memory(self) -> Dict[str, Any]:
+        """Gets a copy of the conversations of the sub-agent and its own sub-agents, if they were built"""
+        if self._model is None:
+            return {}
+        return {
+            'messages': self._model.get_memory(),
+            'tools': {tool.name: tool.get_memory() for tool in self._model.get_tools() if isinstance(tool, SubAgentTool)},
+        }
+
+    def set_memory(self, memory: Dict[str, Any]):
+        """Replaces the conversations of the sub-agent and its own sub-agents with ones from `get_memory`
+
+        The agents missing from it, because they were built later, forget their conversations.
+        """
+        if self._model is None:
+            return
+        self._model.set_memory(memory.get('messages', []))
+        for tool in self._model.get_tools():
+            if isinstance(tool, SubAgentTool):
+                tool.set_memory(memory.get('tools', {}).get(tool.name, {}))
+
+    def _get_callbacks(self, model: Model, parent_span_id: Optional[UUID] = None) -> list:
+        # The sub-agent's span goes under this tool's run, in the parent agent's trace
+        return get_agent_callbacks(self.name, self._parent, model=model, tool=self.name, parent_span_id=parent_span_id)
+
+    def _get_agent_path(self) -> str:
+        """The chain of agents leading to this one, i.e. `AgentManager > Tester`"""
+        return f"{self._parent} > {self.name}" if self._parent else self.name
+
+    @abstractmethod
+    def _get_tools(self, model: Model) -> List[BaseTool]:
+        """Creates the sub-agent's own tools
+
+        Args:
+            model (Model): The sub-agent's model, not initialized yet
+
+        Returns:
+            List[BaseTool]: The tools
+        """
+        pass
@@ -1,25 +1,89 @@
-from langchain.tools.retriever import create_retriever_tool
-from alfred_ai_backend.core.CodeDatabase import CodeDatabase
-from langchain.tools import Tool
+from typing import Optional, Type
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain.tools import BaseTool
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from alfred_ai_backend.core.Config import Config
+from pathlib import Path
+import asyncio
+import contextvars
+import logging
 
-def create_code_retriever_tool() -> Tool:
-    """Creates a tool that will be used 
+logger = logging.getLogger(__name__)
+root_config = Config()
+DEFAULT_WAIT_SECONDS = 2  # A new index can take minutes, the agent shouldn't block on it
 
-    Returns:
-        Tool: Code retriever tool
+class CodeRetrieverSchema(BaseModel):
+    query: str = Field(description="What to look for in the code. Use an exact function or class name to get its definition")
+    pkg_name: str = Field(description="The python package name (i.e. subfolder) where all code should reside")
+
+
+class CodeRetrieverTool(BaseTool):
+    """Searches the code database, binding to the package's index on first use
+
+    This can be registered before the code database was ever refreshed. The first search
+    of a package opens its persisted index or starts building one in the background, and
+    only waits `retriever_wait_seconds` for it before telling the agent it's still building.
     """
+    name: str = "SearchCodeRepo"
+    description: str = "Searches and returns parts of the code repository. Search for an exact function or class name to get its definition."
+    args_schema: Type[BaseModel] = CodeRetrieverSchema
+    root_folder: Optional[str] = None  # Where the packages are, defaults to the configured root_folder
+
+    def _run(
+        self,
+        query: str,
+        pkg_name: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool."""
+        repo_path = Path(self.root_folder or root_config.get('root_folder'), pkg_name)
+        if not repo_path.is_dir():
+            return f"There is no package folder named {pkg_name}"
+
+        # The code database pulls in the vector store, so it's only imported once it's needed
+        from alfred_ai_backend.core.CodeDatabase import CodeDatabase
+
+        wait_seconds = root_config.get('code_database', {}).get('retriever_wait_seconds', DEFAULT_WAIT_SECONDS)
+        try:
+            retriever = CodeDatabase().get_retriever_for(repo_path, timeout=wait_seconds)
+        except Exception as e:
+            logger.error(f"Unable to build the code database for {repo_path}. Error message: {e}")
+            return f"Unable to search the code of {pkg_name}: {e}"
+        if retriever is None:
+            return f"The code index of {pkg_name} is still building in the background. Use the file tools for now and search again later."
 
-    # TODO: this is going to be broken: the retiever is empty at this stage
-    # need to figure out the chicken-egg problem of having a tool defined at
-    # initiation where the tool isn't ready because it hasn't initlaized the db
-    
+        documents = retriever.get_relevant_documents(query, callbacks=run_manager.get_child() if run_manager else None)
+        if not documents:
+            return "No matching code found"
+        return "\n\n".join(f"# {document.metadata.get('source', 'unknown')}\n{document.page_content}" for document in documents)
 
-    code_database = CodeDatabase()
-    retriever = code_database.get_retriever()
+    async def _arun(
+        self,
+        query: str,
+        pkg_name: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool asynchronously."""
+        loop = asyncio.get_running_loop()
+        # The search blocks, so it runs on a thread, keeping this call's callbacks and context
+        # so the retriever's callbacks, spans and agent events still see it
+        sync_run_manager = run_manager.get_sync() if run_manager else None
+        return await loop.run_in_executor(None, contextvars.copy_context().run, self._run, query, pkg_name, sync_run_manager)
 
-    tool = create_retriever_tool(
-        retriever,
-        "SearchCodeRepo",
-        "Searches and returns parts of the code repository.",
-    )
-    return tool
+
+def create_code_retriever_tool(root_folder: Optional[str] = None) -> BaseTool:
+    """Creates a tool that searches the code database
+
+    The tool is safe to create at agent initialization because it only binds to an index
+    once it's used.
+
+    Args:
+        root_folder (Optional[str], optional): Where the packages are. Defaults to the configured root_folder.
+
+    Returns:
+        BaseTool: Code retriever tool
+    """
+    return CodeRetrieverTool(root_folder=root_folder)
@@ -0,0 +1,40 @@
+from typing import List, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from alfred_ai_backend.core.utils.StatusMessaging import StatusMessaging
+from alfred_ai_backend.core.utils.AgentLogger import AgentLogger
+from alfred_ai_backend.core.utils.TokenCounter import TokenCounter
+from alfred_ai_backend.core.utils.AgentEvents import AgentEvents, get_event_sink
+from alfred_ai_backend.core.utils.SpanTracer import SpanTracer
+from alfred_ai_backend.core.utils.TraceRecorder import is_tracing_enabled
+from alfred_ai_backend.models.Model import Model
+
+
+def get_agent_callbacks(name: str, parent: str=None, model: Optional[Model] = None, tool: Optional[str] = None, parent_span_id: Optional[UUID] = None) -> List[BaseCallbackHandler]:
+    """Creates the callbacks that every agent runs with
+
+    Args:
+        name (str): The agent's name
+        parent (str, optional): The chain of agents leading to this one. Defaults to None.
+        model (Optional[Model], optional): The agent's model, whose tokenizer counts tokens
+            the LLM doesn't report. Defaults to None.
+        tool (Optional[str], optional): The parent agent's tool that runs this agent. Defaults to None.
+        parent_span_id (Optional[UUID], optional): The run of the parent agent's tool, which
+            this agent's span is nested under. Defaults to None.
+
+    Returns:
+        List[BaseCallbackHandler]: The logging, console and token accounting callbacks, and
+            the events callback when the agent runs in a `send_events_to` context, and the
+            span tracer when tracing is enabled
+    """
+    callbacks = [
+        AgentLogger(name, parent),
+        StatusMessaging(name, parent),
+        TokenCounter(name, parent, count_tokens=model.count_tokens if model else None, tool=tool),
+    ]
+    if get_event_sink() is not None:
+        callbacks.append(AgentEvents(name, parent))
+    if is_tracing_enabled():
+        # After the TokenCounter, whose token counts it takes from the ledger
+        callbacks.append(SpanTracer(name, parent, parent_run_id=parent_span_id))
+    return callbacks
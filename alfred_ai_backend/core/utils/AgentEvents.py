@@ -0,0 +1,147 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from uuid import UUID
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain.schema import (
+    AgentAction,
+    AgentFinish,
+    BaseMessage,
+    LLMResult,
+)
+import contextvars
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+MAX_TEXT_LENGTH = 2000  # Tool inputs and outputs are cut to this many characters in events
+
+# Where the agents created in this context send their events. Tools run on other threads
+# with a copy of the context, so nested agents send theirs to the same place.
+_event_sink: contextvars.ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = contextvars.ContextVar('event_sink', default=None)
+
+
+def get_event_sink() -> Optional[Callable[[Dict[str, Any]], None]]:
+    return _event_sink.get()
+
+
+@contextmanager
+def send_events_to(sink: Callable[[Dict[str, Any]], None]) -> Iterator[None]:
+    """Makes the agents that run in this context send their step and status events to a sink
+
+    Args:
+        sink (Callable[[Dict[str, Any]], None]): Called with each event, from whichever thread
+            the agent runs on
+    """
+    token = _event_sink.set(sink)
+    try:
+        yield
+    finally:
+        _event_sink.reset(token)
+
+
+def _cut(text: Any) -> str:
+    text = str(text)
+    return text if len(text) <= MAX_TEXT_LENGTH else f"{text[:MAX_TEXT_LENGTH]}... [{len(text) - MAX_TEXT_LENGTH} more characters]"
+
+
+class AgentEvents(BaseCallbackHandler):
+    """Sends the same steps that StatusMessaging prints as events, like for a client of the server
+
+    Each event is a dict with its `type`, the `agent` that sent it and the `time` it was sent,
+    along with what StatusMessaging shows for it: LLM calls with their latency and time to
+    first token, streamed tokens, tool calls with their input and output, and agent actions.
+    """
+    run_inline = True  # Keep events in order on the event loop instead of a thread pool
+
+    def __init__(self, name: str, parent: str=None, sink: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            name (str): The agent's name
+            parent (str, optional): The chain of agents leading to this one. Defaults to None.
+            sink (Optional[Callable[[Dict[str, Any]], None]], optional): Where the events go.
+                Defaults to the sink of the current context.
+        """
+        if parent:
+            self._name = f"{parent} > {name}"
+        else:
+            self._name = name
+        self._sink = sink or get_event_sink()
+        self._llm_runs: Dict[UUID, Tuple[float, Optional[float]]] = {}  # run id -> start, first token
+        self._running_tools: Dict[UUID, Tuple[str, float]] = {}
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when LLM starts running."""
+        self._llm_runs[run_id] = (time.perf_counter(), None)
+        self._send('llm_start')
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when Chat Model starts running."""
+        self._llm_runs[run_id] = (time.perf_counter(), None)
+        self._send('llm_start', model=serialized['id'][-1])
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        start, first_token = self._llm_runs.get(run_id, (time.perf_counter(), None))
+        if first_token is None:
+            self._llm_runs[run_id] = (start, time.perf_counter())
+        if token:
+            self._send('llm_token', token=token)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when LLM ends running."""
+        self._send('llm_end', **self._get_llm_timing(run_id))
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when LLM errors."""
+        self._send('llm_error', error=str(error), **self._get_llm_timing(run_id))
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when tool starts running."""
+        tool = serialized.get('name', serialized.get('tool', 'unknown'))
+        self._running_tools[run_id] = (tool, time.perf_counter())
+        self._send('tool_start', tool=tool, input=_cut(input_str))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when tool ends running."""
+        tool, start = self._running_tools.pop(run_id, ('unknown', time.perf_counter()))
+        self._send('tool_end', tool=tool, seconds=round(time.perf_counter() - start, 3), output=_cut(output))
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when tool errors."""
+        tool, start = self._running_tools.pop(run_id, ('unknown', time.perf_counter()))
+        self._send('tool_error', tool=tool, seconds=round(time.perf_counter() - start, 3), error=str(error))
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        """Run on agent action."""
+        self._send('agent_action', tool=action.tool, tool_input=_cut(action.tool_input))
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        """Run on agent end."""
+        self._send('agent_finish', output=_cut(finish.return_values.get('output', '')))
+
+    def _get_llm_timing(self, run_id: UUID) -> Dict[str, float]:
+        end = time.perf_counter()
+        start, first_token = self._llm_runs.pop(run_id, (end, None))
+        timing = {'seconds': round(end - start, 3)}
+        if first_token is not None:
+            timing['first_token_seconds'] = round(first_token - start, 3)
+        return timing
+
+    def _send(self, event_type: str, **fields: Any):
+        if self._sink is None:
+            return
+        try:
+            self._sink({'type': event_type, 'agent': self._name, 'time': time.time(), **fields})
+        except Exception as e:
+            # A client that went away mustn't fail the task
+            logger.debug(f"Unable to send the {event_type} event. Error message: {e}")
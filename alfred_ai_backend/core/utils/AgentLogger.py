@@ -1,4 +1,5 @@
 from typing import Any, Dict, List, Union
+from uuid import UUID
 from langchain_core.callbacks import BaseCallbackHandler
 from langchain.schema import (
     AgentAction,
@@ -6,7 +7,6 @@ from langchain.schema import (
     BaseMessage,
     LLMResult,
 )
-import traceback
 import logging
 
 
@@ -15,54 +15,62 @@ class AgentLogger(BaseCallbackHandler):
     """This handles the logging using langchain API
 
     more details here: https://python.langchain.com/docs/modules/callbacks/
+
+    The state of each LLM and tool run is kept by run id since runs can overlap when the
+    agent executes tools concurrently.
+
+    The messages are written by the log writer, off the agent's thread, and the payloads
+    (prompts, responses, tool inputs and outputs) are only formatted when DEBUG is enabled.
     """
+    run_inline = True  # Keep events in order on the event loop instead of a thread pool
+
     def __init__(self, name: str, parent: str=None):
         if parent:
             self._name = f"{parent} > {name}"
         else:
             self._name = name
-        self._running_tool = None
-        self._chat_running = False
+        self._running_tools: Dict[UUID, str] = {}
+        self._chat_runs = set()
         self._logger = logging.getLogger(__name__)
 
     def on_llm_start(
         self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
     ) -> Any:
         """Run when LLM starts running."""
-        self._chat_running = False
-        self._logger.info(f"[{self._name}] - LLM Start")
-        self._logger.debug(f"   Serialized: {serialized}")
-        self._logger.debug(f"   Prompts: {prompts}")
+        self._logger.info("[%s] - LLM Start", self._name)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("   Serialized: %s", serialized)
+            self._logger.debug("   Prompts: %s", prompts)
 
-    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
         """Run when LLM ends running."""
-        if self._chat_running:
-            self._logger.info(f"[{self._name}] - Chat Model End")
+        if run_id in self._chat_runs:
+            self._logger.info("[%s] - Chat Model End", self._name)
         else:
-            self._logger.info(f"[{self._name}] - LLM End")
-        self._logger.debug(f"   Response: {response}")
-        self._chat_running = False
+            self._logger.info("[%s] - LLM End", self._name)
+        self._logger.debug("   Response: %s", response)
+        self._chat_runs.discard(run_id)
 
     def on_llm_error(
-        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when LLM errors."""
-        if self._chat_running:
-            self._logger.info(f"[{self._name}] - Chat Model ERROR")
+        if run_id in self._chat_runs:
+            self._logger.info("[%s] - Chat Model ERROR", self._name)
         else:
-            self._logger.error(f"[{self._name}] - LLM ERROR")
-        self._logger.error(f"   Error: {error}")
-        self._logger.error(f"   Traceback:\n{traceback.format_exc()}")
-        self._chat_running = False
+            self._logger.error("[%s] - LLM ERROR", self._name)
+        # The traceback is the error's own, since no exception is being handled here
+        self._logger.error("   Error: %s", error, exc_info=error)
+        self._chat_runs.discard(run_id)
         
     def on_chat_model_start(
-        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], **kwargs: Any
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when Chat Model starts running."""
-        self._chat_running = True
-        self._logger.info(f"[{self._name}] - Chat Model Start ({serialized['id'][-1]})")
-        #self._logger.debug(f"   Serialized: {serialized}")
-        self._logger.debug(f"   Messages: {messages}")
+        self._chat_runs.add(run_id)
+        self._logger.info("[%s] - Chat Model Start (%s)", self._name, serialized['id'][-1])
+        #self._logger.debug("   Serialized: %s", serialized)
+        self._logger.debug("   Messages: %s", messages)
 
     # There is too much messaging with chains to make these logs useful
     # def on_chain_start(
@@ -89,34 +97,34 @@ class AgentLogger(BaseCallbackHandler):
     #     self._logger.error(f"   Traceback:\n{traceback.format_exc()}")
 
     def on_tool_start(
-        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when tool starts running."""
-        self._running_tool = serialized.get('name', serialized.get('tool', 'unknown'))
-        self._logger.info(f"[{self._name}] - STARTED tool ({self._running_tool})")
-        self._logger.debug(f"   Tool Inputs: {input_str}")
+        tool = serialized.get('name', serialized.get('tool', 'unknown'))
+        self._running_tools[run_id] = tool
+        self._logger.info("[%s] - STARTED tool (%s)", self._name, tool)
+        self._logger.debug("   Tool Inputs: %s", input_str)
 
-    def on_tool_end(self, output: Any, **kwargs: Any) -> Any:
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
         """Run when tool ends running."""
-        self._logger.info(f"[{self._name}] - FINISHED tool ({self._running_tool})")
-        self._logger.debug(f"   Tool Output: {output}")
-        self._running_tool = None
+        tool = self._running_tools.pop(run_id, 'unknown')
+        self._logger.info("[%s] - FINISHED tool (%s)", self._name, tool)
+        self._logger.debug("   Tool Output: %s", output)
 
     def on_tool_error(
-        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when tool errors."""
-        self._logger.error(f"[{self._name}] - Tool ERROR ({self._running_tool})")
-        self._logger.error(f"   Error: {error}")
-        self._logger.error(f"   Traceback:\n{traceback.format_exc()}")
-        self._running_tool = None
+        tool = self._running_tools.pop(run_id, 'unknown')
+        self._logger.error("[%s] - Tool ERROR (%s)", self._name, tool)
+        self._logger.error("   Error: %s", error, exc_info=error)
 
     def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
         """Run on agent action."""
-        self._logger.info(f"[{self._name}] - Agent Action ({action.get('tool', 'unknown')})")
-        self._logger.debug(f"   Action: {action}")
+        self._logger.info("[%s] - Agent Action (%s)", self._name, action.tool)
+        self._logger.debug("   Action: %s", action)
 
     def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
         """Run on agent end."""
-        self._logger.info(f"[{self._name}] - Agent Finish")
-        self._logger.debug(f"   Finish: {finish}")
+        self._logger.info("[%s] - Agent Finish", self._name)
+        self._logger.debug("   Finish: %s", finish)
@@ -0,0 +1,115 @@
+"""A local stand-in for the OpenAI embeddings endpoint
+
+Point OpenAIEmbeddings at it to exercise the embedding scheduler without the network or cost:
+
+    python -m alfred_ai_backend.core.utils.FakeEmbeddingsServer --port 8765 --rate-limit-every 5
+    set OPENAI_API_BASE=http://127.0.0.1:8765/v1
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Any
+import argparse
+import base64
+import hashlib
+import logging
+import struct
+import json
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def fake_embedding(value: Any, dim: int) -> List[float]:
+    """Creates a deterministic unit-ish vector from a text or list of tokens"""
+    digest = hashlib.sha256(json.dumps(value).encode('utf-8')).digest()
+    return [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(dim)]
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    server: "FakeEmbeddingsServer"
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/embeddings'):
+            self._send(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.server.should_rate_limit():
+            self._send(429, {'error': {'message': "Rate limit reached", 'type': 'requests'}}, {'Retry-After': '1'})
+            return
+
+        time.sleep(self.server.latency)
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        data = []
+        for i, value in enumerate(inputs):
+            embedding = fake_embedding(value, self.server.dim)
+            if body.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode('ascii')
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+        self._send(200, {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model', 'fake'),
+            'usage': {'prompt_tokens': len(inputs), 'total_tokens': len(inputs)},
+        })
+
+    def _send(self, status: int, payload: Any, headers: dict = None):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(format, *args)
+
+
+class FakeEmbeddingsServer(ThreadingHTTPServer):
+    """Serves deterministic embeddings and rejects every Nth request with a 429"""
+
+    def __init__(self, port: int = 8765, dim: int = 1536, latency: float = 0.05, rate_limit_every: int = 0):
+        super().__init__(('127.0.0.1', port), FakeEmbeddingsHandler)
+        self.dim = dim
+        self.latency = latency
+        self._rate_limit_every = rate_limit_every
+        self._requests = 0
+        self._lock = threading.Lock()
+
+    def should_rate_limit(self) -> bool:
+        with self._lock:
+            self._requests += 1
+            return self._rate_limit_every > 0 and self._requests % self._rate_limit_every == 0
+
+    @property
+    def requests(self) -> int:
+        """The requests received so far, including the rate limited ones"""
+        with self._lock:
+            return self._requests
+
+    def start(self) -> threading.Thread:
+        """Serves in a background thread, call shutdown() to stop"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI embeddings server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds to wait before each response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Respond with 429 to every Nth request")
+    args = parser.parse_args()
+
+    server = FakeEmbeddingsServer(args.port, args.dim, args.latency, args.rate_limit_every)
+    print(f"Serving fake embeddings on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
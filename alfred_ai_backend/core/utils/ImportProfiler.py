@@ -0,0 +1,98 @@
+from typing import Dict, List
+from importlib.machinery import SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader
+from collections import defaultdict
+import importlib.abc
+import sys
+import time
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Measures how long each module takes to import
+
+    It sits first on `sys.meta_path` while active and times the execution of every module
+    loaded from a file. Like `python -X importtime`, it reports both the time spent in a
+    module itself and the cumulative time including the modules it imported.
+    """
+
+    # Loaders that are created for each module, so timing one doesn't affect other modules
+    _TIMED_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+    def __init__(self):
+        self.cumulative: Dict[str, float] = {}
+        self.self_time: Dict[str, float] = {}
+        self._children_time: List[float] = []
+        self._start = 0.0
+        self.total = 0.0  # Seconds the profiler was active
+        self.import_time = 0.0  # Seconds of that spent importing
+
+    def __enter__(self) -> "ImportProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._start = time.perf_counter()
+        sys.meta_path.insert(0, self)
+
+    def stop(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        self.total = time.perf_counter() - self._start
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if isinstance(spec.loader, self._TIMED_LOADERS):
+            spec.loader.exec_module = self._timed(fullname, spec.loader.exec_module)
+        return spec
+
+    def _timed(self, fullname: str, exec_module):
+        def exec_module_timed(module):
+            self._children_time.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self._children_time.pop()
+                self.cumulative[fullname] = elapsed
+                self.self_time[fullname] = elapsed - children
+                if self._children_time:
+                    self._children_time[-1] += elapsed
+                else:
+                    self.import_time += elapsed
+        return exec_module_timed
+
+    def report(self, top: int = 25, file=None) -> str:
+        """Formats the slowest modules and the import time of each top-level package
+
+        Args:
+            top (int, optional): How many modules and packages to list. Defaults to 25.
+            file (optional): Also writes the report to this stream. Defaults to None.
+
+        Returns:
+            str: The report
+        """
+        packages: Dict[str, float] = defaultdict(float)
+        for name, seconds in self.self_time.items():
+            packages[name.split('.')[0]] += seconds
+
+        lines = [f"Imported {len(self.cumulative)} modules in {self.import_time:0.2f} sec of {self.total:0.2f} sec", "", f"{'cumulative':>12} {'self':>10}  module"]
+        slowest = sorted(self.cumulative.items(), key=lambda item: item[1], reverse=True)[:top]
+        lines += [f"{cumulative * 1e3:10.1f}ms {self.self_time[name] * 1e3:8.1f}ms  {name}" for name, cumulative in slowest]
+        lines += ["", f"{'self':>12}  package"]
+        lines += [f"{seconds * 1e3:10.1f}ms  {name}" for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]]
+        report = "\n".join(lines)
+        if file:
+            print(report, file=file)
+        return report
+
@@ -11,13 +11,25 @@ class StreamToLogger(object):
         self.linebuf = ''
 
     def write(self, buf):
-        for line in str(buf).rstrip().splitlines():
-            if len(line) > 2:  # Skip some superficial messaging like '.' progress indicators
-                self.logger.log(self.log_level, line.rstrip())
+        # Messages printed in pieces, like with print(..., end=""), are logged once their line ends
+        lines = (self.linebuf + str(buf)).split('\n')
+        self.linebuf = lines.pop()
+        for line in lines:
+            self._log(line)
 
     def flush(self):
         pass
 
+    def close(self):
+        """Logs what's left of the last line"""
+        self._log(self.linebuf)
+        self.linebuf = ''
+
+    def _log(self, line):
+        line = line.rstrip()
+        if len(line) > 2:  # Skip some superficial messaging like '.' progress indicators
+            self.logger.log(self.log_level, line)
+
 class RedirectStdStreamsToLogger(object):
     def __init__(self, logger=None):
         if logger is None:
@@ -34,5 +46,7 @@ class RedirectStdStreamsToLogger(object):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        sys.stdout.close()
+        sys.stderr.close()
         sys.stdout = self.old_stdout
         sys.stderr = self.old_stderr
@@ -0,0 +1,153 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from langchain_core.agents import AgentAction
+import threading
+import hashlib
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+MAX_CACHED_COUNTS = 4096
+
+
+class ScratchpadBudgeter():
+    """Keeps the intermediate steps an agent sends back to the LLM under a token budget
+
+    Without it every step resends every tool observation, so long tasks that read large files
+    outgrow the context window and pay for a bigger prompt on each step. Before the steps are
+    rendered into the scratchpad:
+
+    1. If the steps are over `max_tokens`, a read-only tool call repeated with the same input
+       and the same observation, like reading an unchanged file again, only keeps its latest
+       observation. A call of any other tool in between, like a write, keeps both.
+    2. Observations older than the most recent steps are cut down to `max_observation_tokens`,
+       keeping their beginning and end.
+    3. If the steps are still over `max_tokens`, the oldest observations are replaced by
+       their first line, then the recent ones share what is left of the budget.
+
+    The actions themselves are never changed, so the agent still knows everything it did.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_tokens: int = 6000,
+        keep_recent_steps: int = 2,
+        max_observation_tokens: int = 1500,
+        read_only_tools: Optional[Iterable[str]] = None,
+    ):
+        """
+        Args:
+            count_tokens (Callable[[str], int]): Counts the tokens of a text with the model's tokenizer
+            max_tokens (int, optional): The budget of the steps. Defaults to 6000.
+            keep_recent_steps (int, optional): How many of the last steps keep their whole
+                observation while the budget allows it. Defaults to 2.
+            max_observation_tokens (int, optional): The size older observations are cut down to. Defaults to 1500.
+            read_only_tools (Optional[Iterable[str]], optional): Tools whose repeated calls are deduplicated. Defaults to None.
+        """
+        self._count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.keep_recent_steps = keep_recent_steps
+        self.max_observation_tokens = max_observation_tokens
+        self.read_only_tools = set(read_only_tools or [])
+        # Observations are counted on every step, so their counts are kept
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def fit(self, intermediate_steps: List[Tuple[AgentAction, str]]) -> List[Tuple[AgentAction, str]]:
+        """Fits the steps in the budget
+
+        Args:
+            intermediate_steps (List[Tuple[AgentAction, str]]): The agent's actions and their observations
+
+        Returns:
+            List[Tuple[AgentAction, str]]: The same actions, with their observations shortened where needed
+        """
+        if not intermediate_steps:
+            return intermediate_steps
+        actions = [action for action, _ in intermediate_steps]
+        action_tokens = sum(self.count(self._render_action(action)) for action in actions)
+        original = action_tokens + sum(self.count(str(observation)) for _, observation in intermediate_steps)
+        observations = [str(observation) for _, observation in intermediate_steps]
+        if original > self.max_tokens:
+            observations = self._dedupe(actions, observations)
+        recent = max(0, len(observations) - self.keep_recent_steps)
+
+        for i in range(recent):
+            if self.count(observations[i]) > self.max_observation_tokens:
+                observations[i] = self._truncate(observations[i], self.max_observation_tokens)
+
+        total = action_tokens + sum(self.count(observation) for observation in observations)
+        for i in range(recent):
+            if total <= self.max_tokens:
+                break
+            elided = self._elide(observations[i])
+            if self.count(elided) >= self.count(observations[i]):
+                continue
+            total += self.count(elided) - self.count(observations[i])
+            observations[i] = elided
+
+        if total > self.max_tokens and recent < len(observations):
+            # Even the last steps don't fit, so they share what's left after the older ones
+            older = action_tokens + sum(self.count(observation) for observation in observations[:recent])
+            share = max(1, (self.max_tokens - older) // (len(observations) - recent))
+            for i in range(recent, len(observations)):
+                if self.count(observations[i]) > share:
+                    observations[i] = self._truncate(observations[i], share)
+            total = older + sum(self.count(observation) for observation in observations[recent:])
+
+        if total != original:
+            logger.debug(f"Fit the scratchpad of {len(observations)} steps from {original} to {total} tokens")
+        return list(zip(actions, observations))
+
+    def count(self, text: str) -> int:
+        """Counts the tokens of a text, remembering the counts of recent texts"""
+        text = str(text)
+        count = self._counts.get(text)
+        if count is None:
+            count = self._count_tokens(text)
+            with self._lock:
+                if len(self._counts) >= MAX_CACHED_COUNTS:
+                    self._counts.clear()
+                self._counts[text] = count
+        return count
+
+    def _dedupe(self, actions: List[AgentAction], observations: List[str]) -> List[str]:
+        """Replaces the observations of read-only calls that are repeated later with the same output with a pointer to the later one"""
+        observations = list(observations)
+        latest: Dict[str, Tuple[int, str]] = {}  # call -> step and hash of its observation
+        for i, action in enumerate(actions):
+            if action.tool not in self.read_only_tools:
+                # It may have changed what the earlier calls read
+                latest.clear()
+                continue
+            key = f"{action.tool}\0{json.dumps(action.tool_input, sort_keys=True, default=str)}"
+            digest = hashlib.sha1(observations[i].encode('utf-8')).hexdigest()
+            if key in latest and latest[key][1] == digest:
+                observations[latest[key][0]] = f"[Same output as the later {action.tool} call in step {i + 1}]"
+            latest[key] = (i, digest)
+        return observations
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Keeps the beginning and end of a text, at most `max_tokens` long unless even the marker is longer"""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        marker = f"\n... [{tokens - max_tokens} tokens truncated] ...\n"
+        # Tokens aren't spread evenly over the characters, so shrink until it fits with the marker
+        keep = int(len(text) * max(0, max_tokens - self.count(marker)) / tokens)
+        while True:
+            head = keep * 2 // 3
+            tail = keep - head
+            truncated = f"{text[:head]}{marker}{text[len(text) - tail:] if tail else ''}"
+            if keep == 0 or self.count(truncated) <= max_tokens:
+                return truncated
+            keep = keep * 9 // 10
+
+    def _elide(self, text: str) -> str:
+        """Replaces an observation with its first line"""
+        first_line = text.strip().split('\n', 1)[0][:200]
+        return f"{first_line} ... [{self.count(text)} tokens elided to fit the context window]"
+
+    @staticmethod
+    def _render_action(action: AgentAction) -> str:
+        return f"{action.tool} {action.tool_input}"
@@ -0,0 +1,199 @@
+from typing import Any, Dict, List, Optional, Set, Union
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from langchain.schema import (
+    BaseMessage,
+    Generation,
+    LLMResult,
+)
+from alfred_ai_backend.core.utils.TraceRecorder import Span, TraceRecorder
+from alfred_ai_backend.core.utils.TokenUsageLedger import TokenUsageLedger, get_current_task_id
+from alfred_ai_backend.core.utils.TokenCounter import get_model_name, get_reported_usage, is_cached
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def _get_size(value: Any) -> int:
+    """The size of a payload in characters"""
+    if isinstance(value, dict):
+        return sum(_get_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_get_size(item) for item in value)
+    if isinstance(value, BaseMessage):
+        return len(str(value.content))
+    return len(str(value)) if value is not None else 0
+
+
+def _get_completion(generation: Generation) -> str:
+    """The text of a generation, with the tool calls of chat models that reply with them"""
+    message = getattr(generation, 'message', None)
+    tool_calls = message.additional_kwargs.get('tool_calls') if message is not None else None
+    return generation.text + (str(tool_calls) if tool_calls else "")
+
+
+class SpanTracer(BaseCallbackHandler):
+    """Records an agent's runs as spans of the task's trace in the TraceRecorder
+
+    The agent's run is a span under the tool that runs it, or under the task for the
+    AgentManager. Each planning step of the agent is a span holding the LLM call, prompt and
+    parsing of that step, and the tool calls the step decided on. LLM spans have their model,
+    token counts and prompt and response sizes, and tool spans their input and output sizes.
+
+    The token counts are the ones the agent's TokenCounter recorded in the TokenUsageLedger,
+    so prompts the LLM doesn't report tokens for aren't tokenized twice.
+    """
+    run_inline = True  # Keep events in order on the event loop instead of a thread pool
+
+    def __init__(self, name: str, parent: str=None, parent_run_id: Optional[UUID] = None):
+        """
+        Args:
+            name (str): The agent's name
+            parent (str, optional): The chain of agents leading to this one. Defaults to None.
+            parent_run_id (Optional[UUID], optional): The run of the tool that runs this agent,
+                which its run is nested under. Defaults to None.
+        """
+        if parent:
+            self._name = f"{parent} > {name}"
+        else:
+            self._name = name
+        self._parent_run_id = parent_run_id
+        self._task_id = get_current_task_id()
+        self._recorder = TraceRecorder()
+        self._ledger = TokenUsageLedger()
+        self._spans: Dict[UUID, Span] = {}
+        self._executors: Set[UUID] = set()  # The agent's own runs, whose chains are its steps
+        self._steps: Dict[UUID, Span] = {}  # executor run id -> its current step
+        self._step_counts: Dict[UUID, int] = {}
+
+    def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when chain starts running."""
+        if parent_run_id is None:
+            self._executors.add(run_id)
+            self._start(run_id, self._parent_run_id, self._name, 'agent', input_chars=_get_size(inputs))
+            return
+        if parent_run_id in self._executors:
+            # Everything the agent runs between two plans is part of the step that planned it
+            self._end_step(parent_run_id)
+            self._step_counts[parent_run_id] = self._step_counts.get(parent_run_id, 0) + 1
+            step = self._start(uuid.uuid4(), parent_run_id, f"step {self._step_counts[parent_run_id]}", 'step')
+            if step is not None:
+                self._steps[parent_run_id] = step
+            parent_run_id = step.id if step is not None else parent_run_id
+        self._start(run_id, parent_run_id, kwargs.get('name') or self._get_name(serialized), 'chain')
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when chain ends running."""
+        if run_id in self._executors:
+            self._executors.discard(run_id)
+            self._end_step(run_id)
+            self._step_counts.pop(run_id, None)
+            self._end(run_id, output_chars=_get_size(outputs.get('output')) if isinstance(outputs, dict) else _get_size(outputs))
+            return
+        self._end(run_id)
+
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when chain errors."""
+        if run_id in self._executors:
+            self._executors.discard(run_id)
+            self._end_step(run_id)
+            self._step_counts.pop(run_id, None)
+        self._end(run_id, error=error)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when LLM starts running."""
+        self._start_llm(serialized, "\n".join(prompts), run_id, parent_run_id, kwargs.get('invocation_params'))
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when Chat Model starts running."""
+        self._start_llm(serialized, "\n".join(get_buffer_string(m) for m in messages), run_id, parent_run_id, kwargs.get('invocation_params'))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        span = self._spans.get(run_id)
+        if span is not None and 'first_token_ms' not in span.attributes:
+            span.attributes['first_token_ms'] = round((time.time_ns() - span.start_ns) / 1e6, 1)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when LLM ends running."""
+        span = self._spans.get(run_id)
+        if span is None:
+            return
+        completion = "".join(_get_completion(generation) for generations in response.generations for generation in generations)
+        attributes = {'completion_chars': len(completion)}
+        if is_cached(response):
+            attributes['cached'] = True
+        recorded = self._ledger.get_llm_run(run_id)
+        if recorded is not None:
+            attributes['prompt_tokens'], attributes['completion_tokens'], estimated = recorded
+            if estimated:
+                attributes['estimated_tokens'] = True
+        else:
+            usage = get_reported_usage(response)
+            if usage is not None:
+                attributes['prompt_tokens'], attributes['completion_tokens'] = usage
+        self._end(run_id, **attributes)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when LLM errors."""
+        self._end(run_id, error=error)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when tool starts running."""
+        if parent_run_id in self._steps:
+            parent_run_id = self._steps[parent_run_id].id
+        tool = serialized.get('name', serialized.get('tool', 'unknown'))
+        self._start(run_id, parent_run_id, tool, 'tool', input_chars=len(input_str or ""))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when tool ends running."""
+        self._end(run_id, output_chars=_get_size(output))
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when tool errors."""
+        self._end(run_id, error=error)
+
+    def _start_llm(self, serialized: Dict[str, Any], prompt: str, run_id: UUID, parent_run_id: Optional[UUID], invocation_params: Optional[Dict[str, Any]]):
+        model = get_model_name(serialized, invocation_params)
+        self._start(run_id, parent_run_id, f"LLM {model}", 'llm', model=model, prompt_chars=len(prompt))
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str, **attributes: Any) -> Optional[Span]:
+        span = Span(run_id, parent_run_id, name, kind, self._name, time.time_ns(), attributes=attributes)
+        if not self._recorder.add_span(self._task_id, span):
+            return None
+        self._spans[run_id] = span
+        return span
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes: Any):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        span.attributes.update(attributes)
+        span.end(f"{type(error).__name__}: {error}" if error is not None else None)
+
+    def _end_step(self, executor_run_id: UUID):
+        step = self._steps.pop(executor_run_id, None)
+        if step is not None:
+            step.end()
+
+    @staticmethod
+    def _get_name(serialized: Optional[Dict[str, Any]]) -> str:
+        serialized = serialized or {}
+        return serialized.get('name') or (serialized.get('id') or ['chain'])[-1]
@@ -1,4 +1,5 @@
-from typing import Any, Dict, List, Union, Optional
+from typing import Any, Dict, List, Set, Tuple, Union, Optional
+from uuid import UUID
 from langchain_core.callbacks import StdOutCallbackHandler
 from langchain.schema import (
     AgentAction,
@@ -6,89 +7,121 @@ from langchain.schema import (
     BaseMessage,
     LLMResult,
 )
+from alfred_ai_backend.core.utils.console import get_colored_text  # Kept importable from here
+from alfred_ai_backend.core.Config import Config
 import traceback
+import threading
 import time
 import sys
 
-def get_colored_text(text: str, color: Optional[str]="yellow", **kwargs):
-    _TEXT_COLOR_MAPPING = {
-        "blue": "36;1",
-        "yellow": "33;1",
-        "pink": "38;5;200",
-        "green": "32;1",
-        "red": "31;1",
-    }
-    return f"\u001b[{_TEXT_COLOR_MAPPING[color]}m\033[1;3m{text}\u001b[0m"
-
+root_config = Config()
 
 class StatusMessaging(StdOutCallbackHandler):
     """This handles additional console status messaging using langchain API
 
     more details here: https://python.langchain.com/docs/modules/callbacks/
+
+    The state of each LLM and tool run is kept by run id since runs can overlap when the
+    agent executes tools concurrently. A "Running LLM..." line is only completed in place
+    if nothing else was printed since, otherwise the result gets a line of its own.
+
+    In streaming mode the LLM's tokens are printed as they arrive. Either way, each LLM
+    call reports its time to first token alongside its total latency.
     """
-    def __init__(self, name: str, parent: str=None):
+    run_inline = True  # Keep events in order on the event loop instead of a thread pool
+
+    # The console is shared by all agents
+    _console_lock = threading.Lock()
+    _open_line: Optional[UUID] = None
+
+    def __init__(self, name: str, parent: str=None, stream_tokens: Optional[bool]=None):
         if parent:
             self._name = f"{parent} > {name}"
         else:
             self._name = name
-        self._running_tool = None
-        self._chat_running = False
+        self._llm_timers: Dict[UUID, float] = {}
+        self._running_tools: Dict[UUID, Tuple[str, float]] = {}
+        self._first_tokens: Dict[UUID, float] = {}
+        self._streamed_runs: Set[UUID] = set()
+        self._task_timers: Dict[UUID, float] = {}
+        self._first_token_at: Optional[float] = None
+        if stream_tokens is None:
+            stream_tokens = root_config.get('streaming', {}).get('enabled', False)
+        self._stream_tokens = stream_tokens
         self._p = "  "*len(self._name.split(' > '))
 
     def on_llm_start(
-        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when LLM starts running."""
-        self._chat_running = False
-        self._llm_timer = time.perf_counter()
-        print(f"{self._p}[{self._name}] - Running LLM...", end="")
-        sys.stdout.flush()
+        self._llm_timers[run_id] = time.perf_counter()
+        self._print(f"{self._p}[{self._name}] - Running LLM...", open_for=run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        if run_id not in self._first_tokens:
+            self._first_tokens[run_id] = time.perf_counter()
+            if self._first_token_at is None:
+                self._first_token_at = self._first_tokens[run_id]
+        # Tool call chunks come with no text
+        if self._stream_tokens and token:
+            self._print_token(token, run_id)
 
-    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
         """Run when LLM ends running."""
-        t = f"{time.perf_counter() - self._llm_timer:0.1f} sec"
-        print(f"Done ({t})")
-        self._chat_running = False
-        sys.stdout.flush()
+        t = self._get_llm_timing(run_id) + self._get_prompt_eval(response)
+        if run_id in self._streamed_runs:
+            self._streamed_runs.discard(run_id)
+            self._print(f"{self._p}[{self._name}] - LLM Done ({t})")
+        else:
+            self._print(f"Done ({t})", closes=run_id, standalone=f"{self._p}[{self._name}] - LLM Done ({t})")
 
     def on_llm_error(
-        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when LLM errors."""
-        print(get_colored_text("ERROR","red"), end="")
-        t = f"{time.perf_counter() - self._llm_timer:0.1f} sec"
-        print(f" ({t})")
-        print(f"{self._p}  Error: {error}")
-        print(f"{self._p}  Traceback:\n{traceback.format_exc()}")
-        self._chat_running = False
-        
+        self._streamed_runs.discard(run_id)
+        t = self._get_llm_timing(run_id)
+        errmsg = get_colored_text("ERROR","red")
+        self._print(
+            f"{errmsg} ({t})\n{self._p}  Error: {error}\n{self._p}  Traceback:\n{traceback.format_exc()}",
+            closes=run_id,
+            standalone=f"{self._p}[{self._name}] - LLM {errmsg} ({t})\n{self._p}  Error: {error}\n{self._p}  Traceback:\n{traceback.format_exc()}",
+        )
+
     def on_chat_model_start(
-        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], **kwargs: Any
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when Chat Model starts running."""
-        self._chat_running = True
-        self._llm_timer = time.perf_counter()
-        print(f"{self._p}[{self._name}] - Running Chat Model {serialized['id'][-1]}...", end="")
-        sys.stdout.flush()
+        self._llm_timers[run_id] = time.perf_counter()
+        self._print(f"{self._p}[{self._name}] - Running Chat Model {serialized['id'][-1]}...", open_for=run_id)
 
     def on_chain_start(
-        self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
     ) -> Any:
         """Run when chain starts running."""
+        if self._stream_tokens and parent_run_id is None:
+            self._task_timers[run_id] = time.perf_counter()
         # Chain messaging is just too much...
         # print(f"{self._p}[{self._name}] - Chain Start")
         pass
 
-    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> Any:
         """Run when chain ends running."""
+        if run_id in self._task_timers:
+            start = self._task_timers.pop(run_id)
+            first_token = self._first_token_at
+            ttft = f", first token after {first_token - start:0.1f} sec" if first_token is not None and first_token >= start else ""
+            self._print(f"{self._p}[{self._name}] - Task Done ({time.perf_counter() - start:0.1f} sec{ttft})")
         # Chain messaging is just too much...
         # print(f"{self._p}[{self._name}] - Chain End")
         pass
 
     def on_chain_error(
-        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when chain errors."""
+        self._task_timers.pop(run_id, None)
         # Chain messaging is just too much...
         # errmsg = get_colored_text(f"Chain ERROR", "red")
         # print(f"{self._p}[{self._name}] - {errmsg}")
@@ -97,39 +130,90 @@ class StatusMessaging(StdOutCallbackHandler):
         pass
 
     def on_tool_start(
-        self, serialized: Dict[str, Any], input_str: str, **kwargs: Any
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when tool starts running."""
-        self._tool_timer = time.perf_counter()
-        self._running_tool = serialized.get('name', serialized.get('tool', 'unknown'))
-        print(f"{self._p}[{self._name}] - Starting tool {self._running_tool}")
-        sys.stdout.flush()
+        tool = serialized.get('name', serialized.get('tool', 'unknown'))
+        self._running_tools[run_id] = (tool, time.perf_counter())
+        self._print(f"{self._p}[{self._name}] - Starting tool {tool}")
 
-    def on_tool_end(self, output: Any, **kwargs: Any) -> Any:
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
         """Run when tool ends running."""
-        t = f"{time.perf_counter() - self._tool_timer:0.1f} sec"
-        print(f"{self._p}[{self._name}] - Finished with tool {self._running_tool} ({t})")
-        self._running_tool = None
-        sys.stdout.flush()
+        tool, start = self._running_tools.pop(run_id, ('unknown', time.perf_counter()))
+        t = f"{time.perf_counter() - start:0.1f} sec"
+        self._print(f"{self._p}[{self._name}] - Finished with tool {tool} ({t})")
 
     def on_tool_error(
-        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
     ) -> Any:
         """Run when tool errors."""
-        errmsg = get_colored_text(f"Tool ERROR ({self._running_tool})", "red")
-        print(f"{self._p}[{self._name}] - {errmsg}", end="")
-        t = f"{time.perf_counter() - self._tool_timer:0.1f} sec"
-        print(f" ({t})")
-        print(f"{self._p}  Error: {error}")
-        print(f"{self._p}  Traceback:\n{traceback.format_exc()}")
-        self._running_tool = None
+        tool, start = self._running_tools.pop(run_id, ('unknown', time.perf_counter()))
+        errmsg = get_colored_text(f"Tool ERROR ({tool})", "red")
+        t = f"{time.perf_counter() - start:0.1f} sec"
+        self._print(f"{self._p}[{self._name}] - {errmsg} ({t})\n{self._p}  Error: {error}\n{self._p}  Traceback:\n{traceback.format_exc()}")
 
     def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
         """Run on agent action."""
-        print(f"{self._p}[{self._name}] - Beginning Agent Action: {action.get('tool', 'unknown')}")
-        sys.stdout.flush()
+        self._print(f"{self._p}[{self._name}] - Beginning Agent Action: {action.tool}")
 
     def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
         """Run on agent end."""
-        print(f"{self._p}[{self._name}] - Finished Agent Execution")
-        sys.stdout.flush()
+        self._print(f"{self._p}[{self._name}] - Finished Agent Execution")
+
+    def _get_llm_timing(self, run_id: UUID) -> str:
+        """Formats the total latency of an LLM run and its time to first token"""
+        end = time.perf_counter()
+        start = self._llm_timers.pop(run_id, end)
+        first_token = self._first_tokens.pop(run_id, None)
+        if first_token is None:
+            return f"{end - start:0.1f} sec"
+        return f"{end - start:0.1f} sec, first token after {first_token - start:0.1f} sec"
+
+    @staticmethod
+    def _get_prompt_eval(response: LLMResult) -> str:
+        """Formats how much of the prompt a local model evaluated, if it reported it"""
+        for generations in response.generations:
+            for generation in generations:
+                prompt_eval = (generation.generation_info or {}).get('prompt_eval')
+                if prompt_eval:
+                    return f", evaluated {prompt_eval['evaluated_tokens']} of {prompt_eval['prompt_tokens']} prompt tokens"
+        return ""
+
+    def _print_token(self, token: str, run_id: UUID):
+        """Prints a streamed token under the run's "Running LLM..." line
+
+        If another run printed in between, the run's name is repeated before its next tokens.
+        """
+        indent = f"{self._p}  "
+        with StatusMessaging._console_lock:
+            if StatusMessaging._open_line != run_id or run_id not in self._streamed_runs:
+                if StatusMessaging._open_line is not None:
+                    print()
+                if run_id in self._streamed_runs:
+                    print(f"{indent}[{self._name}] ", end="")
+                else:
+                    print(indent, end="")
+                    self._streamed_runs.add(run_id)
+            print(token.replace("\n", f"\n{indent}"), end="")
+            StatusMessaging._open_line = run_id
+            sys.stdout.flush()
+
+    def _print(self, text: str, open_for: Optional[UUID] = None, closes: Optional[UUID] = None, standalone: Optional[str] = None):
+        """Prints to the console without mixing up the lines of overlapping runs
+
+        Args:
+            text (str): What to print
+            open_for (Optional[UUID], optional): Leaves the line open for this run to complete. Defaults to None.
+            closes (Optional[UUID], optional): Completes the line left open by this run. Defaults to None.
+            standalone (Optional[str], optional): What to print instead when the run's line
+                can't be completed in place. Defaults to None.
+        """
+        with StatusMessaging._console_lock:
+            if closes is not None and StatusMessaging._open_line == closes:
+                print(text)
+            else:
+                if StatusMessaging._open_line is not None:
+                    print()
+                print(standalone if closes is not None and standalone else text, end="" if open_for else "\n")
+            StatusMessaging._open_line = open_for
+            sys.stdout.flush()
@@ -0,0 +1,207 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from langchain.schema import (
+    BaseMessage,
+    LLMResult,
+)
+from alfred_ai_backend.core.utils.TokenUsageLedger import TokenUsageLedger, get_current_task_id
+from pathlib import Path
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the tokens of a text at 4 characters per token"""
+    return (len(text) + 3) // 4
+
+
+def get_model_name(serialized: Dict[str, Any], invocation_params: Optional[Dict[str, Any]]) -> str:
+    """Gets the model name of an LLM run from its callback arguments"""
+    params = invocation_params or {}
+    for key in ('model_name', 'model'):
+        if isinstance(params.get(key), str):
+            return params[key]
+    if isinstance(params.get('model_path'), str):
+        return Path(params['model_path']).name
+    return (serialized or {}).get('id', ['unknown'])[-1]
+
+
+def is_cached(response: LLMResult) -> bool:
+    """Whether the response came from the LlmResponseCache instead of the LLM"""
+    for generations in response.generations:
+        for generation in generations:
+            if (generation.generation_info or {}).get('cached'):
+                return True
+    return False
+
+
+def get_reported_usage(response: LLMResult) -> Optional[Tuple[int, int]]:
+    """Gets the prompt and completion tokens that the LLM reported, if it did
+
+    OpenAI reports them in `token_usage` and Anthropic in `usage`, either in the LLM output
+    or in the response metadata of the message. Streamed responses usually report nothing.
+    """
+    sources = [response.llm_output or {}]
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, 'message', None)
+            if message is not None:
+                sources.append(message.response_metadata or {})
+    for source in sources:
+        usage = source.get('token_usage') or source.get('usage')
+        if not usage:
+            continue
+        if isinstance(usage, dict) and 'prompt_tokens' in usage:
+            return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+        if isinstance(usage, dict) and 'input_tokens' in usage:
+            return usage.get('input_tokens') or 0, usage.get('output_tokens') or 0
+    return None
+
+
+class TokenCounter(BaseCallbackHandler):
+    """Reports the tokens, cost and latency of an agent's LLM and tool calls to the TokenUsageLedger
+
+    The tokens reported by the LLM are used when there are any. Otherwise, like for local
+    models or streamed responses, the prompt and the response are counted with the model's
+    tokenizer. LLM calls made while a tool runs, like the LLM of llm-math, count towards that
+    tool as well. Responses served from the LlmResponseCache count as calls without tokens.
+    """
+    run_inline = True  # Keep events in order on the event loop instead of a thread pool
+
+    def __init__(self, name: str, parent: str=None, count_tokens: Optional[Callable[[str], int]] = None, tool: Optional[str] = None):
+        """
+        Args:
+            name (str): The agent's name
+            parent (str, optional): The chain of agents leading to this one. Defaults to None.
+            count_tokens (Optional[Callable[[str], int]], optional): Counts tokens with the model's
+                tokenizer. Defaults to estimating them.
+            tool (Optional[str], optional): The parent agent's tool that runs this agent, which
+                LLM calls outside of this agent's own tools count towards. Defaults to None.
+        """
+        if parent:
+            self._name = f"{parent} > {name}"
+        else:
+            self._name = name
+        self._count_tokens = count_tokens or estimate_tokens
+        self._tool = tool
+        self._task_id = get_current_task_id()
+        self._ledger = TokenUsageLedger()
+        self._llm_runs: Dict[UUID, Tuple[float, str, str]] = {}  # run id -> start, model, prompt
+        self._tool_runs: Dict[UUID, Tuple[str, float]] = {}
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when LLM starts running."""
+        model = get_model_name(serialized, kwargs.get('invocation_params'))
+        self._llm_runs[run_id] = (time.perf_counter(), model, "\n".join(prompts))
+        self._parents[run_id] = parent_run_id
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when Chat Model starts running."""
+        model = get_model_name(serialized, kwargs.get('invocation_params'))
+        self._llm_runs[run_id] = (time.perf_counter(), model, "\n".join(get_buffer_string(m) for m in messages))
+        self._parents[run_id] = parent_run_id
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when LLM ends running."""
+        if run_id not in self._llm_runs:
+            return
+        start, model, prompt = self._llm_runs.pop(run_id)
+        seconds = time.perf_counter() - start
+        tool = self._find_tool(run_id)
+        self._parents.pop(run_id, None)
+
+        if is_cached(response):
+            self._ledger.record_llm_call(self._task_id, self._name, tool, model, 0, 0, seconds, cached=True, run_id=run_id)
+            return
+        usage = get_reported_usage(response)
+        estimated = usage is None
+        if estimated:
+            usage = (self._safe_count(prompt), self._safe_count(self._get_completion_text(response)))
+        self._ledger.record_llm_call(self._task_id, self._name, tool, model, usage[0], usage[1], seconds, estimated=estimated, run_id=run_id)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when LLM errors."""
+        self._llm_runs.pop(run_id, None)
+        self._parents.pop(run_id, None)
+
+    def on_chain_start(
+        self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when chain starts running."""
+        self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when chain ends running."""
+        self._parents.pop(run_id, None)
+
+    def on_chain_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when chain errors."""
+        self._parents.pop(run_id, None)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        """Run when tool starts running."""
+        tool = serialized.get('name', serialized.get('tool', 'unknown'))
+        self._tool_runs[run_id] = (tool, time.perf_counter())
+        self._parents[run_id] = parent_run_id
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
+        """Run when tool ends running."""
+        self._end_tool(run_id, error=False)
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        """Run when tool errors."""
+        self._end_tool(run_id, error=True)
+
+    def _end_tool(self, run_id: UUID, error: bool):
+        self._parents.pop(run_id, None)
+        if run_id in self._tool_runs:
+            tool, start = self._tool_runs.pop(run_id)
+            self._ledger.record_tool_call(self._task_id, self._name, tool, time.perf_counter() - start, error)
+
+    def _find_tool(self, run_id: UUID) -> Optional[str]:
+        """Finds the tool that a run is part of by walking up its parent runs"""
+        parent = self._parents.get(run_id)
+        while parent is not None:
+            if parent in self._tool_runs:
+                return self._tool_runs[parent][0]
+            parent = self._parents.get(parent)
+        return self._tool
+
+    def _safe_count(self, text: str) -> int:
+        if not text:
+            return 0
+        try:
+            return self._count_tokens(text)
+        except Exception as e:
+            logger.debug(f"Unable to count tokens, estimating them instead. Error message: {e}")
+            return estimate_tokens(text)
+
+    @staticmethod
+    def _get_completion_text(response: LLMResult) -> str:
+        """Gets the text of a response, including the tool calls of chat models"""
+        texts = []
+        for generations in response.generations:
+            for generation in generations:
+                texts.append(generation.text)
+                message = getattr(generation, 'message', None)
+                if message is not None and message.additional_kwargs:
+                    texts.append(json.dumps(message.additional_kwargs, default=str))
+        return "".join(texts)
@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterator, Optional, Tuple
+from uuid import UUID
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from alfred_ai_backend.core.Config import Config, SingletonMeta
+import contextvars
+import threading
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+MAX_TASKS = 100  # Tasks whose usage is kept for the session
+MAX_LLM_RUNS = 1000  # LLM calls whose tokens are kept for the other callbacks of the run
+
+# The task that callbacks created in this context report to. Tools run on other threads
+# with a copy of the context, so nested agents report to the task that started them.
+_current_task: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('current_task', default=None)
+
+
+def get_current_task_id() -> Optional[str]:
+    return _current_task.get()
+
+
+def _new_usage() -> Dict[str, Any]:
+    return {
+        'llm_calls': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_tokens': 0,
+        'cost_usd': 0.0,
+        'llm_seconds': 0.0,
+        'estimated_calls': 0,  # Calls whose tokens were counted locally because the LLM didn't report them
+        'cached_calls': 0,  # Calls served from the response cache, which cost nothing
+        'tool_calls': 0,
+        'tool_errors': 0,
+        'tool_seconds': 0.0,
+    }
+
+
+class _UsageReport():
+    """Usage totals overall and by agent, tool and model"""
+
+    def __init__(self):
+        self.total = _new_usage()
+        self.agents: Dict[str, Dict[str, Any]] = defaultdict(_new_usage)
+        self.tools: Dict[str, Dict[str, Any]] = defaultdict(_new_usage)
+        self.models: Dict[str, Dict[str, Any]] = defaultdict(_new_usage)
+
+    def add_llm_call(self, agent: str, tool: Optional[str], model: str, prompt_tokens: int, completion_tokens: int, cost: float, seconds: float, estimated: bool, cached: bool):
+        usages = [self.total, self.agents[agent], self.models[model]]
+        if tool:
+            usages.append(self.tools[tool])
+        for usage in usages:
+            usage['llm_calls'] += 1
+            usage['prompt_tokens'] += prompt_tokens
+            usage['completion_tokens'] += completion_tokens
+            usage['total_tokens'] += prompt_tokens + completion_tokens
+            usage['cost_usd'] += cost
+            usage['llm_seconds'] += seconds
+            usage['estimated_calls'] += int(estimated)
+            usage['cached_calls'] += int(cached)
+
+    def add_tool_call(self, agent: str, tool: str, seconds: float, error: bool):
+        for usage in (self.total, self.agents[agent], self.tools[tool]):
+            usage['tool_calls'] += 1
+            usage['tool_errors'] += int(error)
+            usage['tool_seconds'] += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total': dict(self.total),
+            'agents': {name: dict(usage) for name, usage in self.agents.items()},
+            'tools': {name: dict(usage) for name, usage in self.tools.items()},
+            'models': {name: dict(usage) for name, usage in self.models.items()},
+        }
+
+
+class TokenUsageLedger(metaclass=SingletonMeta):
+    """Collects the token usage, cost and latency of every LLM and tool call of the session
+
+    The TokenCounter callback of each agent, including the sub-agents, reports here. The
+    usage is totaled for each task and for the whole session, and broken down by agent,
+    tool and model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = _UsageReport()
+        self._tasks: OrderedDict[str, _UsageReport] = OrderedDict()
+        self._llm_runs: OrderedDict[UUID, Tuple[int, int, bool]] = OrderedDict()
+        # USD per million tokens by model name
+        self._pricing: Dict[str, Dict[str, float]] = (root_config.get('token_usage') or {}).get('pricing') or {}
+
+    @contextmanager
+    def track_task(self, task_id: Optional[str] = None) -> Iterator[str]:
+        """Makes the usage of the LLM and tool calls in this context count towards a task
+
+        Args:
+            task_id (Optional[str], optional): The task's id. Defaults to a new one.
+
+        Yields:
+            str: The task's id
+        """
+        task_id = task_id or uuid.uuid4().hex
+        with self._lock:
+            self._tasks[task_id] = _UsageReport()
+            while len(self._tasks) > MAX_TASKS:
+                self._tasks.popitem(last=False)
+        token = _current_task.set(task_id)
+        try:
+            yield task_id
+        finally:
+            _current_task.reset(token)
+
+    def record_llm_call(self, task_id: Optional[str], agent: str, tool: Optional[str], model: str, prompt_tokens: int, completion_tokens: int, seconds: float, estimated: bool = False, cached: bool = False, run_id: Optional[UUID] = None):
+        """Records an LLM call
+
+        Args:
+            task_id (Optional[str]): The task it was made for, if any
+            agent (str): The agent that made it, like `AgentManager > Coder`
+            tool (Optional[str]): The tool it was made for, if any
+            model (str): The model name
+            prompt_tokens (int): The tokens of the prompt
+            completion_tokens (int): The tokens of the response
+            seconds (float): How long it took
+            estimated (bool, optional): The tokens were counted locally. Defaults to False.
+            cached (bool, optional): The response came from the response cache. Defaults to False.
+            run_id (Optional[UUID], optional): The LLM run, to get its tokens with `get_llm_run`.
+                Defaults to None.
+        """
+        cost = self.get_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            if run_id is not None:
+                self._llm_runs[run_id] = (prompt_tokens, completion_tokens, estimated)
+                while len(self._llm_runs) > MAX_LLM_RUNS:
+                    self._llm_runs.popitem(last=False)
+            reports = [self._session]
+            if task_id in self._tasks:
+                reports.append(self._tasks[task_id])
+            for report in reports:
+                report.add_llm_call(agent, tool, model, prompt_tokens, completion_tokens, cost, seconds, estimated, cached)
+
+    def get_llm_run(self, run_id: UUID) -> Optional[Tuple[int, int, bool]]:
+        """Gets the tokens recorded for an LLM run, so other callbacks don't count them again
+
+        Returns:
+            Optional[Tuple[int, int, bool]]: The prompt and completion tokens and whether they
+                were counted locally, or None if the run wasn't recorded
+        """
+        with self._lock:
+            return self._llm_runs.get(run_id)
+
+    def record_tool_call(self, task_id: Optional[str], agent: str, tool: str, seconds: float, error: bool = False):
+        """Records a tool call
+
+        Args:
+            task_id (Optional[str]): The task it was made for, if any
+            agent (str): The agent that called the tool
+            tool (str): The tool name
+            seconds (float): How long it took
+            error (bool, optional): The tool failed. Defaults to False.
+        """
+        with self._lock:
+            reports = [self._session]
+            if task_id in self._tasks:
+                reports.append(self._tasks[task_id])
+            for report in reports:
+                report.add_tool_call(agent, tool, seconds, error)
+
+    def get_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Gets the cost in USD of a call, zero for models without pricing like local ones"""
+        pricing = self._pricing.get(model)
+        if not pricing:
+            return 0.0
+        return (prompt_tokens * pricing.get('prompt', 0.0) + completion_tokens * pricing.get('completion', 0.0)) / 1e6
+
+    def get_task_usage(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Gets the usage of a task
+
+        Returns:
+            Optional[Dict[str, Any]]: The `total` usage and the usage by `agents`, `tools` and
+                `models`, or None if the task isn't known
+        """
+        with self._lock:
+            report = self._tasks.get(task_id)
+            return report.to_dict() if report else None
+
+    def get_session_usage(self) -> Dict[str, Any]:
+        """Gets the usage of every task of the session, in the same format as a task's usage"""
+        with self._lock:
+            return self._session.to_dict()
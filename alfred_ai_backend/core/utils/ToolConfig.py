@@ -12,6 +12,7 @@ class ToolConfig():
     """
 
     def __init__(self, tool_config_file_name: str, model_path: str):
+        self.file_name = tool_config_file_name
         try:
             config_file_path = Path(Path(model_path).parent,'config',tool_config_file_name)
             with open(config_file_path, 'r') as f:
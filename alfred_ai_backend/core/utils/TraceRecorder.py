@@ -0,0 +1,216 @@
+from typing import Any, Dict, Iterator, List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from uuid import UUID
+from alfred_ai_backend.core.Config import Config, SingletonMeta
+from pathlib import Path
+import threading
+import logging
+import json
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+MAX_TRACES = 20  # Traces of the most recent tasks kept in memory
+
+
+@dataclass
+class Span:
+    """A timed part of a task, like an agent step, an LLM call or a tool call"""
+    id: UUID
+    parent_id: Optional[UUID]
+    name: str
+    kind: str  # task, agent, step, chain, llm or tool
+    agent: str
+    start_ns: int
+    thread: int = field(default_factory=threading.get_ident)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def end(self, error: Optional[str] = None):
+        self.end_ns = time.time_ns()
+        self.error = error
+
+
+class _Trace():
+    def __init__(self, task: Span):
+        self.task = task
+        self.spans: List[Span] = [task]
+        self.file: Optional[str] = None
+
+
+def is_tracing_enabled() -> bool:
+    return (root_config.get('tracing') or {}).get('enabled', False)
+
+
+class TraceRecorder(metaclass=SingletonMeta):
+    """Collects the spans of each task, reported by the SpanTracer callback of every agent
+
+    A task's spans form a tree: the task, each agent, its steps, and the LLM calls, chains and
+    tool calls of each step, with the agents that tools run nested under those tools. When the
+    task ends, its trace is written to `tracing.folder` as Chrome trace JSON, which opens in
+    chrome://tracing, Perfetto or speedscope, or as OTLP JSON for OpenTelemetry tools.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._traces: OrderedDict[str, _Trace] = OrderedDict()
+
+    @contextmanager
+    def trace_task(self, task_id: str, task: str) -> Iterator[None]:
+        """Records a task's spans while it runs and writes its trace once it's done, if tracing is enabled
+
+        Args:
+            task_id (str): The task's id, from TokenUsageLedger.track_task
+            task (str): The task
+        """
+        if not is_tracing_enabled():
+            yield
+            return
+        span = Span(uuid.uuid4(), None, "task", "task", "", time.time_ns(), attributes={'input_chars': len(task)})
+        with self._lock:
+            self._traces[task_id] = _Trace(span)
+            while len(self._traces) > MAX_TRACES:
+                self._traces.popitem(last=False)
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end(error)
+            self._write(task_id)
+
+    def add_span(self, task_id: Optional[str], span: Span) -> bool:
+        """Adds a span to a task's trace, under the task if it has no parent
+
+        Returns:
+            bool: Whether the task is being traced
+        """
+        with self._lock:
+            trace = self._traces.get(task_id)
+            if trace is None:
+                return False
+            if span.parent_id is None:
+                span.parent_id = trace.task.id
+            trace.spans.append(span)
+        return True
+
+    def get_spans(self, task_id: str) -> List[Span]:
+        with self._lock:
+            trace = self._traces.get(task_id)
+            return list(trace.spans) if trace else []
+
+    def get_trace_file(self, task_id: str) -> Optional[str]:
+        """Gets the file a task's trace was written to, if it was"""
+        with self._lock:
+            trace = self._traces.get(task_id)
+            return trace.file if trace else None
+
+    def _write(self, task_id: str):
+        config = root_config.get('tracing') or {}
+        trace_format = config.get('format', 'chrome')
+        spans = self.get_spans(task_id)
+        try:
+            if trace_format == 'otlp':
+                content, suffix = to_otlp(task_id, spans), "otlp.json"
+            else:
+                content, suffix = to_chrome_trace(spans), "trace.json"
+            path = Path(config.get('folder', '.alfred_traces'), f"{time.strftime('%Y%m%d-%H%M%S')}-{task_id[:8]}.{suffix}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, default=str)
+        except Exception as e:
+            logger.error(f"Unable to write the trace of task {task_id}. Error message: {e}")
+            return
+        with self._lock:
+            if task_id in self._traces:
+                self._traces[task_id].file = str(path)
+        logger.info(f"Wrote the trace of {len(spans)} spans to {path}")
+
+
+def _get_end_ns(span: Span) -> int:
+    # Spans still open when the trace is written, like after an error, end then
+    return span.end_ns if span.end_ns is not None else time.time_ns()
+
+
+def to_chrome_trace(spans: List[Span]) -> Dict[str, Any]:
+    """Converts spans to the Chrome trace event format
+
+    Each thread gets its own row, so tool calls that ran concurrently are shown side by side.
+
+    Args:
+        spans (List[Span]): The spans of a task
+
+    Returns:
+        Dict[str, Any]: The trace, to be written as JSON
+    """
+    start_ns = min((span.start_ns for span in spans), default=0)
+    threads: Dict[int, int] = {}
+    events = []
+    for span in sorted(spans, key=lambda s: s.start_ns):
+        tid = threads.setdefault(span.thread, len(threads) + 1)
+        args = {'agent': span.agent, **span.attributes}
+        if span.error:
+            args['error'] = span.error
+        events.append({
+            'name': span.name,
+            'cat': span.kind,
+            'ph': 'X',
+            'ts': (span.start_ns - start_ns) / 1000,
+            'dur': (_get_end_ns(span) - span.start_ns) / 1000,
+            'pid': 1,
+            'tid': tid,
+            'args': args,
+        })
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'Alfred.ai'}})
+    for thread, tid in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': 'main' if tid == 1 else f"thread {tid}"}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _to_otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(task_id: str, spans: List[Span]) -> Dict[str, Any]:
+    """Converts spans to the OTLP JSON format of OpenTelemetry traces
+
+    Args:
+        task_id (str): The task's id, which becomes the trace id
+        spans (List[Span]): The spans of a task
+
+    Returns:
+        Dict[str, Any]: The trace, to be written as JSON
+    """
+    trace_id = uuid.UUID(hex=task_id).hex if len(task_id) == 32 else uuid.uuid5(uuid.NAMESPACE_OID, task_id).hex
+    otlp_spans = []
+    for span in spans:
+        attributes = {'alfred.kind': span.kind, 'alfred.agent': span.agent, **{f"alfred.{key}": value for key, value in span.attributes.items()}}
+        otlp_span = {
+            'traceId': trace_id,
+            'spanId': span.id.hex[:16],
+            'name': span.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(_get_end_ns(span)),
+            'attributes': [{'key': key, 'value': _to_otlp_value(value)} for key, value in attributes.items() if value is not None],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+        }
+        if span.parent_id is not None:
+            otlp_span['parentSpanId'] = span.parent_id.hex[:16]
+        otlp_spans.append(otlp_span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'alfred_ai'}}]},
+        'scopeSpans': [{'scope': {'name': 'alfred_ai_backend'}, 'spans': otlp_spans}],
+    }]}
@@ -0,0 +1,11 @@
+from typing import Optional
+
+def get_colored_text(text: str, color: Optional[str]="yellow", **kwargs):
+    _TEXT_COLOR_MAPPING = {
+        "blue": "36;1",
+        "yellow": "33;1",
+        "pink": "38;5;200",
+        "green": "32;1",
+        "red": "31;1",
+    }
+    return f"\u001b[{_TEXT_COLOR_MAPPING[color]}m\033[1;3m{text}\u001b[0m"
@@ -0,0 +1,144 @@
+"""Writes the logs on a background thread, so the agents only queue their records
+
+The root logger gets a single handler that puts records on a queue, and a listener thread
+formats them and writes them to the real handlers: the console, the log file and, optionally,
+a JSONL file that is rotated by size and compressed.
+
+Like with QueueHandler, a record's message is merged with its arguments before it's queued,
+since any logger in the process may pass objects that change once the call returns. Logging
+`logger.debug("Prompts: %s", prompts)` costs the agent's thread a level check when DEBUG is
+disabled, and formatting the message when it is enabled. The writing is left to the listener.
+"""
+from typing import Any, Dict, List, Optional
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timezone
+from pathlib import Path
+import threading
+import logging
+import atexit
+import copy
+import queue
+import gzip
+import json
+import os
+import shutil
+
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+_registered_exit = False
+_exception_formatter = logging.Formatter()
+
+
+class _MessageQueueHandler(QueueHandler):
+    """Queues records with their message merged, but leaves the formatting to the handlers
+
+    QueueHandler formats the whole record with its own formatter first, which folds the
+    traceback into the message. This keeps it apart as text, for the JSONL `exception` field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as a JSON object on one line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _compressed_name(name: str) -> str:
+    return f"{name}.gz"
+
+
+def _compress(source: str, dest: str):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def create_jsonl_handler(jsonl_config: Dict[str, Any]) -> logging.Handler:
+    """Creates the handler of the structured logs
+
+    Args:
+        jsonl_config (Dict[str, Any]): The `logging.jsonl` config, with the `file`, its
+            `max_size_mb` before it's rotated, the `backup_count` of rotated files kept and
+            whether to `compress` them
+
+    Returns:
+        logging.Handler: The handler, writing a JSON object per line
+    """
+    file = jsonl_config.get('file', 'output.jsonl')
+    Path(file).parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(
+        file,
+        maxBytes=int(jsonl_config.get('max_size_mb', 50) * 1024 * 1024),
+        backupCount=jsonl_config.get('backup_count', 5),
+        encoding='utf-8',
+    )
+    if jsonl_config.get('compress', True):
+        handler.namer = _compressed_name
+        handler.rotator = _compress
+    handler.setFormatter(JsonLinesFormatter())
+    if jsonl_config.get('level'):
+        handler.setLevel(getattr(logging, jsonl_config['level']))
+    return handler
+
+
+def start_log_writer(handlers: List[logging.Handler], level: int):
+    """Sends the logs of the root logger to the handlers through the background writer
+
+    Replaces the root logger's handlers and the writer started before, if any. The writer is
+    stopped, and the logs still queued written, when the process exits.
+
+    Args:
+        handlers (List[logging.Handler]): Where the logs are written
+        level (int): The level of the root logger
+    """
+    global _listener, _registered_exit
+    stop_log_writer()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(level)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    with _lock:
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        if not _registered_exit:
+            atexit.register(stop_log_writer)
+            _registered_exit = True
+    root.addHandler(_MessageQueueHandler(log_queue))
+
+
+def stop_log_writer():
+    """Writes the logs still queued and stops the background writer"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -0,0 +1,26 @@
+from typing import Optional
+import sys
+
+
+def get_rss_mb() -> Optional[float]:
+    """Gets the resident memory of this process
+
+    Uses psutil when it's installed and falls back on the peak resident memory from the
+    resource module, which isn't available on Windows.
+
+    Returns:
+        Optional[float]: The resident memory in MB or None if it can't be measured
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
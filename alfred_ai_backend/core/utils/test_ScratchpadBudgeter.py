@@ -0,0 +1,92 @@
+import unittest
+from langchain_core.agents import AgentAction
+from alfred_ai_backend.core.utils.ScratchpadBudgeter import ScratchpadBudgeter
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def step(tool: str, tool_input: str, observation: str):
+    return (AgentAction(tool, tool_input, ""), observation)
+
+
+def lines(prefix: str, n: int) -> str:
+    return "\n".join(f"{prefix} line {i}" for i in range(n))
+
+
+class TestScratchpadBudgeter(unittest.TestCase):
+    def create(self, **kwargs) -> ScratchpadBudgeter:
+        settings = {'max_tokens': 100, 'keep_recent_steps': 1, 'max_observation_tokens': 1000, 'read_only_tools': ["read_file"]}
+        return ScratchpadBudgeter(count_words, **{**settings, **kwargs})
+
+    def total(self, budgeter: ScratchpadBudgeter, steps) -> int:
+        return sum(budgeter.count(f"{action.tool} {action.tool_input}") + budgeter.count(observation) for action, observation in steps)
+
+    def test_under_budget_is_unchanged(self):
+        steps = [step("read_file", "a.py", "x = 1"), step("read_file", "a.py", "x = 1")]
+
+        self.assertEqual(self.create().fit(steps), steps)
+
+    def test_dedupes_repeated_reads_with_the_same_output(self):
+        content = lines("a", 30)
+        steps = [step("read_file", "a.py", content), step("list_directory", ".", "a.py"), step("read_file", "a.py", content)]
+        budgeter = self.create(max_tokens=120, read_only_tools=["read_file", "list_directory"])
+
+        observations = [observation for _, observation in budgeter.fit(steps)]
+
+        self.assertEqual(observations[0], "[Same output as the later read_file call in step 3]")
+        self.assertEqual(observations[1:], ["a.py", content])
+
+    def test_doesnt_dedupe_across_a_write(self):
+        content = lines("a", 30)
+        steps = [step("read_file", "a.py", content), step("write_file", "a.py", "ok"), step("read_file", "a.py", content)]
+
+        observations = [observation for _, observation in self.create().fit(steps)]
+
+        self.assertNotIn("Same output", observations[0])
+
+    def test_doesnt_dedupe_a_changed_output(self):
+        steps = [step("read_file", "a.py", lines("a", 30)), step("read_file", "a.py", lines("b", 30))]
+
+        observations = [observation for _, observation in self.create().fit(steps)]
+
+        self.assertNotIn("Same output", observations[0])
+
+    def test_truncates_old_observations(self):
+        budgeter = self.create(max_tokens=10000, max_observation_tokens=30)
+        content = lines("a", 50)
+        steps = [step("read_file", "a.py", content), step("read_file", "b.py", content)]
+
+        observations = [observation for _, observation in budgeter.fit(steps)]
+
+        self.assertTrue(observations[0].startswith("a line 0"))
+        self.assertTrue(observations[0].endswith("a line 49"))
+        self.assertIn("tokens truncated", observations[0])
+        self.assertLess(count_words(observations[0]), count_words(content))
+        # The most recent step keeps its whole observation
+        self.assertEqual(observations[1], content)
+
+    def test_elides_the_oldest_steps_first(self):
+        budgeter = self.create(max_tokens=150, keep_recent_steps=1)
+        steps = [step("read_file", f"{name}.py", lines(name, 20)) for name in ["a", "b", "c"]]
+
+        observations = [observation for _, observation in budgeter.fit(steps)]
+
+        self.assertTrue(observations[0].startswith("a line 0 ... ["))
+        self.assertIn("tokens elided", observations[0])
+        self.assertEqual(observations[1:], [lines("b", 20), lines("c", 20)])
+
+    def test_stays_within_the_budget(self):
+        budgeter = self.create(max_tokens=80, keep_recent_steps=2)
+        steps = [step("read_file", f"{i}.py", lines(str(i), 40)) for i in range(5)]
+
+        fitted = budgeter.fit(steps)
+
+        self.assertLessEqual(self.total(budgeter, fitted), 80)
+        # The actions are never changed
+        self.assertEqual([action for action, _ in fitted], [action for action, _ in steps])
+
+
+if __name__ == '__main__':
+    unittest.main()
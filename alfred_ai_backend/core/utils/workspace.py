@@ -0,0 +1,48 @@
+from pathlib import Path
+from alfred_ai_backend.core.Config import Config
+import logging
+import shutil
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+
+
+def prepare_workspace(workspace: Path, copy_root_folder: bool = False) -> Path:
+    """Creates a folder for agents to work in instead of the configured root_folder
+
+    Args:
+        workspace (Path): The folder
+        copy_root_folder (bool, optional): Start a new workspace as a copy of the configured
+            root_folder. An existing workspace is kept as is. Defaults to False.
+
+    Returns:
+        Path: The absolute path of the workspace
+    """
+    workspace = Path(workspace).resolve()
+    source = Path(str(root_config.get('root_folder') or ''))
+    if copy_root_folder and not workspace.exists() and source.is_dir():
+        logger.info(f"Copying {source} to the workspace {workspace}")
+        shutil.copytree(source, workspace)
+    workspace.mkdir(parents=True, exist_ok=True)
+    return workspace
+
+
+def reset_workspace(workspace: Path, copy_root_folder: bool = False):
+    """Empties a workspace, like before another task works in it
+
+    The folder itself is kept, since the agents' tools were created with its path.
+
+    Args:
+        workspace (Path): The folder
+        copy_root_folder (bool, optional): Start it again as a copy of the configured
+            root_folder. Defaults to False.
+    """
+    workspace = Path(workspace)
+    for child in workspace.iterdir():
+        if child.is_dir() and not child.is_symlink():
+            shutil.rmtree(child)
+        else:
+            child.unlink()
+    source = Path(str(root_config.get('root_folder') or ''))
+    if copy_root_folder and source.is_dir():
+        shutil.copytree(source, workspace, dirs_exist_ok=True)
@@ -1,13 +1,20 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Sequence, Optional, List
+from typing import Any, Callable, Dict, Sequence, Optional, List, Tuple, Type
 import logging
 from langchain.agents import AgentExecutor
 from langchain_core.tools import BaseTool
 from langchain.tools.render import ToolsRenderer, render_text_description_and_args
 from alfred_ai_backend.core.Config import Config
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig
 
 from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
+from alfred_ai_backend.models.ModelRegistry import ModelRegistry, get_call_settings
+from alfred_ai_backend.core.LlmResponseCache import get_llm_response_cache
+from alfred_ai_backend.core.utils.TokenCounter import estimate_tokens
+from alfred_ai_backend.core.utils.ScratchpadBudgeter import ScratchpadBudgeter
+from alfred_ai_backend.models.ParallelAgentExecutor import DEFAULT_READ_ONLY_TOOLS
+from langchain_core.agents import AgentAction
+from langchain_core.messages import BaseMessage
 #from alfred_ai_backend.core.utils.redirect_stream import RedirectStdStreamsToLogger
 #from langchain_community.callbacks import wandb_tracing_enabled
 
@@ -21,10 +28,88 @@ class Model(ABC):
         self._llm  = None
         self._agent_executor: AgentExecutor = None
         self._tool_config = tool_config
+        self._call_settings: Dict[str, Any] = {}
+        self._has_tokenizer = True
+        self._scratchpad_budgeter: Optional[ScratchpadBudgeter] = None
+
+    def count_tokens(self, text: str) -> int:
+        """Counts the tokens of a text with the LLM's tokenizer
+
+        When the LLM has no usable tokenizer, it's estimated at 4 characters per token.
+        """
+        if self._has_tokenizer and self._llm is not None:
+            try:
+                return self._llm.get_num_tokens(text)
+            except Exception as e:
+                logger.warning(f"Unable to count tokens with {type(self._llm).__name__}, estimating them instead. Error message: {e}")
+                self._has_tokenizer = False
+        return estimate_tokens(text)
 
     def get_llm(self):
         return self._llm
 
+    def get_bound_llm(self) -> Runnable:
+        """Gets the shared LLM with this agent's sampling settings bound, for the chains of its tools"""
+        return self._bind_call_settings(self._llm)
+
+    def _load_llm(self, llm_class: Type, factory: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """Gets the LLM from the model registry so agents with the same weights share it
+
+        All the sampling settings of this agent, like temperature, are kept to be bound
+        when the agent calls the LLM, with the class defaults for the ones it leaves out.
+
+        Args:
+            llm_class (Type): The LLM class
+            factory (Optional[Callable[[Dict[str, Any]], Any]], optional): Creates the LLM from
+                the load settings if it isn't loaded yet. Defaults to None.
+        """
+        init_config = self._get_init_config()
+        self._call_settings = get_call_settings(llm_class, init_config)
+        self._llm = ModelRegistry().get_llm(llm_class, init_config, factory)
+        cache = get_llm_response_cache()
+        if cache is not None:
+            self._llm.cache = cache
+
+    @property
+    def _stream_runnable(self) -> bool:
+        """Whether the agent streams the LLM while planning instead of invoking it
+
+        LangChain only looks in the response cache when the LLM is invoked, so agents with
+        a cached LLM invoke it. In streaming mode the LLM was created with `streaming=True`
+        and still sends its tokens to the callbacks as they arrive.
+        """
+        return getattr(self._llm, 'cache', None) is None
+
+    def _get_init_config(self) -> Dict[str, Any]:
+        """Gets the model's init config, with token streaming turned on in streaming mode"""
+        init_config = dict(self._tool_config.get_init_config() or {})
+        if root_config.get('streaming', {}).get('enabled', False):
+            init_config.setdefault('streaming', True)
+        return init_config
+
+    def _fit_scratchpad(self, intermediate_steps: List[Tuple[AgentAction, str]]) -> List[Tuple[AgentAction, str]]:
+        """Fits the agent's intermediate steps in its scratchpad token budget before they're rendered
+
+        The budget is set by `scratchpad` in the root config and can be overridden by the
+        tool config, for example for a model with a small context window.
+        """
+        if self._scratchpad_budgeter is None:
+            settings = {**(root_config.get('scratchpad') or {})}
+            if self._tool_config:
+                settings.update(self._tool_config.get('scratchpad') or {})
+            if not settings.pop('enabled', True):
+                return intermediate_steps
+            self._scratchpad_budgeter = ScratchpadBudgeter(
+                self.count_tokens,
+                read_only_tools=(root_config.get('agent_executor') or {}).get('read_only_tools', DEFAULT_READ_ONLY_TOOLS),
+                **settings,
+            )
+        return self._scratchpad_budgeter.fit(intermediate_steps)
+
+    def _bind_call_settings(self, runnable: Runnable) -> Runnable:
+        """Binds this agent's sampling settings to the shared LLM"""
+        return runnable.bind(**self._call_settings) if self._call_settings else runnable
+
     @abstractmethod
     def initialize_agent(
         self,
@@ -36,7 +121,60 @@ class Model(ABC):
     ):
         pass
     
+    def get_tools(self) -> List[BaseTool]:
+        """Gets the tools the agent executor runs
+
+        The executor validates its tools with pydantic, which copies them, so the sub-agents
+        that tools build on their first use are only on these copies, not on the tools given
+        to `initialize_agent`.
+        """
+        return list(getattr(self._agent_executor, 'tools', None) or [])
+
+    def clear_memory(self):
+        """Forgets the conversation, so the next task starts without the previous ones"""
+        memory = getattr(self._agent_executor, 'memory', None)
+        if memory is not None:
+            memory.clear()
+
+    def get_memory(self) -> List[BaseMessage]:
+        """Gets a copy of the conversation, to restore it with `set_memory`"""
+        memory = getattr(self._agent_executor, 'memory', None)
+        if memory is None:
+            return []
+        return list(memory.chat_memory.messages)
+
+    def set_memory(self, messages: List[BaseMessage]):
+        """Replaces the conversation, i.e. with one from `get_memory`"""
+        memory = getattr(self._agent_executor, 'memory', None)
+        if memory is not None:
+            memory.chat_memory.messages = list(messages)
+
     def invoke_agent_executor(self, input: Dict[str, Any], inference_config: Optional[RunnableConfig] = None, **kwargs: Any ) -> Dict[str, Any]:
         #with RedirectStdStreamsToLogger(logger):
             #with wandb_tracing_enabled():
         return self._agent_executor.invoke(input, inference_config, **kwargs)
+
+    async def ainvoke_agent_executor(self, input: Dict[str, Any], inference_config: Optional[RunnableConfig] = None, **kwargs: Any ) -> Dict[str, Any]:
+        """Invokes the agent executor asynchronously
+
+        Tool calls that the LLM requests together in one step run concurrently on this path.
+        """
+        return await self._agent_executor.ainvoke(input, inference_config, **kwargs)
+
+    def stream_agent_executor(self, input: Dict[str, Any], inference_config: Optional[RunnableConfig] = None, **kwargs: Any ) -> Dict[str, Any]:
+        """Runs the agent executor step by step instead of waiting for the whole task
+
+        The LLM tokens reach the callbacks' `on_llm_new_token` as they're generated, and each
+        tool call is logged as soon as its step completes.
+
+        Returns:
+            Dict[str, Any]: The final output, like `invoke_agent_executor`
+        """
+        response: Dict[str, Any] = {}
+        for chunk in self._agent_executor.stream(input, inference_config, **kwargs):
+            for step in chunk.get('steps', []):
+                logger.debug(f"Tool {step.action.tool} returned: {step.observation}")
+            if 'output' in chunk:
+                response = {**input, **chunk}
+        response.pop('messages', None)
+        return response
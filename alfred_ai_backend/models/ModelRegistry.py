@@ -0,0 +1,100 @@
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+from alfred_ai_backend.core.Config import SingletonMeta
+import threading
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+# Init settings that only affect sampling. Agents that differ only in these can share one
+# loaded model, and each agent binds its own values when it calls the model.
+CALL_TIME_SETTINGS = {
+    'temperature', 'top_p', 'top_k', 'max_tokens', 'repeat_penalty',
+    'frequency_penalty', 'presence_penalty', 'seed',
+}
+
+
+def split_init_config(init_config: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Splits a model's init config into what identifies the loaded model and the call time settings
+
+    Args:
+        init_config (Optional[Dict[str, Any]]): The init config of a model's tool config
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, Any]]: The load config and the call time settings
+    """
+    init_config = init_config or {}
+    load_config = {key: value for key, value in init_config.items() if key not in CALL_TIME_SETTINGS}
+    call_settings = {key: value for key, value in init_config.items() if key in CALL_TIME_SETTINGS}
+    return load_config, call_settings
+
+
+def get_call_settings(llm_class: Type, init_config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gets every sampling setting an agent binds to the shared LLM
+
+    The shared LLM is created without any agent's sampling settings, so each agent binds all
+    of them: its own, and the LLM class defaults for the ones it leaves out. That way an agent
+    never depends on the settings of the agent that happened to load the model.
+
+    Args:
+        llm_class (Type): The LLM class, like LlamaCpp or ChatOpenAI
+        init_config (Optional[Dict[str, Any]]): The init config of the model's tool config
+
+    Returns:
+        Dict[str, Any]: The call time settings
+    """
+    _, call_settings = split_init_config(init_config)
+    for field in getattr(llm_class, '__fields__', {}).values():
+        name = field.alias if field.alias in CALL_TIME_SETTINGS else field.name
+        if name in CALL_TIME_SETTINGS and name not in call_settings and field.default is not None:
+            call_settings[name] = field.default
+    return call_settings
+
+
+class ModelRegistry(metaclass=SingletonMeta):
+    """Holds the LLMs loaded by this process so agents with the same weights share one
+
+    For a local model like Mistral through llama.cpp, this means loading the GGUF file once
+    instead of once per agent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._llms: Dict[Tuple[str, str], Any] = {}
+        self._requests = 0
+
+    def get_llm(self, llm_class: Type, init_config: Optional[Dict[str, Any]], factory: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Any:
+        """Gets the shared LLM for an init config, loading it on first use
+
+        The LLM is created with the load settings only, the agents bind their sampling
+        settings from `get_call_settings` when they call it.
+
+        Args:
+            llm_class (Type): The LLM class, like LlamaCpp or ChatOpenAI
+            init_config (Optional[Dict[str, Any]]): The init config of the model's tool config
+            factory (Optional[Callable[[Dict[str, Any]], Any]], optional): Creates the LLM from the
+                load settings when it's not loaded yet. Defaults to calling `llm_class` with them.
+
+        Returns:
+            Any: The LLM
+        """
+        load_config, _ = split_init_config(init_config)
+        key = (f"{llm_class.__module__}.{llm_class.__qualname__}", json.dumps(load_config, sort_keys=True, default=str))
+        # Loading is slow, but holding the lock keeps two agents from loading the same weights
+        with self._lock:
+            self._requests += 1
+            llm = self._llms.get(key)
+            if llm is None:
+                start = time.perf_counter()
+                llm = factory(load_config) if factory else llm_class(**load_config)
+                self._llms[key] = llm
+                logger.info(f"Loaded {llm_class.__name__} in {time.perf_counter() - start:0.1f} sec ({len(self._llms)} models loaded)")
+            else:
+                logger.info(f"Reusing the loaded {llm_class.__name__}")
+        return llm
+
+    def get_stats(self) -> Dict[str, int]:
+        """Gets how many models were loaded and how many agents asked for one"""
+        with self._lock:
+            return {'models': len(self._llms), 'requests': self._requests}
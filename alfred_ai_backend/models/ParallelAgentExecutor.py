@@ -0,0 +1,136 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.tools import BaseTool
+from alfred_ai_backend.core.Config import Config
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+root_config = Config()
+
+# Tools that only read, so running them at the same time can't change their results
+DEFAULT_READ_ONLY_TOOLS = ["read_file", "list_directory", "file_search", "SearchCodeRepo"]
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int) -> ThreadPoolExecutor:
+    """Gets the thread pool shared by the read-only tools of all the agents with this many workers"""
+    with _pool_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"AgentTool{max_workers}")
+        return _pools[max_workers]
+
+
+class _PlannedStep():
+    """The actions of the step being taken and, once the first is performed, all their steps"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.actions: List[AgentAction] = []
+        self.steps: Optional[Dict[int, AgentStep]] = None  # id of the action -> its step
+
+
+# Set while AgentExecutor takes a step, so performing its first action can perform them all
+_planned_step: contextvars.ContextVar[Optional[_PlannedStep]] = contextvars.ContextVar('planned_step', default=None)
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """Agent executor that runs independent read-only tool calls of a step concurrently
+
+    When the LLM asks for several tools in one step, consecutive read-only tools run in a
+    bounded thread pool while any other tool waits for the ones before it and runs alone, so
+    writes keep their order. Observations are always returned in the order they were asked for.
+
+    Planning, parsing errors and running each tool are left to AgentExecutor. Its
+    `_iter_next_step` yields all the actions of a step before it performs the first one, so
+    that's when all of them are performed, grouped, and the rest are then returned in turn.
+    The async path is left to langchain, which already gathers all the actions of a step.
+    """
+    parallel_tools: bool = root_config.get('agent_executor', {}).get('parallel_tools', True)
+    max_parallel_tools: int = root_config.get('agent_executor', {}).get('max_parallel_tools', 4)
+    read_only_tools: Set[str] = set(root_config.get('agent_executor', {}).get('read_only_tools', DEFAULT_READ_ONLY_TOOLS))
+
+    def _iter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        planned = _PlannedStep()
+        outputs = super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+        while True:
+            # Only set around each output, as the consumer may run in another context between them
+            token = _planned_step.set(planned)
+            try:
+                output = next(outputs)
+            except StopIteration:
+                return
+            finally:
+                _planned_step.reset(token)
+            if isinstance(output, AgentAction):
+                planned.actions.append(output)
+            yield output
+
+    def _perform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        planned = _planned_step.get()
+        if not self.parallel_tools or planned is None or id(agent_action) not in map(id, planned.actions):
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if planned.steps is None:
+            planned.steps = self._perform_step(planned, name_to_tool_map, color_mapping, run_manager)
+        return planned.steps[id(agent_action)]
+
+    def _perform_step(
+        self,
+        planned: _PlannedStep,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        run_manager: Optional[CallbackManagerForChainRun],
+    ) -> Dict[int, AgentStep]:
+        """Performs all the actions of a step, grouping consecutive read-only ones
+
+        Returns:
+            Dict[int, AgentStep]: The step of each action by the action's id
+        """
+        perform = super()._perform_agent_action
+        plan_time = time.perf_counter() - planned.start
+        steps: Dict[int, AgentStep] = {}
+        concurrent = 0
+        group: List[AgentAction] = []
+        for action in planned.actions + [None]:
+            if action is not None and action.tool in self.read_only_tools:
+                group.append(action)
+                continue
+
+            if len(group) > 1:
+                pool = _get_pool(self.max_parallel_tools)
+                # Each tool gets a copy of this context so callbacks and tracing still see it
+                futures = [pool.submit(contextvars.copy_context().run, perform, name_to_tool_map, color_mapping, a, run_manager) for a in group]
+                for a, future in zip(group, futures):
+                    steps[id(a)] = future.result()
+                concurrent += len(group)
+            else:
+                for a in group:
+                    steps[id(a)] = perform(name_to_tool_map, color_mapping, a, run_manager)
+            group = []
+            if action is not None:
+                steps[id(action)] = perform(name_to_tool_map, color_mapping, action, run_manager)
+
+        logger.info(
+            f"Agent step: {len(planned.actions)} tool calls ({concurrent} concurrent) in {time.perf_counter() - planned.start:0.2f} sec "
+            f"(planning {plan_time:0.2f} sec, tools {time.perf_counter() - planned.start - plan_time:0.2f} sec)"
+        )
+        return steps
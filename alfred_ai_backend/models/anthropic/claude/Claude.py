@@ -6,10 +6,10 @@ from langchain.tools.render import ToolsRenderer, render_text_description_and_ar
 from langchain.memory import ConversationBufferWindowMemory
 from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
 from alfred_ai_backend.models.Model import Model
-from langchain_core.runnables import RunnableConfig
+from alfred_ai_backend.models.ParallelAgentExecutor import ParallelAgentExecutor
 from alfred_ai_backend.models.anthropic.claude.ClaudeAgentOutputParser import ClaudeAgentOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from alfred_ai_backend.models.anthropic.claude.utils import parse_tool_input
+from alfred_ai_backend.models.anthropic.claude.ClaudeScratchpad import ClaudeScratchpad
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,8 +29,9 @@ class Claude(Model):
                 #" and pip install -qU langchain-anthropic defusedxml"
             )
         self._chat_history = True
+        self._scratchpad = ClaudeScratchpad()
         # self._llm = ChatAnthropic(**self._tool_config.get_init_config())
-        self._llm = ChatAnthropicTools(**self._tool_config.get_init_config())
+        self._load_llm(ChatAnthropicTools)
     
     def initialize_agent(
         self,
@@ -64,12 +65,12 @@ class Claude(Model):
         if system_input_variables:
             prompt = prompt.partial(**system_input_variables)
 
-        llm_with_tools = self._llm.bind_tools(tools=tools, stop=["</tool_input>", "</final_answer>"])
+        llm_with_tools = self._bind_call_settings(self._llm.bind_tools(tools=tools, stop=["</tool_input>", "</final_answer>"]))
 
         agent = (
             RunnablePassthrough.assign(
                 agent_scratchpad=lambda x: self._convert_intermediate_steps(
-                    x["intermediate_steps"]
+                    self._fit_scratchpad(x["intermediate_steps"])
                 ),
                 #chat_history=lambda _: memory.load_memory_variables({})["chat_history"]
             )
@@ -78,46 +79,30 @@ class Claude(Model):
             | ClaudeAgentOutputParser()
         )
         
-        self._agent_executor = AgentExecutor(
+        self._agent_executor = ParallelAgentExecutor(
             agent=agent,
             tools=tools,
             verbose=False,  # If enabled, I think this is spitting "My output actions" to stdout
             handle_parsing_errors=True,
             early_stopping_method="generate",
             memory=memory,
+            stream_runnable=self._stream_runnable,
         )
         return self._agent_executor
 
 
-    def invoke_agent_executor(self, input: Dict[str, Any], inference_config: Optional[RunnableConfig] = None, **kwargs: Any  ) -> Dict[str, Any]:
-        # TODO add token counting for Anthropic
-        # with get_openai_callback() as cb:
-        logger.debug("*** Invoking with the following input: ", input)
-        response = self._agent_executor.invoke(input, inference_config, **kwargs)
-
-        # logger.info(f"Total Tokens: {cb.total_tokens}")
-        # logger.info(f"Prompt Tokens: {cb.prompt_tokens}")
-        # logger.info(f"Completion Tokens: {cb.completion_tokens}")
-        # logger.info(f"Total Cost (USD): ${cb.total_cost}")
-        return response
-
-
     def _convert_intermediate_steps(self, intermediate_steps: Any) -> str:
         """Logic for going from intermediate steps to a string to pass into model
         This is pretty tied to the prompt
 
         Source: https://python.langchain.com/docs/expression_language/cookbook/agent
 
+        Steps rendered on earlier agent steps are reused, see ClaudeScratchpad.
+
         Args:
             intermediate_steps (Any): intermediate steps
 
         Returns:
             str: string conversion
         """
-        log = ""
-        for action, observation in intermediate_steps:
-            log += (
-                f"<tool>{action.tool}</tool><tool_input>{str(parse_tool_input(action.tool_input))}"
-                f"</tool_input><observation>{observation}</observation>"
-            )
-        return log
+        return self._scratchpad.render(intermediate_steps)
@@ -0,0 +1,71 @@
+from typing import Any, List, Optional, Tuple
+from collections import OrderedDict
+from langchain_core.agents import AgentAction
+from alfred_ai_backend.models.anthropic.claude.utils import parse_tool_input
+import threading
+
+MAX_CACHED_STEPS = 1024
+
+
+def render_step(action: AgentAction, observation: Any) -> str:
+    """Renders one step the way the Claude prompt expects it"""
+    return (
+        f"<tool>{action.tool}</tool><tool_input>{str(parse_tool_input(action.tool_input))}"
+        f"</tool_input><observation>{observation}</observation>"
+    )
+
+
+class ClaudeScratchpad():
+    """Renders the agent scratchpad incrementally
+
+    Each step is rendered once and its fragment is kept, so an agent step only renders the
+    step it just added instead of re-parsing the tool input of every earlier action.  When
+    the steps were only appended to since the last render, only the new fragments are joined
+    to the previous text.
+
+    A step is rendered again if its observation changed, like when the scratchpad budget
+    truncated it.  Fragments are kept by action for the most recent steps, so agents
+    running several tasks at once share one scratchpad without mixing them up.
+    """
+
+    def __init__(self):
+        self._fragments: OrderedDict[int, Tuple[AgentAction, str, str]] = OrderedDict()  # id(action) -> action, observation, fragment
+        self._last_steps: List[Tuple[AgentAction, Any]] = []
+        self._last_text = ""
+        self._lock = threading.Lock()
+
+    def render(self, intermediate_steps: List[Tuple[AgentAction, Any]]) -> str:
+        """Renders the steps into the scratchpad text
+
+        Args:
+            intermediate_steps (List[Tuple[AgentAction, Any]]): The agent's actions and their observations
+
+        Returns:
+            str: The scratchpad
+        """
+        with self._lock:
+            last_steps, last_text = self._last_steps, self._last_text
+        # Comparing the lists only compares references unless a step was replaced
+        appended = len(intermediate_steps) >= len(last_steps) and intermediate_steps[:len(last_steps)] == last_steps
+        new_steps = intermediate_steps[len(last_steps):] if appended else intermediate_steps
+        text = (last_text if appended else "") + "".join(self._get_fragment(action, observation) for action, observation in new_steps)
+        with self._lock:
+            self._last_steps, self._last_text = list(intermediate_steps), text
+        return text
+
+    def _get_fragment(self, action: AgentAction, observation: Any) -> str:
+        observation = str(observation)
+        key = id(action)
+        with self._lock:
+            cached: Optional[Tuple[AgentAction, str, str]] = self._fragments.get(key)
+            if cached is not None and cached[0] is action and (cached[1] is observation or cached[1] == observation):
+                self._fragments.move_to_end(key)
+                return cached[2]
+        fragment = render_step(action, observation)
+        with self._lock:
+            # The action is kept with its fragment, so its id can't be reused while it's cached
+            self._fragments[key] = (action, observation, fragment)
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > MAX_CACHED_STEPS:
+                self._fragments.popitem(last=False)
+        return fragment
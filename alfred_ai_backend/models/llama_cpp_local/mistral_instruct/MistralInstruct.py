@@ -1,31 +1,175 @@
 from alfred_ai_backend.core.utils.RedirectStdStreamsToLogger import RedirectStdStreamsToLogger
 from alfred_ai_backend.models.Model import Model
-from typing import Sequence, Union, Optional, List, Dict
+from alfred_ai_backend.models.ParallelAgentExecutor import ParallelAgentExecutor
+from alfred_ai_backend.models.ModelRegistry import CALL_TIME_SETTINGS
+from typing import Any, Iterator, Sequence, Union, Optional, List, Dict
 from langchain_community.llms import LlamaCpp
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
+from langchain_core.callbacks import CallbackManagerForLLMRun, Callbacks
+from langchain_core.pydantic_v1 import PrivateAttr, root_validator
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.tools import BaseTool
 from langchain_core.prompts.chat import ChatPromptTemplate, PromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain.tools.render import ToolsRenderer, render_text_description_and_args
 from langchain.agents.output_parsers import JSONAgentOutputParser
-from langchain_core.agents import AgentExecutor, AgentAction, AgentFinish
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_log_to_str
 from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers.json import parse_json_markdown
 from langchain.memory import ConversationBufferWindowMemory
 from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
+import contextvars
+import threading
 import logging
+import time
 
 
 logger = logging.getLogger(__name__)
 B_INST, E_INST = "[INST]", "[/INST]"
 BOS, EOS = "<s> ", " </s>"
 
+# The settings bound to the call being generated, like the agent's temperature
+_bound_settings: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('bound_settings', default={})
+
+class SharedLlamaCpp(LlamaCpp):
+    """LlamaCpp that several agents can share
+
+    A llama.cpp context isn't thread safe, so calls from agents running at the same time
+    take turns.
+
+    llama.cpp only evaluates the part of a prompt that differs from the tokens already in
+    its KV state. Consecutive steps of an agent share everything up to the new scratchpad
+    step, but once another agent used the model its state holds that agent's prompt. With
+    the prefix cache enabled, the KV state after each call is kept in RAM and the state
+    sharing the longest prefix with the next prompt is restored first, so agents taking
+    turns still only evaluate their new tokens.
+
+    The prefix cache is a load setting, `prefix_cache_mb` in the model's init config, like
+    `n_ctx`, since every agent sharing the model shares its KV states.
+
+    Each call logs how many prompt tokens were reused and evaluated and the time to first
+    token. They're also added to the generation info as `prompt_eval`.
+
+    LangChain describes a call of a text completion LLM, for the response cache and the
+    callbacks, by the LLM's settings and the stop words only. The settings each agent binds,
+    like its temperature, are added to them so agents with different settings don't get
+    each other's cached responses. Only the sampling settings are added, not per-run
+    arguments like `tags` or `run_name`, so those never split or end up in cache keys.
+    """
+    prefix_cache_mb: Optional[float] = None
+    """The RAM for the KV states of recent prompts. A state holds the KV cache of one prompt,
+    so it takes several to cover agents taking turns. None disables the prefix cache."""
+
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    def generate(self, prompts: List[str], stop: Optional[List[str]] = None, callbacks: Callbacks = None, **kwargs: Any) -> LLMResult:
+        token = _bound_settings.set(self._get_bound_settings(kwargs))
+        try:
+            return super().generate(prompts, stop=stop, callbacks=callbacks, **kwargs)
+        finally:
+            _bound_settings.reset(token)
+
+    async def agenerate(self, prompts: List[str], stop: Optional[List[str]] = None, callbacks: Callbacks = None, **kwargs: Any) -> LLMResult:
+        token = _bound_settings.set(self._get_bound_settings(kwargs))
+        try:
+            return await super().agenerate(prompts, stop=stop, callbacks=callbacks, **kwargs)
+        finally:
+            _bound_settings.reset(token)
+
+    def dict(self, **kwargs: Any) -> Dict:
+        return {**super().dict(**kwargs), **_bound_settings.get()}
+
+    @staticmethod
+    def _get_bound_settings(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in kwargs.items() if key in CALL_TIME_SETTINGS}
+
+    @root_validator()
+    def set_prefix_cache(cls, values: Dict) -> Dict:
+        """Gives the llama.cpp client, once LlamaCpp created it, a RAM cache of KV states"""
+        capacity_mb = values.get('prefix_cache_mb')
+        if capacity_mb and values.get('client') is not None:
+            from llama_cpp import LlamaRAMCache
+            values['client'].set_cache(LlamaRAMCache(capacity_bytes=int(capacity_mb * 1024 * 1024)))
+            logger.info(f"Enabled the llama.cpp prefix cache with {capacity_mb} MB")
+        return values
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        # Like LLM._generate but keeping the generation info with the prompt evaluation. The
+        # tokens are always generated one by one, so the time to first token is measured
+        # without streaming too, they're just not sent to the callbacks then
+        generations = []
+        for prompt in prompts:
+            generation: Optional[GenerationChunk] = None
+            for chunk in self._stream(prompt, stop=stop, run_manager=run_manager if self.streaming else None, **kwargs):
+                generation = chunk if generation is None else generation + chunk
+            generations.append([Generation(text=generation.text, generation_info=generation.generation_info) if generation else Generation(text="")])
+        return LLMResult(generations=generations)
+
+    def _call(self, *args: Any, **kwargs: Any) -> str:
+        with self._lock:
+            return super()._call(*args, **kwargs)
+
+    def _stream(self, prompt: str, *args: Any, **kwargs: Any) -> Iterator[GenerationChunk]:
+        with self._lock:
+            start = time.perf_counter()
+            prompt_eval = self._measure_prompt(prompt)
+            first_token = None
+            for chunk in super()._stream(prompt, *args, **kwargs):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield chunk
+            if first_token is not None:
+                prompt_eval['first_token_seconds'] = round(first_token, 3)
+            self._log_prompt_eval(prompt_eval, time.perf_counter() - start)
+            yield GenerationChunk(text="", generation_info={'prompt_eval': prompt_eval})
+
+    def _measure_prompt(self, prompt: str) -> Dict[str, Any]:
+        """Counts the prompt's tokens and how many of them llama.cpp can reuse from a KV state
+
+        Only public parts of llama-cpp-python are used: the tokens in the KV state are the first
+        `n_tokens` of `input_ids`, and a LlamaRAMCache keeps its states by their tokens in
+        `cache_state`.
+        """
+        try:
+            llama = self.client
+            tokens = llama.tokenize(prompt.encode("utf-8"), special=True)
+            states = [llama.input_ids[:llama.n_tokens].tolist()]
+            states += list(getattr(llama.cache, 'cache_state', None) or {})
+            reused = max(type(llama).longest_token_prefix(state, tokens) for state in states)
+            # The last prompt token is always evaluated again for its logits
+            reused = max(0, min(reused, len(tokens) - 1))
+            return {'prompt_tokens': len(tokens), 'reused_tokens': reused, 'evaluated_tokens': len(tokens) - reused}
+        except Exception as e:
+            logger.debug(f"Unable to measure the prompt evaluation. Error message: {e}")
+            return {}
+
+    def _log_prompt_eval(self, prompt_eval: Dict[str, Any], seconds: float):
+        if not prompt_eval:
+            return
+        first_token = f", first token after {prompt_eval['first_token_seconds']:0.2f} sec" if 'first_token_seconds' in prompt_eval else ""
+        logger.info(
+            f"Prompt of {prompt_eval['prompt_tokens']} tokens: {prompt_eval['reused_tokens']} reused from the KV cache, "
+            f"{prompt_eval['evaluated_tokens']} evaluated{first_token}, done in {seconds:0.2f} sec"
+        )
+
+
 class MistralInstruct(Model):
     def __init__(self, tool_config: Optional[ToolConfig] = None):
         super().__init__(tool_config)
-        # Load the model using the model's init config and send any std messages to logger
-        with RedirectStdStreamsToLogger(logger):
-            self._llm = LlamaCpp(**self._tool_config.get.get_init_config())
+        # Load the model using the model's init config and send any std messages to logger.
+        # This swaps the process's streams, which is why start.py loads it before the prompt
+        # (`load_before_prompt`). Agents with the same model path share the loaded weights.
+        def load_llm(load_config: Dict[str, Any]):
+            with RedirectStdStreamsToLogger(logger):
+                return SharedLlamaCpp(**load_config)
+        self._load_llm(SharedLlamaCpp, load_llm)
 
     def initialize_agent(
         self,
@@ -47,7 +191,7 @@ class MistralInstruct(Model):
             tools=tools_renderer(list(tools)),
             tool_names=", ".join([t.name for t in tools]),
         )
-        llm_with_stop = self._llm.bind(stop=["Observation"])
+        llm_with_stop = self._bind_call_settings(self._llm.bind(stop=["Observation"]))
 
         memory = None
         if chat_history:
@@ -57,20 +201,21 @@ class MistralInstruct(Model):
 
         agent = (
             RunnablePassthrough.assign(
-                agent_scratchpad=lambda x: format_log_to_str(x["intermediate_steps"]),
+                agent_scratchpad=lambda x: format_log_to_str(self._fit_scratchpad(x["intermediate_steps"])),
             )
             | prompt
             | llm_with_stop
             | MistralJsonOutputParser(self)
         )
 
-        self._agent_executor = AgentExecutor(
+        self._agent_executor = ParallelAgentExecutor(
             agent=agent,
             tools=tools,
             verbose=True,
             handle_parsing_errors=True,
             early_stopping_method="generate",
             memory=memory,
+            stream_runnable=self._stream_runnable,
         )
         
     def _create_system_prompt_template(self) -> str:
@@ -0,0 +1,41 @@
+from typing import Any, List, Optional
+import unittest
+from langchain_core.caches import InMemoryCache
+from langchain_core.outputs import Generation, LLMResult
+from alfred_ai_backend.models.llama_cpp_local.mistral_instruct.MistralInstruct import SharedLlamaCpp
+
+
+class CountingLlamaCpp(SharedLlamaCpp):
+    """Answers without a llama.cpp model and counts the calls that weren't cached"""
+    calls: int = 0
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        self.calls += 1
+        return LLMResult(generations=[[Generation(text=f"answer {self.calls}")] for _ in prompts])
+
+
+class TestSharedLlamaCpp(unittest.TestCase):
+    def setUp(self):
+        # Skips the validators, which would load the model
+        self.llm = CountingLlamaCpp.construct(model_path="model.gguf", client=None, cache=InMemoryCache())
+
+    def test_run_arguments_dont_split_the_cache(self):
+        first = self.llm.bind(temperature=0).invoke("prompt", config={'tags': ['a'], 'run_name': 'first', 'metadata': {'m': 1}})
+        second = self.llm.bind(temperature=0).invoke("prompt", config={'tags': ['b'], 'run_name': 'second'})
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.llm.calls, 1)
+        cache_keys = [llm_string for _, llm_string in self.llm.cache._cache]
+        self.assertEqual(len(cache_keys), 1)
+        for run_argument in ['tags', 'metadata', 'run_name', 'run_id']:
+            self.assertNotIn(f'"{run_argument}"', cache_keys[0])
+
+    def test_sampling_settings_split_the_cache(self):
+        self.llm.bind(temperature=0).invoke("prompt")
+        self.llm.bind(temperature=0.7).invoke("prompt")
+
+        self.assertEqual(self.llm.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,8 +7,11 @@ from langchain.memory import ConversationBufferWindowMemory
 import logging
 from alfred_ai_backend.core.utils.ToolConfig import ToolConfig
 from alfred_ai_backend.models.Model import Model
-from langchain_core.runnables import RunnableConfig
-from langchain.agents import create_openai_tools_agent
+from alfred_ai_backend.models.ParallelAgentExecutor import ParallelAgentExecutor
+from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+from langchain_core.runnables import RunnablePassthrough
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +21,6 @@ class ChatGpt(Model):
         
         try:
             from langchain_openai import ChatOpenAI
-            from langchain_community.callbacks import get_openai_callback
         except ImportError:
             raise ImportError(
                 "Could not import langchain_openai library. "
@@ -26,7 +28,7 @@ class ChatGpt(Model):
                 "use this embedding model: pip install langchain-openai"
             )
 
-        self._llm = ChatOpenAI(**self._tool_config.get_init_config())
+        self._load_llm(ChatOpenAI)
     
     def initialize_agent(
         self,
@@ -56,7 +58,18 @@ class ChatGpt(Model):
         if system_input_variables:
             prompt = prompt.partial(**system_input_variables)
 
-        agent = create_openai_tools_agent(self._llm, tools, prompt)
+        # This is langchain.agents.create_openai_tools_agent with the scratchpad kept in budget
+        llm_with_tools = self._bind_call_settings(self._llm).bind(tools=[convert_to_openai_tool(tool) for tool in tools])
+        agent = (
+            RunnablePassthrough.assign(
+                agent_scratchpad=lambda x: format_to_openai_tool_messages(
+                    self._fit_scratchpad(x["intermediate_steps"])
+                )
+            )
+            | prompt
+            | llm_with_tools
+            | OpenAIToolsAgentOutputParser()
+        )
 
         memory = None
         if chat_history:
@@ -68,25 +81,13 @@ class ChatGpt(Model):
                 output_key="output",
             )
         
-        self._agent_executor = AgentExecutor(
+        self._agent_executor = ParallelAgentExecutor(
             agent=agent,
             tools=tools,
             verbose=True,
             handle_parsing_errors=True,
             early_stopping_method="generate",
             memory=memory,
+            stream_runnable=self._stream_runnable,
         )
         return self._agent_executor
-
-
-    def invoke_agent_executor(self, input: Dict[str, Any], inference_config: Optional[RunnableConfig] = None, **kwargs: Any  ) -> Dict[str, Any]:
-        with get_openai_callback() as cb:
-            response = self._agent_executor.invoke(input, inference_config, **kwargs)
-
-            # TODO: need to figure out why these are always zero.
-            # Think it might be related to an issue: https://github.com/langchain-ai/langchain/issues/18212
-            logger.info(f"Total Tokens: {cb.total_tokens}")
-            logger.info(f"Prompt Tokens: {cb.prompt_tokens}")
-            logger.info(f"Completion Tokens: {cb.completion_tokens}")
-            logger.info(f"Total Cost (USD): ${cb.total_cost}")
-            return response
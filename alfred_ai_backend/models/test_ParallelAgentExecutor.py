@@ -0,0 +1,95 @@
+from typing import Any, List, Tuple, Union
+import threading
+import unittest
+import time
+from langchain.agents import BaseMultiActionAgent
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.tools import Tool
+from alfred_ai_backend.models.ParallelAgentExecutor import ParallelAgentExecutor
+
+TOOL_SECONDS = 0.2
+
+
+class ScriptedAgent(BaseMultiActionAgent):
+    """Asks for all the scripted actions in its first step, then finishes with their observations"""
+    actions: List[AgentAction]
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["input"]
+
+    def plan(self, intermediate_steps: List[Tuple[AgentAction, str]], callbacks: Any = None, **kwargs: Any) -> Union[List[AgentAction], AgentFinish]:
+        if not intermediate_steps:
+            return self.actions
+        return AgentFinish({"output": [observation for _, observation in intermediate_steps]}, "")
+
+    async def aplan(self, intermediate_steps: List[Tuple[AgentAction, str]], callbacks: Any = None, **kwargs: Any) -> Union[List[AgentAction], AgentFinish]:
+        return self.plan(intermediate_steps, callbacks, **kwargs)
+
+
+class TestParallelAgentExecutor(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.intervals = {}  # tool input -> start and end
+
+    def create_tool(self, name: str) -> Tool:
+        def run(tool_input: str) -> str:
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            start = time.perf_counter()
+            time.sleep(TOOL_SECONDS)
+            with self.lock:
+                self.running -= 1
+                self.intervals[tool_input] = (start, time.perf_counter())
+            return f"{name}:{tool_input}"
+        return Tool(name=name, func=run, description=name)
+
+    def run_actions(self, *actions: Tuple[str, str], parallel_tools: bool = True) -> List[str]:
+        agent = ScriptedAgent(actions=[AgentAction(tool, tool_input, "") for tool, tool_input in actions])
+        executor = ParallelAgentExecutor(
+            agent=agent,
+            tools=[self.create_tool(name) for name in ["read_file", "list_directory", "write_file"]],
+            parallel_tools=parallel_tools,
+            read_only_tools={"read_file", "list_directory"},
+            max_parallel_tools=4,
+        )
+        return executor.invoke({"input": "task"})["output"]
+
+    def test_reads_run_concurrently_and_writes_keep_their_order(self):
+        output = self.run_actions(
+            ("read_file", "r1"), ("list_directory", "r2"), ("read_file", "r3"),
+            ("write_file", "w1"),
+            ("read_file", "r4"), ("read_file", "r5"),
+        )
+
+        # Observations come back in the order the actions were asked for
+        self.assertEqual(output, [
+            "read_file:r1", "list_directory:r2", "read_file:r3", "write_file:w1", "read_file:r4", "read_file:r5",
+        ])
+        self.assertEqual(self.max_running, 3)
+        # The write waits for the reads before it, and the reads after it wait for the write
+        write_start, write_end = self.intervals["w1"]
+        for before in ["r1", "r2", "r3"]:
+            self.assertLessEqual(self.intervals[before][1], write_start)
+        for after in ["r4", "r5"]:
+            self.assertGreaterEqual(self.intervals[after][0], write_end)
+
+    def test_without_parallel_tools_runs_one_at_a_time(self):
+        output = self.run_actions(("read_file", "r1"), ("read_file", "r2"), parallel_tools=False)
+
+        self.assertEqual(output, ["read_file:r1", "read_file:r2"])
+        self.assertEqual(self.max_running, 1)
+
+    def test_unknown_tool_is_left_to_agent_executor(self):
+        output = self.run_actions(("read_file", "r1"), ("missing", "x"), ("read_file", "r2"))
+
+        self.assertEqual(output[0], "read_file:r1")
+        self.assertIn("missing is not a valid tool", output[1])
+        self.assertEqual(output[2], "read_file:r2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,38 @@
 import argparse
 import logging
-from typing import Optional
+from typing import Optional, Type, TYPE_CHECKING
 import importlib
+import asyncio
 #from alfred_ai_backend.core.agent import AgentWrapper
-from alfred_ai_backend.core.AgentManager import AgentManager
 from alfred_ai_backend.core.Config import Config
-from alfred_ai_backend.core.utils.StatusMessaging import get_colored_text
-from alfred_ai_backend.models.Model import Model
+from alfred_ai_backend.core.utils.console import get_colored_text
+from alfred_ai_backend.core.utils.log_writer import create_jsonl_handler, start_log_writer
+from concurrent.futures import Future
+import threading
+import time
+import sys
 import os
 
+# Langchain and the models are slow to import, so they're only imported when the agents are created
+if TYPE_CHECKING:
+    from alfred_ai_backend.core.AgentManager import AgentManager
+    from alfred_ai_backend.models.Model import Model
+
 logger = logging.getLogger(__name__)
+REPLAY_COMMAND = "/replay"
 
 def configure_logger(config: Config, debug_mode: bool, log_file: Optional[str]=None):
     """Configure the logging
 
+    The logs are written on a background thread, so the agents only queue them.
+
     Args:
         config (Config): The loaded configuration
         debug_mode (bool): Enable debug logging
         log_file (Optional[str], optional): The output log file. Defaults to None.
     """
-    logging.getLogger().handlers.clear()
     log_config = config.get("logging")
+    formatter = logging.Formatter(log_config.get('format','%(asctime)s - %(levelname)s - %(message)s'))
 
     handlers = []
     if log_config.get('verbose',False)==True:
@@ -28,16 +40,17 @@ def configure_logger(config: Config, debug_mode: bool, log_file: Optional[str]=N
     log_file = log_file if log_file else log_config['file']
     if log_file:
         handlers.append(logging.FileHandler(log_file, 'w', 'utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    jsonl_config = log_config.get('jsonl') or {}
+    if jsonl_config.get('enabled', False):
+        handlers.append(create_jsonl_handler(jsonl_config))
 
     if len(handlers)==0: return
 
-    logging.basicConfig(
-        level=getattr(logging, log_config['level']) if not debug_mode else logging.DEBUG,
-        format=log_config.get('format','%(asctime)s - %(levelname)s - %(message)s'),
-        handlers=handlers,
-    )
+    start_log_writer(handlers, getattr(logging, log_config['level']) if not debug_mode else logging.DEBUG)
 
-def get_model_type(config: Config, model: Optional[str] = 'default_model') -> Model:
+def get_model_type(config: Config, model: Optional[str] = 'default_model') -> Type["Model"]:
     """This dyanmically loads the LLM model to be used by the agent
 
     Args:
@@ -72,28 +85,200 @@ def get_model_type(config: Config, model: Optional[str] = 'default_model') -> Mo
     logger.info(f"Loaded model {module_name}")
     return getattr(module, class_name)
 
+def create_agent_manager(config: Config, model: str) -> "AgentManager":
+    """Imports the agents and the model and creates the agent manager
+
+    Args:
+        config (Config): The loaded configuration
+        model (str): The model to use
+
+    Returns:
+        AgentManager: The agent manager
+    """
+    from alfred_ai_backend.core.AgentManager import AgentManager
+    return AgentManager(get_model_type(config, model))
+
+def start_agent_manager(config: Config, model: str) -> Future:
+    """Creates the agent manager in the background so the prompt is usable right away
+
+    Args:
+        config (Config): The loaded configuration
+        model (str): The model to use
+
+    Returns:
+        Future: Resolves to the agent manager
+    """
+    future = Future()
+    def run():
+        try:
+            future.set_result(create_agent_manager(config, model))
+        except BaseException as e:
+            logger.error(f"Unable to start the agents. Error message: {e}")
+            future.set_exception(e)
+    threading.Thread(target=run, name="AgentManagerStartup", daemon=True).start()
+    return future
+
+def profile_startup(config: Config, model: str):
+    """Creates the agent manager and reports what its imports cost
+
+    Args:
+        config (Config): The loaded configuration
+        model (str): The model to use
+    """
+    from alfred_ai_backend.core.utils.ImportProfiler import ImportProfiler
+    start = time.perf_counter()
+    with ImportProfiler() as profiler:
+        create_agent_manager(config, model)
+    profiler.report(top=30, file=sys.stdout)
+    print(f"\nAgent manager created in {time.perf_counter() - start:0.2f} sec, {profiler.import_time:0.2f} sec of it importing modules")
+
+def run_batch(config: Config, model: str, batch_file: str, output_file: Optional[str], workers: Optional[int]):
+    """Runs a queue of tasks from JSONL across worker processes and writes their results as JSONL
+
+    Args:
+        config (Config): The loaded configuration
+        model (str): The model to use
+        batch_file (str): The tasks, or '-' to read them from stdin
+        output_file (Optional[str]): Where to write the results. Defaults to stdout.
+        workers (Optional[int]): The worker processes. Defaults to the config.
+    """
+    from alfred_ai_backend.core.BatchRunner import BatchRunner, read_tasks
+    batch_config = config.get('batch', {})
+    runner = BatchRunner(
+        get_model_type(config, model),
+        workers=workers or batch_config.get('workers', 2),
+        workspace_folder=batch_config.get('workspace_folder', '.alfred_batch/workspaces'),
+        copy_root_folder=batch_config.get('copy_root_folder', False),
+    )
+    tasks_stream = sys.stdin if batch_file == '-' else open(batch_file, 'r', encoding='utf-8')
+    output = open(output_file, 'w', encoding='utf-8') if output_file else sys.stdout
+    try:
+        summary = runner.run(read_tasks(tasks_stream), output)
+    finally:
+        if tasks_stream is not sys.stdin:
+            tasks_stream.close()
+        if output is not sys.stdout:
+            output.close()
+    # The results may be on stdout, so the summary goes to stderr
+    print(get_colored_text(
+        f"Ran {summary['tasks']} tasks, {summary['failed']} failed, in {summary['wall_seconds']:0.1f} sec. "
+        f"Used {summary['prompt_tokens']} prompt and {summary['completion_tokens']} completion tokens (${summary['cost_usd']:0.4f})", "blue"),
+        file=sys.stderr)
+
+def run_server(config: Config, model: str, host: Optional[str], port: Optional[int], sessions: Optional[int]):
+    """Serves tasks over HTTP and their events over WebSocket from a pool of warm sessions
+
+    Args:
+        config (Config): The loaded configuration
+        model (str): The model to use
+        host (Optional[str]): The interface to listen on. Defaults to the config.
+        port (Optional[int]): The port to listen on. Defaults to the config.
+        sessions (Optional[int]): The agent managers that run tasks at the same time. Defaults to the config.
+    """
+    from alfred_ai_backend.core.AgentServer import AgentServer
+    server_config = config.get('server', {})
+    server = AgentServer(
+        get_model_type(config, model),
+        sessions=sessions or server_config.get('sessions', 2),
+        workspace_folder=server_config.get('workspace_folder', '.alfred_server/workspaces'),
+        copy_root_folder=server_config.get('copy_root_folder', False),
+        max_queued_tasks=server_config.get('max_queued_tasks', 100),
+        max_finished_tasks=server_config.get('max_finished_tasks', 1000),
+    )
+    server.run(host=host or server_config.get('host', '127.0.0.1'), port=port or server_config.get('port', 8080))
+
+def run_task(agent_manager: "AgentManager", user_input: str, async_mode: bool):
+    """Runs a task and prints its response and usage
+
+    Args:
+        agent_manager (AgentManager): The agent manager
+        user_input (str): The task, or REPLAY_COMMAND to run the last task again from the
+            conversation it started from
+        async_mode (bool): Run the agents on asyncio
+    """
+    if user_input.strip() == REPLAY_COMMAND:
+        try:
+            if async_mode:
+                resp = asyncio.run(agent_manager.areplay_last_task())
+            else:
+                resp = agent_manager.replay_last_task()
+        except ValueError as e:
+            print(get_colored_text(str(e), "blue"))
+            return
+    elif async_mode:
+        resp = asyncio.run(agent_manager.astart_task(user_input))
+    else:
+        resp = agent_manager.start_task(user_input)
+    logger.info(f"Response: {resp}")
+    colored_text = get_colored_text(resp.get('output', ' [[no response]]'))
+    print(colored_text)
+    if resp.get('usage'):
+        total = resp['usage']['total']
+        print(get_colored_text(
+            f"Used {total['prompt_tokens']} prompt and {total['completion_tokens']} completion tokens "
+            f"in {total['llm_calls']} LLM calls (${total['cost_usd']:0.4f})", "blue"))
+    if resp.get('trace_file'):
+        print(get_colored_text(f"Trace written to {resp['trace_file']}", "blue"))
+
 def main():
     parser = argparse.ArgumentParser(
         description="Alfred.ai",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
 
-    parser.add_argument("-t", "--task", type=str, help="The task to do")
+    parser.add_argument("-t", "--task", type=str, help="The task to do, then exit instead of prompting for tasks")
+    parser.add_argument("-b", "--batch", type=str, help="Run the tasks of a JSONL file, one {\"id\": ..., \"task\": ...} per line, or '-' for stdin")
+    parser.add_argument("-o", "--output", type=str, help="Where to write the JSONL results of --batch. Defaults to stdout")
+    parser.add_argument("-w", "--workers", type=int, help="The worker processes of --batch. Defaults to the config")
     parser.add_argument("-l", "--log_file", type=str, help="The output log file")
     parser.add_argument("-d", "--debug", action='store_true', help='Enable debug logging')
     parser.add_argument("-m", "--model", type=str, help="The model to use", default='default_model')
+    parser.add_argument("--serve", action='store_true', help="Serve tasks over HTTP and their events over WebSocket instead of prompting for tasks")
+    parser.add_argument("--host", type=str, help="The interface --serve listens on. Defaults to the config")
+    parser.add_argument("--port", type=int, help="The port --serve listens on. Defaults to the config")
+    parser.add_argument("--sessions", type=int, help="The warm sessions of --serve that run tasks at the same time. Defaults to the config")
+    parser.add_argument("-a", "--async_mode", action='store_true', help="Run the agents on asyncio so tools called together run concurrently")
+    parser.add_argument("-s", "--stream", action='store_true', help="Print the LLM's tokens as they arrive")
+    parser.add_argument("--trace", action='store_true', help="Write a trace of each task's agents, steps, LLM calls and tool calls")
+    parser.add_argument("--profile-startup", action='store_true', help="Report the import time of each module when starting the agents and exit")
     args = parser.parse_args()
 
     config = Config()
     configure_logger(config, args.debug, args.log_file)
+    if args.stream:
+        config.set('streaming', {**config.get('streaming', {}), 'enabled': True})
+    if args.trace:
+        config.set('tracing', {**(config.get('tracing') or {}), 'enabled': True})
 
     logger.info(f"Starting Alfred.ai")
     os.environ["WANDB_PROJECT"] = "langchain_alfred"
-    model_type = get_model_type(config, args.model)
-    agent_manager = AgentManager(model_type)
+    if args.profile_startup:
+        profile_startup(config, args.model)
+        return
+    if args.serve:
+        run_server(config, args.model, args.host, args.port, args.sessions)
+        logger.info(f"Shutting down")
+        return
+    if args.batch:
+        run_batch(config, args.model, args.batch, args.output, args.workers)
+        logger.info(f"Shutting down")
+        return
+
+    # The agents are created while the user types the first task
+    start = time.perf_counter()
+    agent_manager_future = start_agent_manager(config, args.model)
 
-    if not args.task:
+    if args.task:
+        try:
+            run_task(agent_manager_future.result(), args.task, args.async_mode)
+        except KeyboardInterrupt:
+            print(" *** ctrl+c was pressed ***")
+    else:
+        if config.get('models', {}).get(args.model, {}).get('load_before_prompt', False):
+            # The model writes to the console while it loads, which would mix with the prompt
+            agent_manager_future.result()
         print(get_colored_text("Hello, give me a task to do..."))
+        logger.info(f"Prompt ready in {time.perf_counter() - start:0.2f} sec")
         try:
             while True:
                 user_input = input(get_colored_text(">>> ", "green"))
@@ -102,10 +287,9 @@ def main():
                     break
 
                 if len(user_input)>0:
-                    resp = agent_manager.start_task(user_input)
-                    logger.info(f"Response: {resp}")
-                    colored_text = get_colored_text(resp.get('output', ' [[no response]]'))
-                    print(colored_text)
+                    if not agent_manager_future.done():
+                        print(get_colored_text("Still starting the agents...", "blue"))
+                    run_task(agent_manager_future.result(), user_input, args.async_mode)
         except KeyboardInterrupt:
             print(" *** ctrl+c was pressed ***")
 